@@ -0,0 +1,7 @@
+""" Benchmarks for the store API.
+
+    These aren't collected with the tests, run them explicitly
+    with -s to see the results, e.g.
+
+        pytest benchmarks/bench_pagination.py -s
+"""
@@ -0,0 +1,134 @@
+""" Latency of a user's order history and size of the orders' indexes
+    on ORDERS orders over MONTHS months, with two lines each, on
+    postgres: as they are, and with the orders older than
+    ARCHIVE_AFTER months archived, see store.archive.
+
+        pytest benchmarks/bench_archive.py -s
+
+    The history is read as the view reads it, the first page and a
+    page from a year back, with its lines, and a single order. The
+    archived orders are deleted and vacuumed, which leaves their
+    space in the tables and indexes to be reused by new orders
+    rather than giving it back, so it's committed as it goes.
+"""
+# General
+from datetime import timedelta
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+# Opply
+from benchmarks.timing import measure, report, summary
+from store import archive
+from store.models import Order, OrderProducts, Product, SalesCatchUp
+from store.serializers import OrderRowSerializer
+
+ORDERS = 2_000_000
+USERS = 10_000
+PRODUCTS = 100
+MONTHS = 24
+ARCHIVE_AFTER = 12
+PAGE = 20
+
+pytestmark = pytest.mark.skipif(connection.vendor != 'postgresql',
+                                reason='Measures the indexes on postgres')
+
+
+@pytest.fixture
+def orders():
+    User.objects.bulk_create([User(username=f'bench_user_{i}')
+                              for i in range(USERS)], batch_size=5000)
+    first_user = User.objects.order_by('id').first().id
+    Product.objects.bulk_create([Product(name=f'Product {i}', price=i,
+                                         quantity_in_stock=100)
+                                 for i in range(PRODUCTS)])
+    first_product = Product.objects.order_by('id').first().id
+    now = timezone.now()
+    span = timedelta(days=MONTHS * 365 / 12)
+    with connection.cursor() as cursor:
+        # Oldest first, spread evenly over MONTHS months
+        cursor.execute('INSERT INTO store_order (user_id, datetime, status) '
+                       'SELECT %s + i %% %s, %s - %s * (%s - i), '
+                       "'confirmed' FROM generate_series(1, %s) i",
+                       [first_user, USERS, now, span / ORDERS, ORDERS,
+                        ORDERS])
+        cursor.execute('INSERT INTO store_orderproducts '
+                       '(order_id, product_id, quantity) '
+                       'SELECT id, %s + (id + k) %% %s, 1 + k '
+                       'FROM store_order, generate_series(0, 1) k',
+                       [first_product, PRODUCTS])
+        # Without what earlier runs left behind
+        cursor.execute('REINDEX TABLE store_order')
+        cursor.execute('REINDEX TABLE store_orderproducts')
+        cursor.execute('ANALYZE store_order')
+        cursor.execute('ANALYZE store_orderproducts')
+    # As though the sales were counted, see sales.catch_up
+    SalesCatchUp.objects.update_or_create(
+        pk=1, defaults={'last_id': OrderProducts.objects.aggregate(
+            last=Max('id'))['last']})
+    return User.objects.get(id=first_user + USERS // 2)
+
+
+def index_size(table):
+    """ The size of the indexes of table, in MB.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_indexes_size(%s::regclass)', [table])
+        return float(cursor.fetchone()[0]) / 2 ** 20
+
+
+def run(user):
+    rows = OrderRowSerializer()
+    history = Order.objects.filter(user=user).order_by('-datetime', '-id')
+    year_ago = timezone.now() - timedelta(days=365)
+    newest = history.first()
+    pages = {
+        'first page': history,
+        'a year back': history.filter(datetime__lt=year_ago),
+        'one order': history.filter(id=newest.id),
+    }
+    results = {}
+    for name, queryset in pages.items():
+        # Warm up
+        measure(lambda: rows.many(rows.values(queryset.all())[:PAGE]), 5)
+        latencies = measure(
+            lambda: rows.many(rows.values(queryset.all())[:PAGE]), 50)
+        results[name] = summary(latencies)['p50_ms']
+    return {**{f'{name}_ms': ms for name, ms in results.items()},
+            'orders_MB': index_size('store_order'),
+            'lines_MB': index_size('store_orderproducts')}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_archive(orders):
+    user = orders
+    stages = [('one table', run(user))]
+
+    before = timezone.now() - timedelta(days=ARCHIVE_AFTER * 365 / 12)
+    latencies = measure(lambda: archive.archive(before), repeat=1)
+    archived = archive.ArchivedOrder.objects.count()
+    with connection.cursor() as cursor:
+        cursor.execute('VACUUM ANALYZE store_order')
+        cursor.execute('VACUUM ANALYZE store_orderproducts')
+    stages.append(('archived', run(user)))
+
+    live = Order.objects.filter(user=user).values_list('id', flat=True)[0]
+    archived_id = (archive.ArchivedOrder.objects.filter(user=user)
+                                                .values_list('id', flat=True)[0])
+    report(f'A user\'s order history, {ORDERS} orders over {MONTHS} '
+           f'months, index sizes in MB', stages)
+    report(f'Archiving orders older than {ARCHIVE_AFTER} months', [
+        ('archive', {'orders': archived,
+                     'orders_per_s': archived / latencies[0] * 1000}),
+    ])
+    report('Retrieving an order, p50', [
+        ('live', {'ms': summary(measure(
+            lambda: Order.objects.filter(user=user).with_product_ids()
+                                 .get(id=live), 50))['p50_ms']}),
+        ('archived', {'ms': summary(measure(
+            lambda: archive.find(user, archived_id), 50))['p50_ms']}),
+    ])
+
+    assert archived
@@ -0,0 +1,150 @@
+""" Requests per second and memory serving products and orders
+    under WSGI, with the DRF views, and under ASGI, with the
+    async views, at high concurrency.
+
+        pytest benchmarks/bench_asgi.py -s
+
+    Both handlers are driven in process, so no server is needed:
+    WSGI by CONCURRENCY threads, as a threaded server would, ASGI
+    by CONCURRENCY coroutines on one event loop. Peak memory is
+    the peak traced by tracemalloc over a second, traced, run.
+
+    Note: In Django 4.1 the async ORM runs the queries in a
+          thread, so the async views save the thread per request,
+          not the database round trips.
+"""
+# General
+import asyncio
+import threading
+import time
+import tracemalloc
+from io import BytesIO
+import pytest
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection, connections
+from django.urls import include, path
+from rest_authtoken.models import AuthToken
+from base64 import urlsafe_b64encode
+
+# Opply
+from benchmarks.timing import report
+from store.models import Product, Order, OrderProducts
+from store.urls import async_urlpatterns
+
+CONCURRENCY = 50
+REQUESTS_PER_CLIENT = 4
+PATHS = ['/store/products?page_size=20', '/store/products/1',
+         '/store/orders?page_size=20', '/store/orders/1']
+
+# The async views, for the ASGI runs, see ROOT_URLCONF below.
+urlpatterns = [path('store/', include(async_urlpatterns))]
+
+
+def run_wsgi(authorization, path):
+    handler = WSGIHandler()
+    barrier = threading.Barrier(CONCURRENCY + 1)
+
+    def client():
+        barrier.wait()
+        try:
+            for _ in range(REQUESTS_PER_CLIENT):
+                environ = {
+                    'REQUEST_METHOD': 'GET',
+                    'PATH_INFO': path.split('?')[0],
+                    'QUERY_STRING': path.partition('?')[2],
+                    'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+                    'HTTP_AUTHORIZATION': authorization,
+                    'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http',
+                }
+                statuses = []
+                b''.join(handler(environ, lambda s, h: statuses.append(s)))
+                assert statuses == ['200 OK']
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(CONCURRENCY)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def run_asgi(authorization, path):
+    handler = ASGIHandler()
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path.split('?')[0],
+        'query_string': path.partition('?')[2].encode(),
+        'headers': [(b'authorization', authorization.encode()),
+                    (b'host', b'testserver')],
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 1),
+    }
+
+    async def client():
+        for _ in range(REQUESTS_PER_CLIENT):
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b''}
+
+            async def send(message):
+                messages.append(message)
+
+            await handler(dict(scope), receive, send)
+            assert messages[0]['status'] == 200
+
+    async def main():
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(CONCURRENCY)))
+        return time.perf_counter() - start
+
+    try:
+        return asyncio.run(main())
+    finally:
+        connections.close_all()
+
+
+def traced(run, *args):
+    tracemalloc.start()
+    try:
+        run(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_asgi(settings):
+    settings.DEBUG = False
+    user = User.objects.create_user(username='bench_user')
+    authorization = 'Token ' + urlsafe_b64encode(
+        AuthToken.create_token_for_user(user)).decode()
+    products = Product.objects.bulk_create(
+        [Product(name=f'Product {i}', price=i, quantity_in_stock=100)
+         for i in range(1, 101)])
+    for _ in range(100):
+        order = Order.objects.create(user=user)
+        OrderProducts.objects.bulk_create(
+            [OrderProducts(order=order, product=product, quantity=2)
+             for product in products[:5]])
+    paths = [p.replace('/1', f'/{pk}') for p, pk in
+             zip(PATHS, [None, products[0].id, None, order.id])]
+
+    rows = []
+    for name, run, urlconf in (('wsgi', run_wsgi, 'opply.urls'),
+                               ('asgi', run_asgi, 'benchmarks.bench_asgi')):
+        settings.ROOT_URLCONF = urlconf
+        for path in paths:
+            elapsed = run(authorization, path)
+            peak = traced(run, authorization, path)
+            rows.append((f'{name} {path.split("?")[0]}', {
+                'req/s': CONCURRENCY * REQUESTS_PER_CLIENT / elapsed,
+                'peak MiB': peak / 2 ** 20,
+            }))
+    report(f'{CONCURRENCY} concurrent clients, {REQUESTS_PER_CLIENT} '
+           f'requests each', rows)
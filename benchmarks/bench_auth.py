@@ -0,0 +1,60 @@
+""" Queries and latency per request, polling the order history
+    and a product, authenticated by token with and without the
+    token cache.
+
+        pytest benchmarks/bench_auth.py -s
+"""
+# General
+import json
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_authtoken.auth import AuthTokenAuthentication
+from rest_framework.test import APIClient
+
+# Opply
+from benchmarks.timing import measure, report, summary
+from store.authentication import CachingAuthTokenAuthentication, tokens
+from store.models import Order, Product
+from store.views import OrderViewSet, ProductViewSet
+
+
+@pytest.fixture
+def client():
+    user = User.objects.create_user(username='bench_user',
+                                    password='bench_password')
+    Order.objects.bulk_create([Order(user=user) for _ in range(10)])
+    Product.objects.create(name='Product', price=1, quantity_in_stock=1)
+
+    client = APIClient()
+    r = client.post('/auth/login/', content_type='application/json',
+                    data=json.dumps({'username': 'bench_user',
+                                     'password': 'bench_password'}))
+    client.credentials(HTTP_AUTHORIZATION=f'Token {r.json()["token"]}')
+    return client
+
+
+@pytest.mark.django_db
+def test_auth(client, monkeypatch):
+    product = Product.objects.get()
+    urls = {'orders': '/store/orders',
+            'product': f'/store/products/{product.id}'}
+
+    rows = []
+    for name, authentication in (('db', AuthTokenAuthentication),
+                                 ('cached', CachingAuthTokenAuthentication)):
+        for view in (OrderViewSet, ProductViewSet):
+            monkeypatch.setattr(view, 'authentication_classes',
+                                (authentication, ))
+        tokens.reset()
+        for page, url in urls.items():
+            client.get(url)
+            with CaptureQueriesContext(connection) as ctx:
+                assert client.get(url).status_code == 200
+            rows.append((f'{page} {name}', {
+                'queries': len(ctx.captured_queries),
+                **summary(measure(lambda: client.get(url), repeat=200)),
+            }))
+    report('Queries and latency per request, token auth', rows)
+    print(tokens.snapshot())
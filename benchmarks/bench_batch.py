@@ -0,0 +1,69 @@
+""" Orders per second placed one request each and in batches
+    through /store/orders/batch, by token, as an integration
+    pushing orders in bulk would.
+
+        pytest benchmarks/bench_batch.py -s
+"""
+# General
+import json
+import time
+import pytest
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+# Opply
+from benchmarks.timing import report
+from store.models import Order, Product
+
+ORDERS = 500
+BATCH_SIZES = (10, 100, 500)
+PRODUCTS = 50
+
+
+@pytest.fixture
+def client():
+    User.objects.create_user(username='bench_user',
+                             password='bench_password')
+    Product.objects.bulk_create([
+        Product(name=f'Product {i}', price=1, quantity_in_stock=1_000_000)
+        for i in range(PRODUCTS)])
+    client = APIClient()
+    r = client.post('/auth/login/', content_type='application/json',
+                    data=json.dumps({'username': 'bench_user',
+                                     'password': 'bench_password'}))
+    client.credentials(HTTP_AUTHORIZATION=f'Token {r.json()["token"]}')
+    return client
+
+
+@pytest.mark.django_db
+def test_batch(client):
+    product_ids = list(Product.objects.values_list('id', flat=True))
+    orders = [{'products': [{'product': product_ids[(i + j) % PRODUCTS],
+                             'quantity': 1 + j} for j in range(3)]}
+              for i in range(ORDERS)]
+
+    def run(name, fn):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        return name, {'orders_per_second': ORDERS / elapsed,
+                      'seconds': elapsed}
+
+    def one_by_one():
+        for order in orders:
+            r = client.post('/store/orders', format='json', data=order)
+            assert r.status_code == 201
+
+    def batched(size):
+        def place():
+            for i in range(0, ORDERS, size):
+                r = client.post('/store/orders/batch', format='json',
+                                data={'orders': orders[i:i + size]})
+                assert r.status_code == 201
+        return place
+
+    rows = [run('one per request', one_by_one)]
+    rows += [run(f'batches of {size}', batched(size))
+             for size in BATCH_SIZES]
+    assert Order.objects.count() == ORDERS * (1 + len(BATCH_SIZES))
+    report(f'Placing {ORDERS} orders of 3 lines', rows)
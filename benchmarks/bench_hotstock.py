@@ -0,0 +1,83 @@
+""" Orders per second against a single hot product, placed through
+    orders.place, selling from the product row and from a lease of
+    hot stock.
+
+        pytest benchmarks/bench_hotstock.py -s
+
+    As in bench_sharding, each order's transaction is held open for
+    HOLD seconds after it's placed, standing in for the rest of the
+    request, with whatever rows it locked still locked.
+"""
+# General
+import pytest
+import threading
+import time
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+# Opply
+from benchmarks.timing import report
+from store import orders, stock
+from store.hotstock import hot_stock
+from store.models import Product
+
+THREADS = 16
+ORDERS_PER_THREAD = 25
+HOLD = 0.005
+STOCK = 1_000_000
+
+
+def place_orders(user, product):
+    """ Place orders for the product from THREADS threads at
+        once, returns orders per second.
+    """
+    barrier = threading.Barrier(THREADS + 1)
+
+    def buy():
+        barrier.wait()
+        try:
+            for _ in range(ORDERS_PER_THREAD):
+                with transaction.atomic():
+                    orders.place(user, {product.id: 1})
+                    time.sleep(HOLD)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=buy) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return THREADS * ORDERS_PER_THREAD / (time.perf_counter() - start)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_hot_stock(settings):
+    settings.HOT_STOCK_FLUSH_INTERVAL = None
+    settings.HOT_STOCK_LEASE_UNITS = 2 * THREADS * ORDERS_PER_THREAD
+    user = User.objects.create_user(username='bench_user')
+
+    rows = []
+    for hot in (False, True):
+        settings.HOT_STOCK = hot
+        product = Product.objects.create(name=f'Hot {hot}', price=1,
+                                         quantity_in_stock=STOCK, hot=hot)
+        hot_stock.reset()
+        hot_stock.cycle()
+        stock.stats.reset()
+        rate = place_orders(user, product)
+        stats = stock.stats.snapshot()
+        hot_stock.flush()
+
+        orders_placed = THREADS * ORDERS_PER_THREAD
+        assert Product.objects.with_stock().get(id=product.id).stock == \
+            STOCK - orders_placed
+        rows.append(('hot stock' if hot else 'product row', {
+            'orders/s': rate,
+            'row reservations': stats['reservations'],
+            'mean wait ms': stats['mean_lock_wait_seconds'] * 1000,
+        }))
+    report(f'Orders for one product through orders.place, {THREADS} '
+           f'threads, transactions held {HOLD * 1000:.0f}ms', rows)
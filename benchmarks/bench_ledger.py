@@ -0,0 +1,86 @@
+""" Working out the stock of products from the ledger, see
+    store.ledger, with MOVEMENTS movements over PRODUCTS products,
+    on postgres: from all of their movements, then from their
+    snapshots and the movements since, and checking the whole
+    catalogue against the ledger, CHUNK products at a time.
+
+        pytest benchmarks/bench_ledger.py -s
+"""
+# General
+import pytest
+from django.db import connection
+
+# Opply
+from benchmarks.timing import measure, report, summary
+from store import ledger
+from store.models import Product, StockMovement
+
+PRODUCTS = 10_000
+MOVEMENTS = 2_000_000
+SINCE = 10
+CHUNK = 1000
+BALANCES = 20
+
+pytestmark = pytest.mark.skipif(connection.vendor != 'postgresql',
+                                reason='Movements are generated with '
+                                       'generate_series')
+
+
+@pytest.fixture
+def movements(settings):
+    settings.STOCK_SNAPSHOT_MARGIN = 0
+    Product.objects.bulk_create([Product(name=f'Product {i}', price=1,
+                                         quantity_in_stock=0)
+                                 for i in range(PRODUCTS)], batch_size=5000)
+    first = Product.objects.order_by('id').first().id
+    with connection.cursor() as cursor:
+        # A restock of each product, then sales of one unit, which
+        # leave it with MOVEMENTS / PRODUCTS units
+        cursor.execute("INSERT INTO store_stockmovement "
+                       "(product_id, kind, quantity, created) "
+                       "SELECT %s + i %% %s, "
+                       "CASE WHEN i < %s THEN 'restock' ELSE 'sale' END, "
+                       "CASE WHEN i < %s THEN %s ELSE -1 END, now() "
+                       "FROM generate_series(0, %s - 1) i",
+                       [first, PRODUCTS, PRODUCTS, PRODUCTS,
+                        2 * MOVEMENTS // PRODUCTS, MOVEMENTS])
+        cursor.execute('UPDATE store_product SET quantity_in_stock = %s',
+                       [MOVEMENTS // PRODUCTS + 1])
+        cursor.execute('ANALYZE store_stockmovement')
+    return list(range(first, first + PRODUCTS, PRODUCTS // BALANCES))
+
+
+def run(product_ids):
+    latencies = measure(lambda: ledger.balances(product_ids), 20)
+    reconciled = measure(lambda: list(ledger.reconcile(CHUNK)), 1)[0]
+    return {'balances_ms': summary(latencies)['p50_ms'],
+            'reconcile_ms': reconciled,
+            'products_per_s': PRODUCTS / reconciled * 1000}
+
+
+@pytest.mark.django_db
+def test_ledger(movements):
+    product_ids = movements
+    stages = [('movements', run(product_ids))]
+
+    snapshotted = measure(ledger.snapshot, 1)[0]
+    # Recent sales, since the snapshots
+    StockMovement.objects.bulk_create(
+        [StockMovement(product_id=product_id, kind=StockMovement.SALE,
+                       quantity=-1)
+         for product_id in Product.objects.values_list('id', flat=True)
+         for _ in range(SINCE)])
+    Product.objects.update(quantity_in_stock=MOVEMENTS // PRODUCTS + 1
+                           - SINCE)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE store_stockmovement')
+        cursor.execute('ANALYZE store_stocksnapshot')
+    stages.append(('snapshot', run(product_ids)))
+
+    report(f'Stock of {BALANCES} products, and the whole catalogue '
+           f'reconciled, {MOVEMENTS} movements over {PRODUCTS} products',
+           stages)
+    report('Snapshotting', [('snapshot', {'ms': snapshotted})])
+
+    drifted = sum(len(chunk) for checked, chunk in ledger.reconcile(CHUNK))
+    assert drifted == 0
@@ -0,0 +1,66 @@
+""" Latency per request with and without the performance
+    middleware, sampling none, a tenth and all of the requests.
+
+        pytest benchmarks/bench_metrics.py -s
+"""
+# General
+import pytest
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+# Opply
+from benchmarks.timing import measure, report, summary
+from store.models import Order, OrderProducts, Product
+
+MIDDLEWARE = 'store.middleware.PerformanceMiddleware'
+REPEAT = 1000
+SAMPLE_RATES = {'off': None, 'sample 0': 0, 'sample 0.1': 0.1, 'sample 1': 1}
+
+
+@pytest.fixture
+def client():
+    user = User.objects.create_user(username='bench_user')
+    product = Product.objects.create(name='Product', price=1,
+                                     quantity_in_stock=1)
+    orders = Order.objects.bulk_create([Order(user=user) for _ in range(20)])
+    OrderProducts.objects.bulk_create([
+        OrderProducts(order=order, product=product, quantity=2)
+        for order in orders])
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+@pytest.mark.django_db
+def test_metrics(client, settings):
+    product = Product.objects.get()
+    urls = {'orders': '/store/orders?page_size=20',
+            'product': f'/store/products/{product.id}'}
+    middleware = list(settings.MIDDLEWARE)
+
+    def configure(sample_rate):
+        if sample_rate is None:
+            settings.MIDDLEWARE = [m for m in middleware if m != MIDDLEWARE]
+        else:
+            settings.MIDDLEWARE = middleware
+            settings.PERF_SAMPLE_RATE = sample_rate
+        client.handler.load_middleware()
+
+    rows = []
+    for page, url in urls.items():
+        # Warm up every path first, so the first isn't slower
+        for sample_rate in SAMPLE_RATES.values():
+            configure(sample_rate)
+            measure(lambda: client.get(url), repeat=REPEAT // 5)
+        baseline = None
+        for name, sample_rate in SAMPLE_RATES.items():
+            configure(sample_rate)
+            latencies = measure(lambda: client.get(url), repeat=REPEAT)
+            mean = sum(latencies) / len(latencies)
+            baseline = baseline or mean
+            rows.append((f'{page} {name}', {
+                **summary(latencies),
+                'mean_ms': mean,
+                'overhead_%': (mean - baseline) / baseline * 100,
+            }))
+    report('Latency per request, performance middleware', rows)
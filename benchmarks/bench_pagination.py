@@ -0,0 +1,69 @@
+""" Page 1 versus page 10,000 of the order history and the
+    product catalogue, with page number and keyset pagination.
+
+        pytest benchmarks/bench_pagination.py -s
+"""
+# General
+import pytest
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+# Opply
+from benchmarks.timing import measure, report, summary
+from store.models import Order, Product
+from store.pagination import KeysetPagination
+
+PAGE_SIZE = 2
+DEEP_PAGE = 10_000
+ROWS = PAGE_SIZE * DEEP_PAGE
+
+
+@pytest.fixture
+def client():
+    user = User.objects.create_user(username='bench_user',
+                                    password='bench_password')
+    now = timezone.now()
+    Order.objects.bulk_create(
+        [Order(user=user, datetime=now - timedelta(minutes=i))
+         for i in range(ROWS)], batch_size=5000)
+    Product.objects.bulk_create(
+        [Product(name=f'Product {i}', price=1, quantity_in_stock=1)
+         for i in range(ROWS)], batch_size=5000)
+
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def deep_cursor(queryset, ordering):
+    """ The cursor for page DEEP_PAGE, i.e. the position of
+        the last row of the page before it.
+    """
+    paginator = KeysetPagination(ordering)
+    row = queryset.order_by(*ordering)[ROWS - PAGE_SIZE - 1]
+    return paginator.encode_cursor(paginator.position(row))
+
+
+@pytest.mark.django_db
+def test_pagination(client):
+    orders_cursor = deep_cursor(Order.objects.all(), ('-datetime', '-id'))
+    products_cursor = deep_cursor(Product.objects.all(), ('id', ))
+
+    urls = {
+        'orders page 1': '/store/orders',
+        'orders page 10000': f'/store/orders?page={DEEP_PAGE}',
+        'orders cursor 1': '/store/orders?pagination=cursor',
+        'orders cursor 10000': f'/store/orders?cursor={orders_cursor}',
+        'products page 1': '/store/products',
+        'products page 10000': f'/store/products?page={DEEP_PAGE}',
+        'products cursor 1': '/store/products?pagination=cursor',
+        'products cursor 10000': f'/store/products?cursor={products_cursor}',
+    }
+
+    rows = []
+    for name, url in urls.items():
+        assert len(client.get(url).json()['results']) == PAGE_SIZE
+        rows.append((name, summary(measure(lambda: client.get(url)))))
+    report(f'Pagination latency, {ROWS} rows, page size {PAGE_SIZE}', rows)
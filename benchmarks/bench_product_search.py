@@ -0,0 +1,100 @@
+""" Query plans and latencies of the product filters, see
+    ProductQuerySet.search, on a catalogue of PRODUCTS products:
+    a page of the list, ordered by id, as the view reads it.
+
+        pytest benchmarks/bench_product_search.py -s
+
+    On postgres each filter has to be served by its index rather
+    than a scan of the whole catalogue, the name substring search
+    only where the pg_trgm extension is available.
+"""
+# General
+import re
+from importlib import import_module
+import pytest
+from django.db import connection
+
+# Opply
+from benchmarks.timing import measure, report, summary
+from store.models import Product
+
+PRODUCTS = 200_000
+PAGE = 20
+WORDS = ('oak', 'pine', 'steel', 'glass', 'linen', 'velvet', 'walnut',
+         'brass', 'marble', 'rattan')
+KINDS = ('chair', 'table', 'lamp', 'desk', 'sofa', 'shelf', 'stool',
+         'mirror', 'rug', 'bench')
+
+# Filter, and the index it's expected to use on postgres
+FILTERS = {
+    'name prefix': ({'name': 'walnut table 19'}, 'product_name_prefix'),
+    'name substring': ({'search': 'table 1991'}, 'product_name_trigram'),
+    'price range': ({'min_price': '10.00', 'max_price': '10.40'},
+                    'product_price'),
+    'in stock': ({'in_stock': True}, 'product_in_stock'),
+    'ids': ({'ids': list(range(1000, 200_000, 2000))},
+            'store_product_pkey'),
+}
+
+
+@pytest.fixture
+def catalogue():
+    # Most products are out of stock, one in 50 is in stock
+    Product.objects.bulk_create(
+        [Product(name=f'{WORDS[i % 10]} {KINDS[i // 10 % 10]} {i}',
+                 price=f'{i % 100_000 / 100:.2f}',
+                 quantity_in_stock=0 if i % 50 else 5)
+         for i in range(PRODUCTS)], batch_size=10_000)
+    # Tests build their database without migrations, so without the
+    # name indexes only migration 0014 adds
+    if connection.vendor == 'postgresql':
+        migration = import_module('store.migrations.0014_product_search')
+        with connection.schema_editor() as schema_editor:
+            migration.remove_name_indexes(None, schema_editor)
+            migration.add_name_indexes(None, schema_editor)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE store_product')
+
+
+def indexes(queryset):
+    plan = queryset.explain()
+    names = re.findall(r'(?:Index|Index Only) Scan(?: Backward)? using '
+                       r'(\w+)|Bitmap Index Scan on (\w+)|'
+                       r'USING (?:COVERING )?INDEX (\w+)', plan)
+    used = {name for match in names for name in match if name}
+    if 'USING INTEGER PRIMARY KEY' in plan:
+        # sqlite's rowid
+        used.add('pkey')
+    return used, plan
+
+
+@pytest.mark.django_db
+def test_product_search(catalogue):
+    first = Product.objects.order_by('id').first().id
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT 1 FROM pg_indexes "
+                           "WHERE indexname = 'product_name_trigram'")
+            trigrams = cursor.fetchone() is not None
+        else:
+            trigrams = False
+
+    rows = []
+    for name, (filters, expected) in FILTERS.items():
+        if 'ids' in filters:
+            filters = {'ids': [first + pk for pk in filters['ids']]}
+        queryset = (Product.objects.order_by('id').with_stock()
+                                   .search(**filters)[:PAGE])
+        used, plan = indexes(queryset)
+        found = len(list(queryset.all()))
+        latencies = measure(lambda: list(queryset.all()), repeat=20)
+        index = ','.join(sorted(re.sub(r'^(store_)?product_', '', index)
+                                for index in used))
+        rows.append((name, {**summary(latencies), 'rows': found,
+                            'index': index or 'scan'}))
+
+        if connection.vendor == 'postgresql' and (
+                expected != 'product_name_trigram' or trigrams):
+            assert expected in used, plan
+    report(f'A page of {PAGE} of {PRODUCTS} products, {connection.vendor}',
+           rows)
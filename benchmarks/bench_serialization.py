@@ -0,0 +1,85 @@
+""" Objects serialized a second by the DRF serializers and by the
+    row serializers, see store.rows, for a page of products and
+    of orders: serializing what's been read, reading and
+    serializing it, and reading, serializing and rendering it.
+
+        pytest benchmarks/bench_serialization.py -s
+"""
+# General
+import pytest
+from django.contrib.auth.models import User
+from rest_framework.renderers import JSONRenderer
+
+# Opply
+from benchmarks.timing import measure, report
+from store.models import Order, OrderProducts, Product
+from store.renderers import FastJSONRenderer
+from store.serializers import (ProductSerializer, ProductRowSerializer,
+                               OrderSerializer, OrderRowSerializer)
+
+PAGE = 100
+REPEAT = 200
+
+
+@pytest.fixture
+def user():
+    user = User.objects.create_user(username='bench_user')
+    products = Product.objects.bulk_create([
+        Product(name=f'Product {i}', price=f'{i}.{i % 100:02}',
+                quantity_in_stock=i) for i in range(PAGE)])
+    orders = Order.objects.bulk_create([Order(user=user)
+                                        for _ in range(PAGE)])
+    OrderProducts.objects.bulk_create([
+        OrderProducts(order=order, product=products[(i + j) % PAGE],
+                      quantity=1 + j)
+        for i, order in enumerate(orders) for j in range(3)])
+    return user
+
+
+def run(name, fn):
+    latencies = measure(fn, repeat=REPEAT)
+    mean = sum(latencies) / len(latencies)
+    return name, {'objects_per_s': PAGE / mean * 1000, 'mean_ms': mean}
+
+
+@pytest.mark.django_db
+def test_serialization(user, settings):
+    settings.FAST_SERIALIZATION = True
+    pages = {
+        'products': (Product.objects.order_by('id').with_stock(),
+                     ProductSerializer, ProductRowSerializer()),
+        'orders': (Order.objects.filter(user=user).with_product_ids()
+                                .order_by('-datetime', '-id'),
+                   OrderSerializer, OrderRowSerializer()),
+    }
+    json_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+
+    for page, (queryset, serializer_class, rows) in pages.items():
+        instances = list(queryset[:PAGE])
+        # As read, with the orders' product ids for both
+        values = rows.prepare(list(rows.values(queryset)[:PAGE]))
+        assert fast_renderer.render(list(map(rows.to_dict, values))) == \
+            json_renderer.render(serializer_class(instances, many=True).data)
+
+        # Warm up both first
+        for _ in range(REPEAT // 5):
+            serializer_class(list(queryset[:PAGE]), many=True).data
+            rows.many(rows.values(queryset)[:PAGE])
+
+        report(f'A page of {PAGE} {page}', [
+            run('serialize, DRF',
+                lambda: serializer_class(instances, many=True).data),
+            run('serialize, rows',
+                lambda: list(map(rows.to_dict, values))),
+            run('read, serialize, DRF',
+                lambda: serializer_class(list(queryset[:PAGE]),
+                                         many=True).data),
+            run('read, serialize, rows',
+                lambda: rows.many(rows.values(queryset)[:PAGE])),
+            run('read, serialize, render, DRF',
+                lambda: json_renderer.render(serializer_class(
+                    list(queryset[:PAGE]), many=True).data)),
+            run('read, serialize, render, rows',
+                lambda: fast_renderer.render(
+                    rows.many(rows.values(queryset)[:PAGE]))),
+        ])
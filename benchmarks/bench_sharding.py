@@ -0,0 +1,79 @@
+""" Orders per second against a single hot product, with its
+    stock in the product row, in one shard and in several.
+
+        pytest benchmarks/bench_sharding.py -s
+
+    Each order takes one unit in its own transaction, which is
+    then held open for HOLD seconds, standing in for the rest of
+    the work of placing an order, while the stock stays locked.
+    Going through the API here would measure python threads
+    queuing on the GIL rather than on the row locks.
+"""
+# General
+import pytest
+import threading
+import time
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+# Opply
+from benchmarks.timing import report
+from store import availability, stock
+from store.models import Product
+
+THREADS = 16
+ORDERS_PER_THREAD = 25
+HOLD = 0.005
+STOCK = 1_000_000
+
+
+def place_orders(product):
+    """ Place orders for the product from THREADS threads at
+        once, returns orders per second.
+    """
+    barrier = threading.Barrier(THREADS + 1)
+
+    def buy():
+        barrier.wait()
+        try:
+            for _ in range(ORDERS_PER_THREAD):
+                with transaction.atomic():
+                    stock.reserve({product.id: 1})
+                    time.sleep(HOLD)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=buy) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return THREADS * ORDERS_PER_THREAD / (time.perf_counter() - start)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sharding(settings):
+    settings.STOCK_SHARDING = True
+    User.objects.create_user(username='bench_user')
+
+    rows = []
+    for shards in (0, 1, 4, 16):
+        product = Product.objects.create(name=f'Hot {shards}', price=1,
+                                         quantity_in_stock=STOCK)
+        stock.rebalance(product.id, shards)
+        stock.stats.reset()
+        rate = place_orders(product)
+        stats = stock.stats.snapshot()
+
+        orders = THREADS * ORDERS_PER_THREAD
+        assert availability.get_availability([product.id]) == \
+            {product.id: STOCK - orders}
+        rows.append((f'{shards} shards' if shards else 'product row', {
+            'orders/s': rate,
+            'mean wait ms': stats['mean_lock_wait_seconds'] * 1000,
+            'max wait ms': stats['max_lock_wait_seconds'] * 1000,
+        }))
+    report(f'Orders for one product, {THREADS} threads, transactions '
+           f'held {HOLD * 1000:.0f}ms', rows)
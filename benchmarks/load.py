@@ -0,0 +1,515 @@
+""" Load test of the store API, over HTTP, against a database
+    seeded with a realistic amount of data.
+
+        python -m benchmarks.load seed --users 1000 --products 100000 \\
+            --lines 2000000
+        python -m benchmarks.load run --clients 32 --duration 10
+        python -m benchmarks.load compare before.json after.json
+
+    seed fills the database of the current settings, which with
+    DATABASE_URL can be any other, e.g. sqlite:///load.sqlite3, a
+    migrated one. Running it again tops the data up to the counts
+    asked for.
+
+    run starts a server, manage.py runserver unless --server gives
+    another command, on a local port and drives each of SCENARIOS
+    at it from --clients concurrent clients for --duration seconds.
+    The clients are threads, spread over --processes processes so
+    they don't all queue on one GIL. The orders of the hot scenario
+    all go to a few products with --hot-stock units each, which are
+    checked for overselling after. The queries per request are
+    counted afterwards, in process, over a sample of each scenario.
+
+    Results are printed and saved as JSON, in benchmarks/results/
+    named after the commit unless --output says otherwise, for
+    compare to show the difference between two runs.
+
+    Note: Everything runs on this machine, nothing goes over the
+          network but the loopback.
+"""
+# General
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from base64 import urlsafe_b64encode
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from hashlib import sha512
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = BASE_DIR / 'benchmarks' / 'results'
+
+USER_PREFIX = 'load_user_'
+PRODUCT_PREFIX = 'Load product '
+HOT_PREFIX = 'Load hot product '
+STOCK = 1_000_000
+PAGE_SIZE = 20
+
+
+def setup():
+    """ Set up django for the commands that need it, with debug
+        off, as a server under load would be.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'opply.settings')
+    os.environ.setdefault('DEBUG', 'off')
+    os.environ.setdefault('ALLOWED_HOSTS', '127.0.0.1,localhost')
+    import django
+    django.setup()
+
+
+def token(user_id):
+    """ The auth token of a load test user, derived from its id
+        so clients can rebuild it without it being stored.
+    """
+    return sha512(f'load:{user_id}'.encode()).digest()[:48]
+
+
+def authorization(user_id):
+    return f'Token {urlsafe_b64encode(token(user_id)).decode()}'
+
+
+# Seeding
+
+def seed(users, products, hot, lines, batch_size, rng):
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from django.db import transaction
+    from django.utils import timezone
+    from rest_authtoken.models import AuthToken
+    from store.models import Order, OrderProducts, Product
+
+    def progress(what, done, total, started):
+        rate = done / (time.perf_counter() - started or 1)
+        print(f'{what}: {done}/{total} ({rate:.0f}/s)', end='\r', flush=True)
+
+    def top_up(model, prefix, total, build):
+        started = time.perf_counter()
+        existing = model.objects.filter(**{prefix[0]: prefix[1]}).count()
+        for start in range(existing, total, batch_size):
+            end = min(total, start + batch_size)
+            model.objects.bulk_create([build(i) for i in range(start, end)])
+            progress(model._meta.verbose_name_plural, end, total, started)
+        print()
+
+    password = make_password('load')
+    top_up(User, ('username__startswith', USER_PREFIX), users,
+           lambda i: User(username=f'{USER_PREFIX}{i}', password=password))
+    user_ids = list(User.objects.filter(username__startswith=USER_PREFIX)
+                                .values_list('id', flat=True))
+    AuthToken.objects.bulk_create(
+        [AuthToken(hashed_token=AuthToken._hash_token(token(pk)), user_id=pk)
+         for pk in user_ids], batch_size=batch_size, ignore_conflicts=True)
+
+    top_up(Product, ('name__startswith', PRODUCT_PREFIX), products,
+           lambda i: Product(name=f'{PRODUCT_PREFIX}{i}',
+                             price=Decimal(rng.randrange(100, 100000)) / 100,
+                             quantity_in_stock=STOCK))
+    top_up(Product, ('name__startswith', HOT_PREFIX), hot,
+           lambda i: Product(name=f'{HOT_PREFIX}{i}', price=Decimal('9.99'),
+                             quantity_in_stock=0))
+    product_ids = list(Product.objects.filter(name__startswith=PRODUCT_PREFIX)
+                                      .values_list('id', flat=True))
+
+    # A year of orders of one to five lines each
+    started = time.perf_counter()
+    done = OrderProducts.objects.count()
+    now = timezone.now()
+    while done < lines:
+        with transaction.atomic():
+            orders = Order.objects.bulk_create([
+                Order(user_id=rng.choice(user_ids),
+                      datetime=now - timedelta(days=365 * rng.random()))
+                for _ in range(batch_size // 3)])
+            batch = [OrderProducts(order=order, product_id=product_id,
+                                   quantity=rng.randint(1, 3))
+                     for order in orders
+                     for product_id in rng.sample(product_ids,
+                                                  rng.randint(1, 5))]
+            OrderProducts.objects.bulk_create(batch)
+        done += len(batch)
+        progress('order lines', done, lines, started)
+    print()
+    return counts()
+
+
+def counts():
+    from django.contrib.auth.models import User
+    from store.models import Order, OrderProducts, Product
+    return {
+        'users': User.objects.count(),
+        'products': Product.objects.count(),
+        'orders': Order.objects.count(),
+        'order_lines': OrderProducts.objects.count(),
+    }
+
+
+# Scenarios, each makes a (method, path, body, user id) for a request
+
+def product_page(rng, plan):
+    page = rng.randint(1, max(1, len(plan['products']) // PAGE_SIZE))
+    return ('GET', f'/store/products?page={page}&page_size={PAGE_SIZE}',
+            None, rng.choice(plan['users']))
+
+
+def product_detail(rng, plan):
+    return ('GET', f'/store/products/{rng.choice(plan["products"])}', None,
+            rng.choice(plan['users']))
+
+
+def product_availability(rng, plan):
+    ids = ','.join(map(str, rng.sample(plan['products'], 10)))
+    return ('GET', f'/store/products/availability?ids={ids}', None,
+            rng.choice(plan['users']))
+
+
+def order_page(rng, plan):
+    return ('GET', f'/store/orders?page_size={PAGE_SIZE}', None,
+            rng.choice(plan['users']))
+
+
+def order_cursor_page(rng, plan):
+    return ('GET', f'/store/orders?pagination=cursor&page_size={PAGE_SIZE}',
+            None, rng.choice(plan['users']))
+
+
+def place_order(rng, plan):
+    lines = [{'product': product_id, 'quantity': rng.randint(1, 3)}
+             for product_id in rng.sample(plan['products'],
+                                          rng.randint(1, 3))]
+    return ('POST', '/store/orders', json.dumps({'products': lines}),
+            rng.choice(plan['users']))
+
+
+def place_hot_order(rng, plan):
+    lines = [{'product': rng.choice(plan['hot']), 'quantity': 1}]
+    return ('POST', '/store/orders', json.dumps({'products': lines}),
+            rng.choice(plan['users']))
+
+
+# name: (make a request, the statuses that aren't errors)
+SCENARIOS = {
+    'product_page': (product_page, {200}),
+    'product_detail': (product_detail, {200}),
+    'availability': (product_availability, {200}),
+    'order_page': (order_page, {200}),
+    'order_cursor_page': (order_cursor_page, {200}),
+    'place_order': (place_order, {201}),
+    # Out of stock is a 400, once the hot products run out
+    'place_hot_order': (place_hot_order, {201, 400}),
+}
+
+
+# Running
+
+def drive(name, plan, threads, deadline, seed):
+    """ Make requests of the scenario from threads clients until
+        deadline, returns their latencies and statuses.
+    """
+    make = SCENARIOS[name][0]
+
+    def client(i):
+        rng = random.Random(seed * 10_000 + i)
+        connection = http.client.HTTPConnection('127.0.0.1', plan['port'],
+                                                timeout=60)
+        latencies, statuses = [], Counter()
+        while time.time() < deadline:
+            method, path, body, user = make(rng, plan)
+            headers = {'Authorization': plan['authorization'][user],
+                       'Content-Type': 'application/json',
+                       'Accept': 'application/json'}
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                status = 0
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] += 1
+        connection.close()
+        return latencies, statuses
+
+    latencies, statuses = [], Counter()
+    with ThreadPoolExecutor(threads) as executor:
+        for client_latencies, client_statuses in executor.map(
+                client, range(threads)):
+            latencies.extend(client_latencies)
+            statuses.update(client_statuses)
+    return latencies, statuses
+
+
+def run_scenario(name, plan, clients, processes, duration):
+    from benchmarks.timing import summary
+
+    processes = max(1, min(processes, clients))
+    shares = [clients // processes + (i < clients % processes)
+              for i in range(processes)]
+    deadline = time.time() + duration
+    start = time.perf_counter()
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        results = pool.starmap(drive, [(name, plan, threads, deadline, i)
+                                       for i, threads in enumerate(shares)])
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(ms for result in results for ms in result[0])
+    statuses = sum((result[1] for result in results), Counter())
+    expected = SCENARIOS[name][1]
+    return {
+        'requests': len(latencies),
+        'errors': sum(n for status, n in statuses.items()
+                      if status not in expected),
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+        'req_per_s': len(latencies) / elapsed,
+        **(summary(latencies) if latencies else {}),
+    }
+
+
+def count_queries(names, plan, samples):
+    """ The mean number of queries of a request of each of the
+        scenarios, made in process with the test client.
+    """
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    client = Client(HTTP_HOST='127.0.0.1')
+    queries = {}
+    for name in names:
+        make, expected = SCENARIOS[name]
+        rng = random.Random(name)
+        total = 0
+        for _ in range(samples):
+            method, path, body, user = make(rng, plan)
+            with CaptureQueriesContext(connection) as context:
+                client.generic(method, path, body or '',
+                               content_type='application/json',
+                               HTTP_AUTHORIZATION=plan['authorization'][user])
+            total += len(context.captured_queries)
+        queries[name] = total / samples
+    return queries
+
+
+def check_oversell(hot_stock, first_line):
+    """ Check that the units of the hot products sold during the
+        run, in the lines after first_line, add up to the stock
+        they lost and that none of them went below zero.
+    """
+    from django.db.models import Sum
+    from store.models import Order, OrderProducts, Product
+
+    sold = dict(OrderProducts.objects
+                .filter(id__gt=first_line,
+                        product__name__startswith=HOT_PREFIX,
+                        order__status=Order.CONFIRMED)
+                .values_list('product_id')
+                .annotate(Sum('quantity')))
+    products = []
+    for product_id, stock in (Product.objects
+                              .filter(name__startswith=HOT_PREFIX)
+                              .with_stock().order_by('id')
+                              .values_list('id', 'stock')):
+        units = sold.get(product_id, 0)
+        products.append({'id': product_id, 'initial': hot_stock,
+                         'sold': units, 'final': stock,
+                         'ok': stock >= 0 and hot_stock - units == stock})
+    return {'ok': all(product['ok'] for product in products),
+            'products': products}
+
+
+def start_server(command, port):
+    env = {**os.environ, 'PYTHONUNBUFFERED': '1'}
+    log = open(RESULTS_DIR / 'server.log', 'w')
+    server = subprocess.Popen(command.format(port=port).split(), cwd=BASE_DIR,
+                              env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f'The server exited, see {log.name}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit(f'The server did not start, see {log.name}')
+
+
+def commit():
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=BASE_DIR, text=True,
+                              capture_output=True).stdout.strip()
+    sha = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    return sha + ('-dirty' if git('status', '--porcelain', '-uno') else '')
+
+
+def run(options):
+    from django.db import connection, connections
+    from django.db.models import Max
+    from django.utils import timezone
+    from rest_authtoken.models import AuthToken
+    from store.models import OrderProducts, Product
+
+    names = options.scenarios or list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+    users = list(AuthToken.objects.filter(user__username__startswith=USER_PREFIX)
+                                  .values_list('user_id', flat=True))
+    if not users:
+        raise SystemExit('Nothing to load, run seed first')
+    AuthToken.objects.filter(user_id__in=users).update(created=timezone.now())
+    Product.objects.filter(name__startswith=HOT_PREFIX).update(
+        quantity_in_stock=options.hot_stock)
+    plan = {
+        'port': options.port,
+        'users': users,
+        'authorization': {pk: authorization(pk) for pk in users},
+        'products': list(Product.objects.filter(name__startswith=PRODUCT_PREFIX)
+                                        .values_list('id', flat=True)),
+        'hot': list(Product.objects.filter(name__startswith=HOT_PREFIX)
+                                   .values_list('id', flat=True)),
+    }
+    first_line = OrderProducts.objects.aggregate(last=Max('id'))['last'] or 0
+    results = {
+        'commit': commit(),
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'database': connection.vendor,
+        'server': options.server,
+        'clients': options.clients,
+        'processes': options.processes,
+        'duration': options.duration,
+        'seed': counts(),
+        'scenarios': {},
+    }
+    connections.close_all()
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    server = start_server(options.server, options.port)
+    try:
+        for name in names:
+            print(f'{name}...', flush=True)
+            results['scenarios'][name] = run_scenario(
+                name, plan, options.clients, options.processes,
+                options.duration)
+    finally:
+        server.terminate()
+        server.wait()
+
+    if 'place_hot_order' in names:
+        results['oversell'] = check_oversell(options.hot_stock, first_line)
+    for name, queries in count_queries(names, plan,
+                                       options.query_samples).items():
+        results['scenarios'][name]['queries_per_req'] = queries
+
+    show(results)
+    output = options.output or RESULTS_DIR / (
+        f'{results["commit"]}-{results["database"]}-'
+        f'{datetime.now():%Y%m%d%H%M%S}.json')
+    Path(output).write_text(json.dumps(results, indent=2))
+    print(f'\nSaved to {output}')
+    if not results.get('oversell', {'ok': True})['ok']:
+        raise SystemExit('Oversold!')
+
+
+COLUMNS = ['req_per_s', 'p50_ms', 'p95_ms', 'p99_ms',
+           'queries_per_req', 'errors']
+
+
+def show(results):
+    from benchmarks.timing import report
+    report(f'{results["commit"]} on {results["database"]}, '
+           f'{results["clients"]} clients for {results["duration"]}s, '
+           f'{results["seed"]}',
+           [(name, {column: scenario.get(column) for column in COLUMNS})
+            for name, scenario in results['scenarios'].items()])
+    if 'oversell' in results:
+        for product in results['oversell']['products']:
+            print(f'hot product {product["id"]}: {product["initial"]} - '
+                  f'{product["sold"]} sold = {product["final"]} '
+                  f'{"ok" if product["ok"] else "OVERSOLD"}')
+
+
+def compare(before, after):
+    """ Print the scenarios of two runs side by side, with the
+        change from before to after as a percentage.
+    """
+    from benchmarks.timing import report
+    before, after = (json.loads(Path(path).read_text())
+                     for path in (before, after))
+    rows = []
+    for name in after['scenarios']:
+        if name not in before['scenarios']:
+            continue
+        old, new = before['scenarios'][name], after['scenarios'][name]
+        for column in COLUMNS[:-1]:
+            if old.get(column) is None or new.get(column) is None:
+                continue
+            change = ((new[column] - old[column]) / old[column] * 100
+                      if old[column] else 0.0)
+            rows.append((f'{name} {column}', {
+                'before': float(old[column]),
+                'after': float(new[column]),
+                'change_%': change,
+            }))
+    report(f'{before["commit"]} ({before["database"]}) -> '
+           f'{after["commit"]} ({after["database"]})', rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seeding = commands.add_parser('seed')
+    seeding.add_argument('--users', type=int, default=1000)
+    seeding.add_argument('--products', type=int, default=100_000)
+    seeding.add_argument('--hot-products', type=int, default=4)
+    seeding.add_argument('--lines', type=int, default=2_000_000)
+    seeding.add_argument('--batch-size', type=int, default=10_000)
+    seeding.add_argument('--seed', type=int, default=0)
+
+    running = commands.add_parser('run')
+    running.add_argument('--clients', type=int, default=32)
+    running.add_argument('--processes', type=int,
+                         default=max(1, (os.cpu_count() or 2) // 2))
+    running.add_argument('--duration', type=float, default=10)
+    running.add_argument('--port', type=int, default=8765)
+    running.add_argument('--server', default=(
+        f'{sys.executable} manage.py runserver --noreload --skip-checks '
+        '127.0.0.1:{port}'))
+    running.add_argument('--hot-stock', type=int, default=500)
+    running.add_argument('--query-samples', type=int, default=20)
+    running.add_argument('--scenarios', type=lambda s: s.split(','))
+    running.add_argument('--output')
+
+    comparing = commands.add_parser('compare')
+    comparing.add_argument('before')
+    comparing.add_argument('after')
+
+    options = parser.parse_args(argv)
+    if options.command == 'compare':
+        return compare(options.before, options.after)
+
+    setup()
+    if options.command == 'seed':
+        print(seed(options.users, options.products, options.hot_products,
+                   options.lines, options.batch_size,
+                   random.Random(options.seed)))
+    else:
+        run(options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+# General
+import statistics
+import time
+
+
+def measure(fn, repeat=20):
+    """ Call fn repeat times and return the latencies, in
+        milliseconds, sorted.
+    """
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return sorted(latencies)
+
+
+def percentile(latencies, p):
+    """ Nearest rank percentile of sorted latencies.
+    """
+    rank = max(0, min(len(latencies) - 1,
+                      round(p / 100 * len(latencies)) - 1))
+    return latencies[rank]
+
+
+def summary(latencies):
+    return {
+        'p50_ms': statistics.median(latencies),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+    }
+
+
+def report(title, rows):
+    """ Print a table of rows, a list of (name, dict of values).
+    """
+    print()
+    print(title)
+    columns = list(rows[0][1])
+    width = max(len(name) for name, _ in rows)
+    print(' ' * width + ''.join(f'{c:>16}' for c in columns))
+    for name, values in rows:
+        print(f'{name:<{width}}' + ''.join(
+            f'{v:>16.2f}' if isinstance(v, float) else f'{v:>16}'
+            for v in values.values()))
@@ -1,7 +1,29 @@
 import pytest
+from django.conf import settings
+from django.core.cache import caches
 from rest_framework.test import APIClient
+from store.authentication import tokens
+from store.hotstock import hot_stock
+from store.replicas import health
+
+# A second alias of the database, standing in for a read replica, see
+# store/tests/test_replicas.py. It's only read from with DATABASE_REPLICAS.
+settings.DATABASES.setdefault('replica1', {**settings.DATABASES['default'],
+                                           'TEST': {'MIRROR': 'default'}})
 
 
 @pytest.fixture
 def request_client():
     return APIClient()
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """ The caches are in process, so they'd otherwise outlive
+        the data of the test which filled them.
+    """
+    for cache in caches.all():
+        cache.clear()
+    tokens.reset()
+    hot_stock.reset()
+    health.reset()
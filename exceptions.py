@@ -5,3 +5,10 @@ class ProductOutOfStockException(APIException):
     status_code = 400
     default_detail = 'Sorry the product you have requested is out of stock.'
     default_code = 'product_out_of_stock'
+
+
+class IdempotencyKeyReusedException(APIException):
+    status_code = 422
+    default_detail = ('This Idempotency-Key has already been used for '
+                      'another request.')
+    default_code = 'idempotency_key_reused'
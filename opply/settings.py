@@ -27,9 +27,9 @@ environ.Env.read_env(os.path.join(BASE_DIR, '.env'))
 SECRET_KEY = 'django-insecure-*k$$pf)t(3jp9i3cv-tf5^bp%f!@5b#!-9em9o)qtr8)vk)pgh'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = env.bool('DEBUG', default=True)
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = env.list('ALLOWED_HOSTS', default=[])
 
 
 # Application definition
@@ -49,13 +49,14 @@ INSTALLED_APPS = [
 # Rest Framework Config
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_authtoken.auth.AuthTokenAuthentication',
+        'store.authentication.CachingAuthTokenAuthentication',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'store.pagination.PageNumberPagination',
     'PAGE_SIZE': 2
 }
 
 MIDDLEWARE = [
+    'store.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,7 +94,7 @@ DATABASES = {
         'ENGINE': 'django.db.backends.postgresql',
         'NAME': 'opply',
         'USER': 'opply',
-        'PASSWORD': env('POSTGRES_PASSWORD'),
+        'PASSWORD': env('POSTGRES_PASSWORD', default=''),
         'HOST': 'database',  # This is the host name of the docker db container
         # as referenced inside of the backend container
         # 'HOST': 'localhost', # Use this host if you're running a containerised
@@ -102,6 +103,162 @@ DATABASES = {
     }
 }
 
+# Or any other database as a URL, e.g. for benchmarks against a local
+# postgres, postgres://opply:pw@localhost/opply, or sqlite:///load.sqlite3
+if 'DATABASE_URL' in os.environ:
+    DATABASES['default'] = env.db('DATABASE_URL')
+
+# Read replicas of the default database, as a comma separated list of URLs
+# in DATABASE_REPLICAS, added as the aliases replica1, replica2, ... Reads
+# of products and orders go to a replica, see store.replicas, unless the
+# user wrote something in the last REPLICA_PIN_SECONDS, noted in the
+# REPLICA_PIN_CACHE cache, which should be shared between processes. Every
+# REPLICA_CHECK_INTERVAL seconds each replica is checked, those down or
+# more than REPLICA_MAX_LAG_SECONDS behind are left out until they catch up.
+for i, url in enumerate(env.list('DATABASE_REPLICAS', default=[]), 1):
+    DATABASES[f'replica{i}'] = {**env.db_url_config(url),
+                                'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['store.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = 10
+REPLICA_PIN_CACHE = 'default'
+REPLICA_CHECK_INTERVAL = 5
+REPLICA_MAX_LAG_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# In process by default, point CACHE_BACKEND and CACHE_LOCATION at a
+# shared cache, e.g. redis or memcached, when running many processes.
+# The catalogue has a cache of its own, which is cleared whenever products
+# change, so point CATALOGUE_CACHE_LOCATION at one holding nothing else, e.g.
+# a redis database of its own. It holds up to CATALOGUE_CACHE_MAX_PAGES.
+CATALOGUE_CACHE_MAX_PAGES = 10000
+CACHES = {
+    'default': {
+        'BACKEND': env('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': env('CACHE_LOCATION', default='opply'),
+    },
+    'catalogue': {
+        'BACKEND': env('CATALOGUE_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': env('CATALOGUE_CACHE_LOCATION', default='opply-catalogue'),
+        'OPTIONS': {'MAX_ENTRIES': CATALOGUE_CACHE_MAX_PAGES},
+    },
+}
+
+# Cache alias and timeout for the pre-rendered product catalogue pages,
+# pages are evicted when products change, the timeout is a backstop.
+CATALOGUE_CACHE = 'catalogue'
+CATALOGUE_CACHE_TIMEOUT = 60 * 60
+
+# Cache alias and timeout for the stock of products, it's changing all
+# the time, so it's only cached briefly and dropped when it changes.
+AVAILABILITY_CACHE = 'default'
+AVAILABILITY_CACHE_TIMEOUT = 5
+
+# Sharded stock, when on, products with stock shards have their stock
+# spread over a number of rows, so buyers of a popular product don't
+# all queue on the lock of one row. See store.models.StockShard.
+# Products are sharded with: manage.py rebalance_stock <id> --shards N
+STOCK_SHARDING = env.bool('STOCK_SHARDING', default=False)
+STOCK_SHARDS = 8
+
+# Hot stock, when on, products marked hot are sold from blocks of their
+# stock leased to each process, HOT_STOCK_LEASE_UNITS at a time, counted
+# in the HOT_STOCK_CACHE cache and flushed to the database every
+# HOT_STOCK_FLUSH_INTERVAL seconds, see store.hotstock. Leases not renewed
+# for HOT_STOCK_LEASE_TIMEOUT seconds are settled, their holders stop
+# selling from them HOT_STOCK_LEASE_MARGIN seconds before. Products are
+# made hot, or not, every HOT_STOCK_REVIEW_INTERVAL seconds, by how many
+# reservations a second each process makes of them, and how long they
+# wait on the row, or with: manage.py hot_stock promote|demote <id>
+HOT_STOCK = env.bool('HOT_STOCK', default=False)
+HOT_STOCK_CACHE = 'default'
+HOT_STOCK_LEASE_UNITS = 100
+HOT_STOCK_LEASE_TIMEOUT = 60
+HOT_STOCK_LEASE_MARGIN = 10
+HOT_STOCK_FLUSH_INTERVAL = 1
+HOT_STOCK_REVIEW_INTERVAL = 30
+HOT_STOCK_PROMOTE_RATE = 20
+HOT_STOCK_PROMOTE_WAIT_MS = 5
+HOT_STOCK_DEMOTE_RATE = 2
+
+# Asynchronous orders, placed with the header Prefer: respond-async, are
+# accepted straight away and have their stock reserved by a pool of
+# ORDER_WORKERS threads in batches of up to ORDER_BATCH_SIZE orders.
+# Pending orders can also be worked through with: manage.py process_orders
+ORDER_WORKERS = env.int('ORDER_WORKERS', default=2)
+ORDER_BATCH_SIZE = 50
+
+# The most orders that can be placed at once at /store/orders/batch.
+ORDER_BATCH_MAX_ORDERS = 1000
+
+# Cached token authentication, see store.authentication.TokenCache. Tokens
+# are cached in process, in an LRU of up to AUTH_TOKEN_LOCAL_CACHE_SIZE
+# tokens for AUTH_TOKEN_LOCAL_CACHE_TIMEOUT seconds, and, if AUTH_TOKEN_CACHE
+# names a cache, shared between processes for AUTH_TOKEN_CACHE_TIMEOUT.
+AUTH_TOKEN_CACHE = env('AUTH_TOKEN_CACHE', default=None)
+AUTH_TOKEN_CACHE_TIMEOUT = 5 * 60
+AUTH_TOKEN_LOCAL_CACHE_SIZE = 10000
+AUTH_TOKEN_LOCAL_CACHE_TIMEOUT = 5
+
+# Rows read at a time by the order export, see store.export.
+EXPORT_CHUNK_SIZE = 2000
+
+# Rows validated and written at a time by manage.py import_products.
+IMPORT_BATCH_SIZE = 1000
+
+# Sales and stock reports, see store.sales. Products with at most
+# LOW_STOCK_THRESHOLD units are low on stock, sales are over the last
+# SALES_REPORT_DAYS days, and reports list up to SALES_REPORT_LIMIT products.
+# Sales are counted from the order lines by manage.py catch_up_sales,
+# SALES_CATCH_UP_BATCH_SIZE at a time, leaving out the orders of the last
+# SALES_CATCH_UP_MARGIN seconds.
+LOW_STOCK_THRESHOLD = 5
+SALES_REPORT_DAYS = 7
+SALES_REPORT_LIMIT = 20
+SALES_CATCH_UP_BATCH_SIZE = 10000
+SALES_CATCH_UP_MARGIN = 10
+
+# Orders older than ORDER_ARCHIVE_AFTER_DAYS days are moved to the archive,
+# ORDER_ARCHIVE_BATCH_SIZE at a time, by: manage.py archive_orders
+ORDER_ARCHIVE_AFTER_DAYS = env.int('ORDER_ARCHIVE_AFTER_DAYS', default=365)
+ORDER_ARCHIVE_BATCH_SIZE = 5000
+
+# Every change to the stock is written to a ledger, see store.ledger, which
+# is snapshotted by manage.py snapshot_stock, leaving out the movements of the
+# last STOCK_SNAPSHOT_MARGIN seconds, and checked against the stock by
+# manage.py reconcile_stock, STOCK_LEDGER_CHUNK_SIZE products at a time.
+STOCK_LEDGER_CHUNK_SIZE = 1000
+STOCK_SNAPSHOT_MARGIN = 60
+
+# Products and orders are listed and retrieved by reading rows with
+# values_list, serialized by precompiled functions and rendered with orjson,
+# when it's installed, see store.rows and store.renderers. The output is the
+# same either way.
+FAST_SERIALIZATION = env.bool('FAST_SERIALIZATION', default=True)
+
+# Native async views for reading products and orders, see store.async_views.
+# On by default under ASGI, see opply/asgi.py, off under WSGI.
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
+
+# Orders sent with an Idempotency-Key header are placed once per key, repeats
+# within IDEMPOTENCY_KEY_TIMEOUT seconds get the first response again. Older
+# keys are deleted with: manage.py purge_idempotency_keys
+IDEMPOTENCY_KEY_TIMEOUT = env.int('IDEMPOTENCY_KEY_TIMEOUT', default=24 * 60 * 60)
+IDEMPOTENCY_PURGE_BATCH_SIZE = 10000
+
+# Request metrics, see store.middleware.PerformanceMiddleware. Every request
+# is timed, PERF_SAMPLE_RATE of them also have their queries and rendering
+# timed. Histograms cover the process' lifetime and the last PERF_WINDOW
+# seconds, they're served to staff at /store/metrics. Queries slower than
+# PERF_SLOW_QUERY_MS are logged.
+PERF_SAMPLE_RATE = env.float('PERF_SAMPLE_RATE', default=0.1)
+PERF_SLOW_QUERY_MS = env.float('PERF_SLOW_QUERY_MS', default=100)
+PERF_SERVER_TIMING = env.bool('PERF_SERVER_TIMING', default=True)
+PERF_WINDOW = 60
+PERF_WINDOW_SLOTS = 6
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
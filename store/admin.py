@@ -1,3 +1,44 @@
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
 
-# Register your models here.
+from . import stock
+from .models import Product, StockShard
+
+
+class StockShardInline(admin.TabularInline):
+    model = StockShard
+    fields = ('slot', 'quantity')
+    readonly_fields = ('slot', 'quantity')
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'price', 'quantity_in_stock', 'hot')
+    list_filter = ('hot', )
+    search_fields = ('name', )
+    inlines = (StockShardInline, )
+    actions = ('rebalance_stock', 'unshard_stock')
+
+    @admin.action(description='Shard or rebalance the stock of the '
+                              'selected products')
+    def rebalance_stock(self, request, queryset):
+        if not settings.STOCK_SHARDING:
+            # The slots would be left out of the stock, see stock.reserve
+            self.message_user(request, 'Stock sharding is off, see '
+                                       'settings.STOCK_SHARDING.',
+                              level=messages.ERROR)
+            return
+        for product in queryset:
+            shards = product.stock_shards.count() or settings.STOCK_SHARDS
+            stock.rebalance(product.id, shards)
+
+    @admin.action(description='Move the stock of the selected products '
+                              'out of their shards')
+    def unshard_stock(self, request, queryset):
+        for product in queryset:
+            stock.rebalance(product.id, 0)
@@ -0,0 +1,89 @@
+# General
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+# Opply
+from . import sales
+from .models import ArchivedOrder, Order, OrderProducts
+
+
+def cutoff():
+    """ Orders placed before this are archived, see
+        settings.ORDER_ARCHIVE_AFTER_DAYS.
+    """
+    return timezone.now() - timedelta(days=settings.ORDER_ARCHIVE_AFTER_DAYS)
+
+
+def archive(before=None, batch_size=None):
+    """ Move the orders placed before before, cutoff() by default,
+        to ArchivedOrder, with their lines, a batch at a time,
+        returns how many were moved.
+
+        Note: Pending orders are left, as they're still to be
+              placed, as are orders with units taken from a lease
+              of hot stock that's not been settled, as it counts
+              them from their lines, see hotstock.settle, and
+              orders with lines not yet counted in the sales, see
+              sales.catch_up.
+    """
+    before = before or cutoff()
+    batch_size = batch_size or settings.ORDER_ARCHIVE_BATCH_SIZE
+    counted = sales.counted()
+    total, last_id = 0, 0
+    while True:
+        with transaction.atomic():
+            orders = list(Order.objects
+                          .filter(id__gt=last_id, datetime__lt=before)
+                          .exclude(status=Order.PENDING)
+                          .exclude(products__id__gt=counted)
+                          .order_by('id')
+                          .values_list('id', 'user_id', 'datetime', 'status',
+                                       'total', 'item_count')
+                          [:batch_size])
+            if not orders:
+                return total
+            last_id = orders[-1][0]
+
+            lines, unsettled = {}, set()
+            for order_id, product_id, quantity, unit_price, released in (
+                    OrderProducts.objects
+                    .filter(order__in=[order[0] for order in orders])
+                    .order_by('id')
+                    .values_list('order_id', 'product_id', 'quantity',
+                                 'unit_price', 'lease__released')):
+                lines.setdefault(order_id, []).append(
+                    [product_id, quantity,
+                     None if unit_price is None else str(unit_price)])
+                if released is False:
+                    unsettled.add(order_id)
+
+            archived = [ArchivedOrder(id=order_id, user_id=user_id,
+                                      datetime=datetime, status=status,
+                                      total=total, item_count=item_count,
+                                      lines=lines.get(order_id, []))
+                        for order_id, user_id, datetime, status, total,
+                        item_count in orders
+                        if order_id not in unsettled]
+            ids = [order.id for order in archived]
+            ArchivedOrder.objects.bulk_create(archived)
+            OrderProducts.objects.filter(order__in=ids).delete()
+            Order.objects.filter(id__in=ids).delete()
+            total += len(ids)
+
+
+def find(user, order_id):
+    """ The user's archived order order_id, as an Order, with its
+        product_ids, see OrderSerializer, or None.
+    """
+    try:
+        archived = ArchivedOrder.objects.get(id=order_id, user=user)
+    except (ArchivedOrder.DoesNotExist, ValueError):
+        return None
+    order = Order(id=archived.id, user_id=archived.user_id,
+                  datetime=archived.datetime, status=archived.status,
+                  total=archived.total, item_count=archived.item_count)
+    order.product_ids = [product_id for product_id, quantity, *_
+                         in archived.lines for _ in range(quantity)]
+    return order
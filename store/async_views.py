@@ -0,0 +1,122 @@
+# General
+import functools
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+
+# Opply
+from . import archive, replicas
+from .authentication import CachingAuthTokenAuthentication
+from .models import Product, Order
+from .pagination import PageNumberPagination
+from .renderers import FastJSONRenderer
+from .serializers import ProductSerializer, OrderSerializer
+from .views import ProductViewSet, OrderViewSet
+
+# Query parameters the async views understand, requests with any
+# others, e.g. ?format=api or ?pagination=cursor, go to the sync views.
+QUERY_PARAMS = {'page', 'page_size'}
+
+
+def render(data, status=status.HTTP_200_OK, headers=None):
+    return HttpResponse(FastJSONRenderer().render(data), status=status,
+                        headers=headers, content_type='application/json')
+
+
+def async_view(sync_view):
+    """ Decorator for the async views, serving authenticated, plain
+        JSON GETs. Everything else, other methods, other formats,
+        cursor pagination, is left to sync_view, the DRF view at
+        the same URL, which runs in a thread.
+
+        The async view is called with the user as well as the
+        request, and APIExceptions it raises are turned into their
+        responses, as in DRF. Its reads go to a read replica, as
+        with ReplicaReadMixin.
+
+        Note: The async views are used under ASGI, see
+              settings.ASYNC_VIEWS. Under WSGI every async view
+              would need an event loop of its own.
+    """
+    sync_view = sync_to_async(sync_view)
+    authentication = CachingAuthTokenAuthentication()
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if (request.method != 'GET'
+                    or not QUERY_PARAMS.issuperset(request.GET)
+                    or 'text/html' in request.headers.get('Accept', '')):
+                return await sync_view(request, *args, **kwargs)
+
+            try:
+                authenticated = await authentication.aauthenticate(request)
+                if authenticated is None:
+                    raise exceptions.NotAuthenticated
+                token = await replicas.astart_reading(authenticated[0])
+                try:
+                    return await view(Request(request), authenticated[0],
+                                      *args, **kwargs)
+                finally:
+                    replicas.stop_reading(token)
+            except exceptions.APIException as exc:
+                headers = None
+                if isinstance(exc, (exceptions.NotAuthenticated,
+                                    exceptions.AuthenticationFailed)):
+                    headers = {'WWW-Authenticate':
+                               authentication.authenticate_header(request)}
+                return render({'detail': exc.detail}, exc.status_code,
+                              headers)
+        return wrapper
+    return decorator
+
+
+async def paginated(request, queryset, serializer_class):
+    paginator = PageNumberPagination()
+    page = await paginator.apaginate_queryset(queryset, request)
+    data = serializer_class(page, many=True).data
+    return render(paginator.get_paginated_response(data).data)
+
+
+async def get_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise exceptions.NotFound
+
+
+@async_view(ProductViewSet.as_view({'get': 'list'}))
+async def product_list(request, user):
+    return await paginated(request,
+                           Product.objects.order_by('id').with_stock(),
+                           ProductSerializer)
+
+
+@async_view(ProductViewSet.as_view({'get': 'retrieve'}))
+async def product_detail(request, user, pk):
+    product = await get_or_404(Product.objects.with_stock(), pk=pk)
+    return render(ProductSerializer(product).data)
+
+
+def user_orders(user):
+    return (Order.objects.filter(user=user)
+                         .with_product_ids()
+                         .order_by(*OrderViewSet.keyset_ordering))
+
+
+@async_view(OrderViewSet.as_view({'get': 'list', 'post': 'create'}))
+async def order_list(request, user):
+    return await paginated(request, user_orders(user), OrderSerializer)
+
+
+@async_view(OrderViewSet.as_view({'get': 'retrieve'}))
+async def order_detail(request, user, pk):
+    try:
+        order = await get_or_404(user_orders(user), pk=pk)
+    except exceptions.NotFound:
+        # Or the archived order, see archive.find
+        order = await sync_to_async(archive.find)(user, pk)
+        if order is None:
+            raise
+    return render(OrderSerializer(order).data)
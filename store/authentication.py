@@ -0,0 +1,271 @@
+# General
+import threading
+import time
+from base64 import urlsafe_b64decode
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authentication import get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from rest_authtoken.auth import AuthTokenAuthentication
+from rest_authtoken.models import AuthToken
+
+
+class AsyncAuthTokenAuthentication(AuthTokenAuthentication):
+    """ AuthTokenAuthentication, which can also check the token
+        from async views, with aauthenticate.
+
+        Note: The checks are those of AuthTokenAuthentication,
+              an expired token is deleted and refused, as is the
+              token of an inactive user.
+    """
+
+    def get_token(self, request):
+        """ The raw token from the Authorization header, None
+            if there's no token auth at all.
+        """
+        auth = get_authorization_header(request).split()
+
+        if not auth or auth[0].lower() != b'token':
+            return None
+
+        if len(auth) == 1:
+            raise AuthenticationFailed(
+                'invalid auth header, No credentials provided.')
+        elif len(auth) > 2:
+            raise AuthenticationFailed('invalid auth token')
+
+        try:
+            return urlsafe_b64decode(auth[1])
+        except ValueError:
+            raise AuthenticationFailed('invalid auth token')
+
+    async def aauthenticate(self, request):
+        """ Async authenticate, returns (user, token) or None.
+        """
+        token = self.get_token(request)
+        if token is None:
+            return None
+
+        try:
+            auth_token = await AuthToken.objects.select_related('user').aget(
+                hashed_token=AuthToken._hash_token(token))
+        except AuthToken.DoesNotExist:
+            raise AuthenticationFailed('invalid auth token')
+
+        if auth_token.age > AuthToken.TOKEN_VALIDITY:
+            await AuthToken.objects.filter(
+                hashed_token=auth_token.hashed_token).adelete()
+            raise AuthenticationFailed('invalid auth token')
+
+        if not auth_token.user.is_active:
+            raise AuthenticationFailed('invalid auth token')
+
+        return auth_token.user, token
+
+
+class TokenCache:
+    """ Cache of what authentication needs to know about a token,
+        (user id, active flag, expiry timestamp), keyed by the
+        hash of the token, as stored in AuthToken.
+
+        The first level is a bounded LRU in process, holding
+        entries for settings.AUTH_TOKEN_LOCAL_CACHE_TIMEOUT
+        seconds. With settings.AUTH_TOKEN_CACHE, a cache alias,
+        there's a second level shared between processes, holding
+        entries for settings.AUTH_TOKEN_CACHE_TIMEOUT seconds.
+
+        Note: Logging out and deactivating a user drop their
+              entries from the shared cache and the LRU of the
+              process it happens in straight away, see
+              store.signals. Other processes may go on accepting
+              the token for the lifetime of their LRU entry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self.local_hits = 0
+            self.shared_hits = 0
+            self.misses = 0
+
+    @staticmethod
+    def get_shared_cache():
+        if settings.AUTH_TOKEN_CACHE:
+            return caches[settings.AUTH_TOKEN_CACHE]
+
+    @staticmethod
+    def key(hashed_token):
+        return f'authtoken:{bytes(hashed_token).hex()}'
+
+    def _get_local(self, hashed_token):
+        with self._lock:
+            cached = self._entries.get(hashed_token)
+            if cached is None or cached[0] < time.monotonic():
+                return None
+            self._entries.move_to_end(hashed_token)
+            self.local_hits += 1
+            return cached[1]
+
+    def _set_local(self, hashed_token, entry):
+        with self._lock:
+            self._entries[hashed_token] = (
+                time.monotonic() + settings.AUTH_TOKEN_LOCAL_CACHE_TIMEOUT,
+                entry)
+            self._entries.move_to_end(hashed_token)
+            while len(self._entries) > settings.AUTH_TOKEN_LOCAL_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def _shared_hit(self, hashed_token, entry):
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+        else:
+            with self._lock:
+                self.shared_hits += 1
+            self._set_local(hashed_token, entry)
+        return entry
+
+    def get(self, hashed_token):
+        entry = self._get_local(hashed_token)
+        if entry is not None:
+            return entry
+        shared = self.get_shared_cache()
+        if shared is not None:
+            entry = shared.get(self.key(hashed_token))
+        return self._shared_hit(hashed_token, entry)
+
+    async def aget(self, hashed_token):
+        entry = self._get_local(hashed_token)
+        if entry is not None:
+            return entry
+        shared = self.get_shared_cache()
+        if shared is not None:
+            entry = await shared.aget(self.key(hashed_token))
+        return self._shared_hit(hashed_token, entry)
+
+    def set(self, hashed_token, entry):
+        self._set_local(hashed_token, entry)
+        shared = self.get_shared_cache()
+        if shared is not None:
+            shared.set(self.key(hashed_token), entry,
+                       settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+    async def aset(self, hashed_token, entry):
+        self._set_local(hashed_token, entry)
+        shared = self.get_shared_cache()
+        if shared is not None:
+            await shared.aset(self.key(hashed_token), entry,
+                              settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+    def invalidate(self, hashed_tokens):
+        hashed_tokens = [bytes(hashed_token) for hashed_token
+                         in hashed_tokens]
+        with self._lock:
+            for hashed_token in hashed_tokens:
+                self._entries.pop(hashed_token, None)
+        shared = self.get_shared_cache()
+        if shared is not None:
+            shared.delete_many([self.key(hashed_token)
+                                for hashed_token in hashed_tokens])
+
+    def snapshot(self):
+        with self._lock:
+            hits = self.local_hits + self.shared_hits
+            lookups = hits + self.misses
+            return {
+                'hits': hits,
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+            }
+
+
+tokens = TokenCache()
+
+
+class CachingAuthTokenAuthentication(AsyncAuthTokenAuthentication):
+    """ AuthTokenAuthentication with the tokens cached, see
+        TokenCache, so most requests don't query the token or
+        the user at all.
+
+        Note: On a cache hit, the user has only its id and
+              is_active loaded, other fields are fetched if
+              they're used.
+    """
+
+    def authenticate(self, request):
+        token = self.get_token(request)
+        if token is None:
+            return None
+
+        hashed_token = AuthToken._hash_token(token)
+        entry = tokens.get(hashed_token)
+        if entry is None:
+            entry = self.fetch(hashed_token)
+        if self.expired(entry):
+            AuthToken.objects.filter(hashed_token=hashed_token).delete()
+            raise AuthenticationFailed('invalid auth token')
+        return self.get_user(entry), token
+
+    async def aauthenticate(self, request):
+        token = self.get_token(request)
+        if token is None:
+            return None
+
+        hashed_token = AuthToken._hash_token(token)
+        entry = await tokens.aget(hashed_token)
+        if entry is None:
+            entry = await self.afetch(hashed_token)
+        if self.expired(entry):
+            await AuthToken.objects.filter(
+                hashed_token=hashed_token).adelete()
+            raise AuthenticationFailed('invalid auth token')
+        return self.get_user(entry), token
+
+    def fetch(self, hashed_token):
+        try:
+            auth_token = AuthToken.objects.select_related('user').get(
+                hashed_token=hashed_token)
+        except AuthToken.DoesNotExist:
+            raise AuthenticationFailed('invalid auth token')
+        entry = self.entry(auth_token)
+        tokens.set(hashed_token, entry)
+        return entry
+
+    async def afetch(self, hashed_token):
+        try:
+            auth_token = await AuthToken.objects.select_related('user').aget(
+                hashed_token=hashed_token)
+        except AuthToken.DoesNotExist:
+            raise AuthenticationFailed('invalid auth token')
+        entry = self.entry(auth_token)
+        await tokens.aset(hashed_token, entry)
+        return entry
+
+    @staticmethod
+    def entry(auth_token):
+        return (auth_token.user_id, auth_token.user.is_active,
+                (auth_token.created + AuthToken.TOKEN_VALIDITY).timestamp())
+
+    @staticmethod
+    def expired(entry):
+        return entry[2] < time.time()
+
+    @staticmethod
+    def get_user(entry):
+        user_id, is_active, expires = entry
+        if not is_active:
+            raise AuthenticationFailed('invalid auth token')
+        return get_user_model().from_db(DEFAULT_DB_ALIAS,
+                                        ['id', 'is_active'],
+                                        [user_id, is_active])
@@ -0,0 +1,75 @@
+# General
+import time
+from django.conf import settings
+from django.core.cache import caches
+
+# Opply
+from . import replicas
+from .models import Product
+
+MODIFIED_KEY = 'availability:modified'
+
+
+def get_cache():
+    return caches[settings.AVAILABILITY_CACHE]
+
+
+def key(product_id):
+    return f'availability:{product_id}'
+
+
+def get_availability(product_ids, cached_only=False):
+    """ The units in stock of each of the products, as a mapping
+        of product id to quantity, for any number of products with
+        at most one query.
+
+        Quantities come from the cache where they're there, the
+        rest are read in one query and cached, briefly, as stock
+        is the part of a product that changes all the time.
+
+        Note: With cached_only, nothing is read from the database,
+              products not in the cache are just left out.
+
+        Note: Unknown product ids are left out too.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+
+    cache = get_cache()
+    cached = cache.get_many([key(pk) for pk in product_ids])
+    availability = {pk: cached[key(pk)] for pk in product_ids
+                    if key(pk) in cached}
+
+    missing = product_ids - set(availability)
+    if missing and not cached_only:
+        # Not from a replica, which may be behind the invalidation
+        with replicas.primary():
+            fetched = dict(Product.objects.filter(id__in=missing)
+                                          .with_stock()
+                                          .values_list('id', 'stock'))
+        cache.set_many({key(pk): quantity
+                        for pk, quantity in fetched.items()},
+                       settings.AVAILABILITY_CACHE_TIMEOUT)
+        availability.update(fetched)
+    return availability
+
+
+def last_modified():
+    """ When stock last changed, as a timestamp.
+    """
+    cache = get_cache()
+    modified = cache.get(MODIFIED_KEY)
+    if modified is None:
+        modified = time.time()
+        cache.add(MODIFIED_KEY, modified, None)
+    return modified
+
+
+def invalidate(product_ids):
+    """ Forget the cached stock of the products, for when it's
+        changed. Call on commit of the change.
+    """
+    cache = get_cache()
+    cache.delete_many([key(pk) for pk in product_ids])
+    cache.set(MODIFIED_KEY, time.time(), None)
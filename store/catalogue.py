@@ -0,0 +1,149 @@
+# General
+import time
+import uuid
+from hashlib import blake2b
+from urllib.parse import urlencode
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+
+# Opply
+from . import availability, replicas
+from .renderers import FastJSONRenderer
+
+VERSION_KEY = 'catalogue:version'
+# The query parameters of the pages cached, those of pagination and of
+# ProductFilterSerializer, pages with any others aren't cached
+CACHED_PARAMS = {'format', 'page', 'page_size', 'pagination', 'cursor',
+                 'name', 'search', 'min_price', 'max_price', 'in_stock',
+                 'ids'}
+# The longest value of a query parameter of the pages cached
+MAX_PARAM_LENGTH = 100
+
+
+def get_cache():
+    return caches[settings.CATALOGUE_CACHE]
+
+
+def version():
+    """ The current (version, last modified timestamp) of the
+        catalogue, started afresh if the cache has lost it.
+    """
+    cache = get_cache()
+    current = cache.get(VERSION_KEY)
+    if current is None:
+        cache.add(VERSION_KEY, (uuid.uuid4().hex, time.time()), None)
+        current = cache.get(VERSION_KEY)
+    return current
+
+
+def bump():
+    """ Start a new version of the catalogue, evicting the pages
+        cached for the previous ones.
+
+        Note: This is called on commit of anything changing a
+              product, other than its stock. The pages are evicted
+              by clearing settings.CATALOGUE_CACHE, which holds
+              nothing else. They're also keyed on the version read
+              before they were rendered, so a page rendered from
+              data that was about to change, and cached after the
+              clear, can never be served under the new version.
+    """
+    cache = get_cache()
+    cache.clear()
+    cache.set(VERSION_KEY, (uuid.uuid4().hex, time.time()), None)
+
+
+def page_key(current, url, params):
+    """ The key of the page at url, with the query parameters
+        params, a QueryDict, or None if it's not to be cached, as
+        it has parameters other than CACHED_PARAMS, a parameter
+        more than once or one longer than MAX_PARAM_LENGTH.
+
+        Note: The parameters are sorted, so the same page has the
+              same key whatever their order, and hashed, so keys
+              are as long however long the URL.
+    """
+    if not CACHED_PARAMS.issuperset(params):
+        return None
+    query = []
+    for name in sorted(params):
+        values = params.getlist(name)
+        if len(values) > 1 or len(values[0]) > MAX_PARAM_LENGTH:
+            return None
+        query.append((name, values[0]))
+    digest = blake2b(f'{url}?{urlencode(query)}'.encode(), digest_size=16)
+    return f'catalogue:{current[0]}:{digest.hexdigest()}'
+
+
+def get_page(key):
+    return get_cache().get(key)
+
+
+def set_page(key, content):
+    get_cache().set(key, content, settings.CATALOGUE_CACHE_TIMEOUT)
+
+
+def cached_response(request, render):
+    """ Serve a catalogue response from the cache, where render
+        builds the DRF response on a miss.
+
+        What's cached is the cold part of the products, their
+        names and prices, for as long as the catalogue version
+        stands. Stock changes with every order, so quantity_in_stock
+        is filled in on every response, from availability, which
+        has its own short lived cache.
+
+        Responses carry an ETag made of the catalogue version and
+        the stock of the products in them, and the last time
+        either changed as Last-Modified. Conditional GETs that
+        still match get a 304.
+
+        Note: Only JSON responses are cached, other formats go
+              straight to render, as do requests page_key leaves
+              out.
+
+        Note: Pages read from a replica soon after the version
+              started aren't cached, the replica may not have
+              caught up with the change, see replicas.may_be_behind.
+    """
+    if request.accepted_renderer.format != 'json':
+        return render()
+    current = version()
+    key = page_key(current, request.build_absolute_uri(request.path),
+                   request.query_params)
+    if key is None:
+        return render()
+
+    data = get_page(key)
+    if data is None:
+        response = render()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        data = response.data
+        # Not if it may have been read from before the version started
+        if not replicas.may_be_behind(current[1]):
+            set_page(key, data)
+
+    products = data['results'] if 'results' in data else [data]
+    stock = availability.get_availability(
+        product['id'] for product in products)
+    digest = blake2b(repr(sorted(stock.items())).encode(), digest_size=8)
+    etag = quote_etag(f'{current[0]}-{digest.hexdigest()}')
+    last_modified = int(max(current[1], availability.last_modified()))
+
+    response = get_conditional_response(request, etag=etag,
+                                        last_modified=last_modified)
+    if response is None:
+        for product in products:
+            product['quantity_in_stock'] = stock.get(
+                product['id'], product['quantity_in_stock'])
+        response = HttpResponse(FastJSONRenderer().render(data),
+                                content_type='application/json')
+
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    return response
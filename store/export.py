@@ -0,0 +1,153 @@
+# General
+import csv
+import heapq
+import json
+import tempfile
+from itertools import groupby
+from operator import itemgetter
+from django.conf import settings
+from rest_framework import serializers
+
+# Opply
+from .models import ArchivedOrder, OrderProducts
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CSV_HEADER = ['order', 'user', 'datetime', 'status', 'product', 'quantity']
+# Bytes of a spooled export kept in memory, beyond which it's on disk
+SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def order_lines(user=None, since=None, until=None):
+    """ The lines of the orders, with their orders, as tuples of
+        (order id, user id, datetime, status, product id, quantity),
+        ordered by order id then product id.
+
+        Note: The ordering is that of the unique index on the
+              lines, so no sort is needed, however many there are.
+    """
+    lines = OrderProducts.objects.order_by('order_id', 'product_id')
+    if user is not None:
+        lines = lines.filter(order__user=user)
+    if since is not None:
+        lines = lines.filter(order__datetime__gte=since)
+    if until is not None:
+        lines = lines.filter(order__datetime__lt=until)
+    return lines.values_list('order_id', 'order__user_id', 'order__datetime',
+                             'order__status', 'product_id', 'quantity')
+
+
+def archived_lines(orders):
+    """ The lines of orders, rows of archived_orders, as tuples
+        like order_lines', ordered by order id then product id.
+    """
+    for order_id, user_id, datetime, status, lines in orders:
+        for product_id, quantity, *_ in sorted(lines):
+            yield order_id, user_id, datetime, status, product_id, quantity
+
+
+def archived_orders(user=None, since=None, until=None):
+    """ The archived orders, see archive, filtered as order_lines
+        filters the lines, ordered by id.
+    """
+    orders = ArchivedOrder.objects.order_by('id')
+    if user is not None:
+        orders = orders.filter(user=user)
+    if since is not None:
+        orders = orders.filter(datetime__gte=since)
+    if until is not None:
+        orders = orders.filter(datetime__lt=until)
+    return orders.values_list('id', 'user_id', 'datetime', 'status', 'lines')
+
+
+def export_orders(output, chunk_size=None, archived=False, **filters):
+    """ The orders, see order_lines for the filters, as an
+        iterator of chunks of NDJSON, one order per line, or CSV,
+        one order line per row. With archived, the archived orders
+        are merged in by id, see archive, otherwise they're left out.
+
+        The lines are read with a server side cursor, chunk_size
+        rows at a time, and written out as they're read, so the
+        memory used doesn't depend on the number of orders.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    lines = order_lines(**filters).iterator(chunk_size=chunk_size)
+    if archived:
+        lines = heapq.merge(lines, archived_lines(
+            archived_orders(**filters).iterator(chunk_size=chunk_size)),
+            key=itemgetter(0, 4))
+    if output == 'csv':
+        return _csv(lines, chunk_size)
+    return _ndjson(lines, chunk_size)
+
+
+def spool(chunks):
+    """ The chunks, see export_orders, written to a temporary file,
+        in memory up to SPOOL_SIZE bytes then on disk, and rewound
+        to be read.
+
+        Note: It's for ASGI, under which Django 4.1 reads streamed
+              responses in the event loop, where the queries of
+              export_orders can't run, and has no async iterators to
+              stream from instead, they come with Django 4.2. The file
+              is written in the view's thread instead, and read in
+              the event loop, so nothing is sent until the whole
+              export is written, and it takes as much disk.
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    for chunk in chunks:
+        file.write(chunk.encode())
+    file.seek(0)
+    return file
+
+
+class _Echo:
+    """ File like object handing back what's written to it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _csv(lines, chunk_size):
+    writer = csv.writer(_Echo())
+    datetime_field = serializers.DateTimeField()
+
+    def rows():
+        yield writer.writerow(CSV_HEADER)
+        for order_id, user_id, datetime, status, product_id, quantity \
+                in lines:
+            yield writer.writerow([
+                order_id, user_id, datetime_field.to_representation(datetime),
+                status, product_id, quantity])
+    return _chunks(rows(), chunk_size)
+
+
+def _ndjson(lines, chunk_size):
+    datetime_field = serializers.DateTimeField()
+
+    def orders():
+        for order_id, order_lines in groupby(lines, key=itemgetter(0)):
+            first = next(order_lines)
+            yield json.dumps({
+                'id': order_id,
+                'user': first[1],
+                'datetime': datetime_field.to_representation(first[2]),
+                'status': first[3],
+                'products': [{'product': line[4], 'quantity': line[5]}
+                             for line in (first, *order_lines)],
+            }, separators=(',', ':')) + '\n'
+    return _chunks(orders(), chunk_size)
@@ -0,0 +1,321 @@
+# General
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+# Opply
+from . import availability, stock
+from .models import Product, OrderProducts, StockLease
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache():
+    return caches[settings.HOT_STOCK_CACHE]
+
+
+def key(lease_id):
+    return f'hotstock:{lease_id}'
+
+
+class Lease:
+    """ A lease held by this process, the units of it sold so
+        far are counted in the cache, under key(id).
+    """
+
+    def __init__(self, id, product_id, units, expires):
+        self.id = id
+        self.product_id = product_id
+        self.units = units
+        self.expires = expires
+
+    def usable(self):
+        """ Whether units can still be sold from it, they can't
+            from a little before it expires, so the orders in
+            flight are committed before anyone can settle it.
+        """
+        margin = timedelta(seconds=settings.HOT_STOCK_LEASE_MARGIN)
+        return timezone.now() < self.expires - margin
+
+
+class HotStock:
+    """ Sells the stock of hot products, those too popular for
+        the lock on their row, see stock.reserve, from blocks of
+        it leased to this process, see StockLease.
+
+        The units sold from a lease are counted with an atomic
+        increment in the cache, so orders for hot products don't
+        touch the product row at all. A background thread, every
+        settings.HOT_STOCK_FLUSH_INTERVAL seconds:
+
+            - flushes the units used of each lease to the database
+              and renews it,
+            - leases more stock when a lease is running low,
+            - gives up the leases of products no longer hot,
+            - settles the leases that have expired, of any process,
+            - promotes and demotes products every
+              HOT_STOCK_REVIEW_INTERVAL seconds.
+
+        Products are promoted when this process reserves them more
+        than HOT_STOCK_PROMOTE_RATE times a second waiting on their
+        row more than HOT_STOCK_PROMOTE_WAIT_MS on average, and
+        demoted when it sells them fewer than HOT_STOCK_DEMOTE_RATE
+        times a second.
+
+        Note: Nothing is oversold when a process goes away. Its
+              leases' units were taken out of quantity_in_stock
+              when they were leased, and the order lines sold from
+              a lease refer to it. Once a lease expires, it's
+              settled from its lines, the units not in any line go
+              back into quantity_in_stock.
+
+        Note: When a lease runs out, or the cache loses its count,
+              orders fall back to the product row until the thread
+              leases more.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.holder = f'{socket.gethostname()[:40]}:{os.getpid()}:' \
+                      f'{uuid.uuid4().hex[:8]}'
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.leases = {}
+            self.hot = set()
+            self.sold = Counter()
+            self.reviewed = time.monotonic()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and settings.HOT_STOCK_FLUSH_INTERVAL:
+                self._thread = threading.Thread(target=self._run,
+                                                name='hotstock', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.HOT_STOCK_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.cycle()
+            except Exception:
+                logger.exception('Failed flushing hot stock')
+                connections.close_all()
+
+    def take(self, quantities):
+        """ Take the units wanted of the hot products from their
+            leases, returns a mapping of the product ids taken to
+            the id of the lease they were taken from. The rest have
+            to be reserved the usual way, see stock.reserve.
+
+            Note: Call it in the transaction placing the order, and
+                  give_back what was taken if that fails.
+        """
+        if not settings.HOT_STOCK:
+            return {}
+        self.start()
+        cache = get_cache()
+        taken = {}
+        for product_id, quantity in quantities.items():
+            lease = self.leases.get(product_id)
+            if lease is None or not lease.usable():
+                if product_id in self.hot:
+                    self._wake.set()
+                continue
+            try:
+                used = cache.incr(key(lease.id), quantity)
+            except ValueError:
+                # The cache lost the count, the lease is given up
+                # and settled from its lines.
+                self._wake.set()
+                continue
+            if used > lease.units:
+                cache.decr(key(lease.id), quantity)
+                self._wake.set()
+                continue
+            taken[product_id] = lease.id
+            if used * 2 > lease.units:
+                self._wake.set()
+        with self._lock:
+            self.sold.update(taken.keys())
+        return taken
+
+    def give_back(self, taken, quantities):
+        """ Put back the units taken for an order that failed.
+        """
+        cache = get_cache()
+        for product_id, lease_id in taken.items():
+            try:
+                cache.decr(key(lease_id), quantities[product_id])
+            except ValueError:
+                pass
+
+    def cycle(self):
+        self.hot = set(Product.objects.filter(hot=True)
+                                      .values_list('id', flat=True))
+        self.flush()
+        for product_id in sorted(self.hot):
+            lease = self.leases.get(product_id)
+            if lease is None or self._used(lease) * 2 > lease.units:
+                self.lease(product_id)
+        settle_expired()
+        if (time.monotonic() - self.reviewed
+                >= settings.HOT_STOCK_REVIEW_INTERVAL):
+            self.review()
+
+    def _used(self, lease):
+        used = get_cache().get(key(lease.id))
+        return lease.units if used is None else used
+
+    def flush(self):
+        """ Write the units used of each lease to the database and
+            renew it, or give it up if its product isn't hot any
+            more, or its count was lost.
+        """
+        expires = timezone.now() + timedelta(
+            seconds=settings.HOT_STOCK_LEASE_TIMEOUT)
+        for product_id, lease in list(self.leases.items()):
+            used = get_cache().get(key(lease.id))
+            if product_id not in self.hot or used is None:
+                self.release(product_id)
+                continue
+            if lease.usable():
+                renewed = StockLease.objects.filter(
+                    id=lease.id, released=False).update(
+                    used=Greatest('used', used), expires=expires)
+                if renewed:
+                    lease.expires = expires
+            if not lease.usable():
+                # Not renewed in time, it's left to be settled
+                del self.leases[product_id]
+
+    def release(self, product_id):
+        """ Stop selling from the product's lease, it's settled
+            once the orders in flight have been committed.
+        """
+        lease = self.leases.pop(product_id, None)
+        if lease is None:
+            return
+        expires = timezone.now() + timedelta(
+            seconds=settings.HOT_STOCK_LEASE_MARGIN)
+        used = get_cache().get(key(lease.id))
+        StockLease.objects.filter(id=lease.id, released=False).update(
+            used=Greatest('used', used or 0), expires=expires)
+
+    def lease(self, product_id):
+        """ Lease another block of the product's stock, adding it
+            to the lease held, if there is one.
+        """
+        expires = timezone.now() + timedelta(
+            seconds=settings.HOT_STOCK_LEASE_TIMEOUT)
+        current = self.leases.get(product_id)
+        with transaction.atomic():
+            # No key update, so it doesn't hold up the order lines
+            # being inserted for the product, which lock its key
+            available = (Product.objects.select_for_update(no_key=True)
+                                        .filter(id=product_id)
+                                        .values_list('quantity_in_stock',
+                                                     flat=True).first())
+            units = min(available or 0, settings.HOT_STOCK_LEASE_UNITS)
+            if not units:
+                return
+            Product.objects.filter(id=product_id).update(
+                quantity_in_stock=F('quantity_in_stock') - units)
+            if current is not None and StockLease.objects.filter(
+                    id=current.id, released=False).update(
+                    units=F('units') + units, expires=expires):
+                lease = current
+                lease.units += units
+                lease.expires = expires
+            else:
+                row = StockLease.objects.create(
+                    product_id=product_id, holder=self.holder,
+                    units=units, expires=expires)
+                lease = Lease(row.id, product_id, units, expires)
+            get_cache().add(key(lease.id), 0, None)
+        self.leases[product_id] = lease
+
+    def review(self):
+        """ Promote the products this process found contended to
+            hot and demote the hot ones it hardly sold.
+        """
+        elapsed = time.monotonic() - self.reviewed
+        with self._lock:
+            sold, self.sold = self.sold, Counter()
+            self.reviewed = time.monotonic()
+
+        promote = [product_id for product_id, (reservations, wait)
+                   in stock.stats.contention().items()
+                   if reservations / elapsed >= settings.HOT_STOCK_PROMOTE_RATE
+                   and wait / reservations * 1000
+                   >= settings.HOT_STOCK_PROMOTE_WAIT_MS]
+        demote = [product_id for product_id in self.hot
+                  if sold[product_id] / elapsed
+                  < settings.HOT_STOCK_DEMOTE_RATE
+                  and product_id in self.leases]
+        promoted = Product.objects.filter(id__in=promote, hot=False) \
+                                  .update(hot=True)
+        demoted = Product.objects.filter(id__in=demote).update(hot=False)
+        if promoted or demoted:
+            logger.info('Hot stock, promoted %s, demoted %s',
+                        promote, demote)
+        return promote, demote
+
+
+def settle(lease_id):
+    """ Settle an expired lease, the units not sold from it, by
+        its order lines, go back into quantity_in_stock. Returns
+        the number of units put back, or None if it wasn't due.
+    """
+    with transaction.atomic():
+        lease = StockLease.objects.filter(id=lease_id).first()
+        if lease is None:
+            return None
+        # The product, then the lease, as when leasing, without
+        # holding up the order lines referring to either
+        Product.objects.select_for_update(no_key=True) \
+                       .filter(id=lease.product_id).values_list('id').first()
+        lease = StockLease.objects.select_for_update(no_key=True) \
+                                  .get(id=lease_id)
+        if lease.released or lease.expires > timezone.now():
+            return None
+        used = (OrderProducts.objects.filter(lease=lease)
+                                     .aggregate(used=Sum('quantity'))['used']
+                or 0)
+        unused = lease.units - used
+        Product.objects.filter(id=lease.product_id).update(
+            quantity_in_stock=F('quantity_in_stock') + unused)
+        lease.used, lease.released = used, True
+        lease.save(update_fields=['used', 'released'])
+        transaction.on_commit(lambda: availability.invalidate(
+            [lease.product_id]))
+    get_cache().delete(key(lease_id))
+    return unused
+
+
+def settle_expired():
+    """ Settle every lease that has expired, returns how many
+        were settled.
+    """
+    expired = list(StockLease.objects.filter(released=False,
+                                             expires__lte=timezone.now())
+                                     .values_list('id', flat=True))
+    return sum(settle(lease_id) is not None for lease_id in expired)
+
+
+hot_stock = HotStock()
@@ -0,0 +1,105 @@
+# General
+import json
+from datetime import timedelta
+from hashlib import sha256
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+# Opply
+from exceptions import IdempotencyKeyReusedException
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+# Headers of the response kept to be sent again with a replay
+REPLAYED_HEADERS = ('Location', 'Preference-Applied')
+
+
+def get_key(request):
+    """ The request's Idempotency-Key, if it has one.
+    """
+    key = request.headers.get(HEADER)
+    if key is None:
+        return None
+    max_length = IdempotencyKey._meta.get_field('key').max_length
+    if not key or len(key) > max_length:
+        raise ValidationError({HEADER: [f'Must be 1 to {max_length} '
+                                        f'characters.']})
+    return key
+
+
+def fingerprint(request):
+    """ A hash of what was asked for, the method, the path and
+        the parsed body, so the same key can't be reused for
+        another request.
+    """
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return sha256(f'{request.method} {request.path} {body}'
+                  .encode()).hexdigest()
+
+
+def expired():
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TIMEOUT)
+
+
+@transaction.atomic
+def respond_once(request, key, respond):
+    """ Respond to the request with respond, once for the key,
+        repeats get the first response again, with the header
+        Idempotent-Replayed: true, without respond being called.
+
+        The key is inserted in the same transaction as whatever
+        respond does, so a concurrent repeat inserting it again
+        waits on the unique constraint until the first commits,
+        and then replays its response, or, if the first failed
+        and rolled back, goes ahead itself.
+
+        Note: Only successful responses are kept. An error, raised
+              out of respond or returned as a 4xx or 5xx response,
+              rolls back the key with everything else, so a retry
+              is tried afresh.
+    """
+    hashed = fingerprint(request)
+    record, created = IdempotencyKey.objects.get_or_create(
+        user=request.user, key=key, defaults={'fingerprint': hashed})
+
+    if not created and record.created < expired():
+        # Expired but not purged yet, it's as good as new
+        record.fingerprint, record.created = hashed, timezone.now()
+        created = True
+    if not created:
+        if record.fingerprint != hashed:
+            raise IdempotencyKeyReusedException()
+        return Response(record.response_body, status=record.status_code,
+                        headers={**record.response_headers,
+                                 'Idempotent-Replayed': 'true'})
+
+    response = respond()
+    if response.status_code >= 400:
+        transaction.set_rollback(True)
+        return response
+    record.status_code = response.status_code
+    record.response_body = response.data
+    record.response_headers = {header: response.headers[header]
+                               for header in REPLAYED_HEADERS
+                               if header in response.headers}
+    record.save()
+    return response
+
+
+def purge(batch_size=None):
+    """ Delete the expired keys, a batch at a time, returns how
+        many were deleted.
+    """
+    batch_size = batch_size or settings.IDEMPOTENCY_PURGE_BATCH_SIZE
+    cutoff = expired()
+    total = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(created__lt=cutoff)
+                                         .values_list('id', flat=True)
+                                         [:batch_size])
+        if not ids:
+            return total
+        total += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,176 @@
+# General
+import csv
+import json
+from itertools import islice
+from operator import itemgetter
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from rest_framework import serializers
+
+# Opply
+from . import availability, catalogue, ledger
+from .models import Product, StockMovement
+from .serializers import ProductImportSerializer, StockDeltaSerializer
+
+
+def read_rows(file, input_format):
+    """ The rows of a CSV file, with a header, or an NDJSON file,
+        one object per line, as (line number, dict) pairs, read
+        lazily.
+    """
+    if input_format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_num, row if isinstance(row, dict) else line
+
+
+def validate(rows, serializer):
+    """ Split a batch of rows into the valid ones, validated by
+        serializer, and the rejected ones, as (line number, errors),
+        along with duplicate names, which are rejected after the
+        first.
+    """
+    valid, rejected, names = [], [], set()
+    for line_num, row in rows:
+        if not isinstance(row, dict):
+            rejected.append((line_num, {'non_field_errors':
+                                        ['Expected an object.']}))
+            continue
+        try:
+            data = serializer.run_validation(row)
+        except serializers.ValidationError as e:
+            rejected.append((line_num, e.detail))
+            continue
+        if data['name'] in names:
+            rejected.append((line_num, {'name': ['Duplicate name.']}))
+            continue
+        names.add(data['name'])
+        valid.append((line_num, data))
+    return valid, rejected
+
+
+def upsert(valid):
+    """ Create the products, or update the price and stock of
+        those that exist, by name, in one statement, and write the
+        changes to their stock to the ledger. Returns the rejected
+        rows, and the ids of the products.
+
+        The stock of a product isn't only its row's when it's
+        sharded or hot, see ledger.with_stock, so the row is set to
+        the new stock less the units held in its slots and leases,
+        which are left as they are. Rows with less stock than that
+        are rejected, see stock.rebalance and the hot_stock command
+        to move those units back into the row first.
+
+        Note: The products that exist are locked first, so their
+              stock doesn't change under the new one, see
+              signals.product_saving.
+    """
+    names = [data['name'] for line_num, data in valid]
+    before, held = {}, {}
+    for name, row, whole in ledger.with_stock(
+            Product.objects.select_for_update(no_key=True)
+                           .filter(name__in=names)) \
+            .values_list('name', 'quantity_in_stock', 'stock'):
+        before[name] = row
+        if whole != row:
+            held[name] = whole - row
+
+    rejected = [(line_num, {'quantity_in_stock': [
+                    f'Ensure this value is greater than or equal to '
+                    f'{held[data["name"]]}, the units held in the '
+                    f'product\'s stock slots and leases.']})
+                for line_num, data in valid
+                if data['quantity_in_stock'] < held.get(data['name'], 0)]
+    valid = [(line_num, data) for line_num, data in valid
+             if data['quantity_in_stock'] >= held.get(data['name'], 0)]
+    if not valid:
+        return rejected, []
+    names = [data['name'] for line_num, data in valid]
+
+    Product.objects.bulk_create(
+        [Product(**{**data, 'quantity_in_stock': data['quantity_in_stock']
+                    - held.get(data['name'], 0)})
+         for line_num, data in valid],
+        update_conflicts=True, unique_fields=['name'],
+        update_fields=['price', 'quantity_in_stock'])
+    ids = dict(Product.objects.filter(name__in=names)
+                              .values_list('name', 'id'))
+    stock = {data['name']: data['quantity_in_stock']
+             for line_num, data in valid}
+    ledger.record(StockMovement.RESTOCK,
+                  {ids[name]: quantity for name, quantity in stock.items()
+                   if name not in before})
+    ledger.record(StockMovement.ADJUSTMENT,
+                  {ids[name]: quantity - before[name] - held.get(name, 0)
+                   for name, quantity in stock.items() if name in before})
+    return rejected, list(ids.values())
+
+
+def add_stock(valid):
+    """ Add units to the stock of the products, by name, in one
+        statement, without reading the stock first, and write them
+        to the ledger. Returns the rejected rows, and the ids of
+        the products.
+    """
+    names = {data['name'] for line_num, data in valid}
+    ids = dict(Product.objects.filter(name__in=names)
+                              .values_list('name', 'id'))
+    rejected = [(line_num, {'name': ['Product does not exist.']})
+                for line_num, data in valid if data['name'] not in ids]
+    deltas = {data['name']: data['quantity'] for line_num, data in valid
+              if data['name'] in ids}
+    if deltas:
+        Product.objects.filter(name__in=deltas).update(
+            quantity_in_stock=F('quantity_in_stock') + Case(
+                *[When(name=name, then=Value(quantity))
+                  for name, quantity in deltas.items()]))
+        ledger.record(StockMovement.RESTOCK,
+                      {ids[name]: quantity
+                       for name, quantity in deltas.items()})
+    return rejected, [ids[name] for name in deltas]
+
+
+def import_products(rows, stock_delta=False, batch_size=None):
+    """ Import products from rows, see read_rows, in batches,
+        validated with the rules of ProductSerializer, and each
+        written with one statement. Yields (imported, rejected)
+        per batch, where rejected is a list of (line, errors).
+
+        With stock_delta, the rows are a name and a quantity, which
+        is added to the product's stock, see add_stock, otherwise
+        products are created, or updated if they exist, see upsert.
+
+        Note: Each batch is committed on its own, so a failure
+              part way through leaves the batches before it.
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    serializer, write = ((StockDeltaSerializer(), add_stock) if stock_delta
+                         else (ProductImportSerializer(), upsert))
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        valid, rejected = validate(batch, serializer)
+        if valid:
+            with transaction.atomic():
+                write_rejected, ids = write(valid)
+
+                # Bulk writes send no signals, see signals.product_changed
+                def changed(ids=ids):
+                    if not stock_delta:
+                        catalogue.bump()
+                    availability.invalidate(ids)
+
+                transaction.on_commit(changed)
+            rejected += write_rejected
+        yield len(batch) - len(rejected), sorted(rejected,
+                                                 key=itemgetter(0))
@@ -0,0 +1,166 @@
+# General
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+# Opply
+from .models import (OrderProducts, Product, StockLease, StockMovement,
+                     StockShard, StockSnapshot)
+
+
+def record(kind, deltas):
+    """ Write a movement of each of the products, deltas being a
+        mapping of product id to units added, or taken when
+        negative, in one statement. Products that didn't move are
+        left out.
+
+        Note: Call it in the transaction changing the stock, so
+              the two are committed together.
+    """
+    StockMovement.objects.bulk_create(
+        [StockMovement(product_id=product_id, kind=kind, quantity=quantity)
+         for product_id, quantity in sorted(deltas.items()) if quantity])
+
+
+def record_sales(orders):
+    """ Write the units sold to each of the orders, orders being
+        (order id, quantities) pairs, quantities a mapping of
+        product id to units, in one statement.
+    """
+    StockMovement.objects.bulk_create(
+        [StockMovement(product_id=product_id, kind=StockMovement.SALE,
+                       quantity=-quantity, order_id=order_id)
+         for order_id, quantities in orders
+         for product_id, quantity in quantities.items()])
+
+
+def _sum(queryset, group, field):
+    return Subquery(queryset.values(group).annotate(units=Sum(field))
+                            .values('units'))
+
+
+def with_stock(products):
+    """ Annotate the products with their whole stock, stock, its
+        quantity_in_stock, its slots and the units left of its
+        leases.
+
+        Note: Unlike ProductQuerySet.with_stock, the units left of
+              a lease are counted from its order lines, rather than
+              as last flushed, and the slots and leases are counted
+              whatever the settings, so it's exact.
+    """
+    shards = StockShard.objects.filter(product=OuterRef('pk'))
+    leases = StockLease.objects.filter(product=OuterRef('pk'),
+                                       released=False)
+    sold = OrderProducts.objects.filter(lease__product=OuterRef('pk'),
+                                        lease__released=False)
+    return products.annotate(
+        stock=F('quantity_in_stock')
+        + Coalesce(_sum(shards, 'product', 'quantity'), 0)
+        + Coalesce(_sum(leases, 'product', 'units'), 0)
+        - Coalesce(_sum(sold, 'lease__product', 'quantity'), 0))
+
+
+def with_balances(products, until=None):
+    """ Annotate the products with their stock by the ledger,
+        balance, the quantity of their latest snapshot plus their
+        movements since, and those movements' units, moved, None
+        if there were none. With until, only the movements up to
+        that id are counted.
+    """
+    snapshots = (StockSnapshot.objects.filter(product=OuterRef('pk'))
+                                      .order_by('-movement_id'))
+    movements = StockMovement.objects.filter(
+        product=OuterRef('pk'), id__gt=OuterRef('snapshot_id'))
+    if until is not None:
+        snapshots = snapshots.filter(movement_id__lte=until)
+        movements = movements.filter(id__lte=until)
+    return (products
+            .annotate(snapshot_id=Coalesce(
+                          Subquery(snapshots.values('movement_id')[:1]), 0),
+                      snapshot=Coalesce(
+                          Subquery(snapshots.values('quantity')[:1]), 0))
+            .annotate(moved=_sum(movements, 'product', 'quantity'))
+            .annotate(balance=F('snapshot') + Coalesce('moved', 0)))
+
+
+def balances(product_ids):
+    """ The stock of the products by the ledger, as a mapping of
+        product id to units, leaving out products that don't exist.
+    """
+    return dict(with_balances(Product.objects.filter(id__in=product_ids))
+                .values_list('id', 'balance'))
+
+
+def _chunks(products, chunk_size, *fields):
+    """ The products, ordered by id, as lists of chunk_size rows of
+        their id and fields, each read with its own query.
+    """
+    last_id = 0
+    while True:
+        rows = list(products.filter(id__gt=last_id).order_by('id')
+                            .values_list('id', *fields)[:chunk_size])
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+
+
+def snapshot(chunk_size=None):
+    """ Take a snapshot of the stock by the ledger of every product
+        which moved since its last one, a chunk of products at a
+        time, returns how many were taken.
+
+        Note: The ids of movements are handed out before they're
+              committed, so one can be committed after a later one.
+              Snapshots only go up to the last movement from more
+              than settings.STOCK_SNAPSHOT_MARGIN seconds ago, so
+              none are passed over.
+    """
+    chunk_size = chunk_size or settings.STOCK_LEDGER_CHUNK_SIZE
+    until = (StockMovement.objects
+             .filter(created__lte=timezone.now() - timedelta(
+                 seconds=settings.STOCK_SNAPSHOT_MARGIN))
+             .order_by('-id').values_list('id', flat=True).first())
+    if until is None:
+        return 0
+    moved = with_balances(Product.objects, until).filter(moved__isnull=False)
+    taken = 0
+    for rows in _chunks(moved, chunk_size, 'balance'):
+        StockSnapshot.objects.bulk_create(
+            [StockSnapshot(product_id=product_id, quantity=balance,
+                           movement_id=until)
+             for product_id, balance in rows])
+        taken += len(rows)
+    return taken
+
+
+def reconcile(chunk_size=None, adjust=False):
+    """ Check the stock of every product against the ledger, a
+        chunk of products at a time, yielding (checked, drifted)
+        per chunk, drifted being a list of (product id, balance,
+        stock) for the products whose whole stock, see with_stock,
+        doesn't match their balance, see with_balances.
+
+        With adjust, an adjustment is written for each of those,
+        so the ledger matches the stock again.
+
+        Note: Each chunk is read with a single query, so its stock
+              and its movements are as of the same moment, orders
+              in flight are left out of both.
+    """
+    chunk_size = chunk_size or settings.STOCK_LEDGER_CHUNK_SIZE
+    products = with_balances(with_stock(Product.objects))
+    for rows in _chunks(products, chunk_size, 'balance', 'stock'):
+        drifted = [(product_id, balance, stock)
+                   for product_id, balance, stock in rows
+                   if balance != stock]
+        if adjust:
+            # Orders since took from both alike, so the difference
+            # still holds
+            record(StockMovement.ADJUSTMENT,
+                   {product_id: stock - balance
+                    for product_id, balance, stock in drifted})
+        yield len(rows), drifted
@@ -0,0 +1,31 @@
+# General
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+# Opply
+from store import archive
+
+
+class Command(BaseCommand):
+    help = ('Move the orders older than settings.ORDER_ARCHIVE_AFTER_DAYS, '
+            'or placed before --before, to the archive, a batch at a time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=self.datetime,
+                            help='Orders placed before, ISO 8601.')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    @staticmethod
+    def datetime(value):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(value)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def handle(self, *args, **options):
+        before = options['before'] or archive.cutoff()
+        archived = archive.archive(before, options['batch_size'])
+        self.stdout.write(f'Archived {archived} orders')
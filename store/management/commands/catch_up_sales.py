@@ -0,0 +1,33 @@
+# General
+import time
+from django.core.management.base import BaseCommand
+
+# Opply
+from store import sales
+
+
+class Command(BaseCommand):
+    help = ('Add the order lines to the sales of each product, a batch at '
+            'a time, polling for new ones until stopped. It picks up where '
+            'it left off if it is stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Stop once it has caught up.')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds between polls when caught up.')
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                done = sales.catch_up(options['batch_size'])
+                total += done
+                if not done:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'Counted {total} lines')
@@ -0,0 +1,59 @@
+# General
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+# Opply
+from store import export
+
+
+class Command(BaseCommand):
+    help = ('Export orders as NDJSON, one order per line, or CSV, one '
+            'order line per row, streamed to stdout or a file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=['ndjson', 'csv'],
+                            default='ndjson')
+        parser.add_argument('--user', help='Username or id, defaults to '
+                                           'the orders of every user.')
+        parser.add_argument('--since', type=self.datetime,
+                            help='Orders placed at or after, ISO 8601.')
+        parser.add_argument('--until', type=self.datetime,
+                            help='Orders placed before, ISO 8601.')
+        parser.add_argument('--archived', action='store_true',
+                            help='Include the archived orders.')
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--file', help='Write to a file, not stdout.')
+
+    @staticmethod
+    def datetime(value):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(value)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            users = get_user_model().objects
+            lookup = ({'id': options['user']} if options['user'].isdigit()
+                      else {'username': options['user']})
+            try:
+                user = users.get(**lookup).id
+            except get_user_model().DoesNotExist:
+                raise CommandError(f'User {options["user"]} does not exist.')
+
+        chunks = export.export_orders(options['output'],
+                                      chunk_size=options['chunk_size'],
+                                      archived=options['archived'],
+                                      user=user, since=options['since'],
+                                      until=options['until'])
+        if options['file']:
+            with open(options['file'], 'w', newline='') as f:
+                f.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,44 @@
+# General
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, Sum
+
+# Opply
+from store import hotstock
+from store.models import Product, StockLease
+
+
+class Command(BaseCommand):
+    help = ('Promote products to hot stock, demote them, settle the '
+            'expired leases of hot stock, e.g. of processes that went '
+            'away, or list the hot products and their leases, see '
+            'settings.HOT_STOCK.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('action',
+                            choices=['promote', 'demote', 'settle', 'status'])
+        parser.add_argument('product_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        action, product_ids = options['action'], options['product_ids']
+        if action in ('promote', 'demote'):
+            if not product_ids:
+                raise CommandError('Give some product ids.')
+            updated = Product.objects.filter(id__in=product_ids).update(
+                hot=action == 'promote')
+            self.stdout.write(f'{action.capitalize()}d {updated} products')
+        elif action == 'settle':
+            settled = hotstock.settle_expired()
+            self.stdout.write(f'Settled {settled} leases')
+        else:
+            leases = dict(
+                (product_id, (count, units)) for product_id, count, units in
+                StockLease.objects.filter(released=False)
+                                  .values('product_id')
+                                  .annotate(count=Count('id'),
+                                            left=Sum(F('units') - F('used')))
+                                  .values_list('product_id', 'count', 'left'))
+            for product in Product.objects.filter(hot=True).order_by('id'):
+                count, units = leases.get(product.id, (0, 0))
+                self.stdout.write(f'Product {product.id}: '
+                                  f'{product.quantity_in_stock} in stock, '
+                                  f'{units} in {count} leases')
@@ -0,0 +1,70 @@
+# General
+import json
+import os
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+# Opply
+from store import importer
+
+
+class Command(BaseCommand):
+    help = ('Import products from a CSV file, with a header, or an NDJSON '
+            'file, one product per line, creating them or updating them '
+            'by name. With --stock-delta, add units to their stock.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='The file to import, - for stdin.')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Defaults to the extension of the file.')
+        parser.add_argument('--stock-delta', action='store_true',
+                            help='Rows are a name and a quantity to add to '
+                                 'the stock of the product.')
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--rejects',
+                            help='Write the rejected rows to this file, as '
+                                 'NDJSON, rather than to stderr.')
+
+    def handle(self, *args, **options):
+        input_format = options['format']
+        if input_format is None:
+            extension = os.path.splitext(options['file'])[1].lstrip('.')
+            if extension not in ('csv', 'ndjson', 'jsonl'):
+                raise CommandError('Give the --format of the file.')
+            input_format = 'csv' if extension == 'csv' else 'ndjson'
+
+        try:
+            file = (sys.stdin if options['file'] == '-'
+                    else open(options['file'], newline=''))
+        except OSError as e:
+            raise CommandError(e)
+
+        rejects = open(options['rejects'], 'w') if options['rejects'] \
+            else None
+        imported = rejected = 0
+        start = time.perf_counter()
+        try:
+            for batch_imported, batch_rejected in importer.import_products(
+                    importer.read_rows(file, input_format),
+                    stock_delta=options['stock_delta'],
+                    batch_size=options['batch_size']):
+                imported += batch_imported
+                rejected += len(batch_rejected)
+                for line_num, errors in batch_rejected:
+                    if rejects:
+                        rejects.write(json.dumps({'line': line_num,
+                                                  'errors': errors}) + '\n')
+                    else:
+                        self.stderr.write(f'Line {line_num}: '
+                                          f'{json.dumps(errors)}')
+        finally:
+            if file is not sys.stdin:
+                file.close()
+            if rejects:
+                rejects.close()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'Imported {imported} rows, rejected {rejected}, '
+                          f'in {elapsed:.2f}s, '
+                          f'{(imported + rejected) / elapsed:.0f} rows/s')
@@ -0,0 +1,34 @@
+# General
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Opply
+from store import orders
+
+
+class Command(BaseCommand):
+    help = ('Confirm or reject pending orders, those placed with '
+            'Prefer: respond-async, polling for new ones until stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Stop once there are no pending orders.')
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.ORDER_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds between polls when idle.')
+
+    def handle(self, *args, **options):
+        processed = 0
+        try:
+            while True:
+                batch = orders.process_pending(options['batch_size'])
+                processed += batch
+                if not batch:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'Processed {processed} orders')
@@ -0,0 +1,17 @@
+# General
+from django.core.management.base import BaseCommand
+
+# Opply
+from store import idempotency
+
+
+class Command(BaseCommand):
+    help = ('Delete the Idempotency-Keys older than '
+            'settings.IDEMPOTENCY_KEY_TIMEOUT, a batch at a time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        purged = idempotency.purge(options['batch_size'])
+        self.stdout.write(f'Purged {purged} keys')
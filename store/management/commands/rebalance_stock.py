@@ -0,0 +1,51 @@
+# General
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+# Opply
+from store import stock
+from store.models import Product, StockShard
+
+
+class Command(BaseCommand):
+    help = ('Spread the stock of products evenly over a number of stock '
+            'shards, see settings.STOCK_SHARDING.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='*', type=int)
+        parser.add_argument('--all', action='store_true',
+                            help='Rebalance every sharded product.')
+        parser.add_argument('--shards', type=int, default=None,
+                            help='The number of shards, 0 moves the stock '
+                                 'back into the product. Defaults to the '
+                                 'number of shards the product has, or '
+                                 'settings.STOCK_SHARDS if it has none.')
+
+    def handle(self, *args, **options):
+        if options['shards'] is not None and options['shards'] < 0:
+            raise CommandError('--shards must not be negative.')
+        if not settings.STOCK_SHARDING and options['shards'] != 0:
+            # The slots would be left out of the stock, see stock.reserve
+            raise CommandError('Stock sharding is off, see '
+                               'settings.STOCK_SHARDING, only --shards 0 '
+                               'can be used.')
+
+        current = dict(StockShard.objects.values('product_id')
+                                         .annotate(shards=Count('id'))
+                                         .values_list('product_id', 'shards'))
+        product_ids = options['product_ids']
+        if options['all']:
+            product_ids = sorted(current)
+        if not product_ids:
+            raise CommandError('Give some product ids, or --all.')
+
+        for product_id in product_ids:
+            shards = options['shards']
+            if shards is None:
+                shards = current.get(product_id, settings.STOCK_SHARDS)
+            try:
+                stock.rebalance(product_id, shards)
+            except Product.DoesNotExist:
+                raise CommandError(f'Product {product_id} does not exist.')
+            self.stdout.write(f'Product {product_id}: {shards} shards')
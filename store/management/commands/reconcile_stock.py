@@ -0,0 +1,34 @@
+# General
+import time
+from django.core.management.base import BaseCommand
+
+# Opply
+from store import ledger
+
+
+class Command(BaseCommand):
+    help = ('Check the stock of every product against the ledger, a chunk '
+            'of products at a time, listing those which drifted. With '
+            '--adjust, write adjustments so the ledger matches the stock.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--adjust', action='store_true',
+                            help='Write an adjustment for each product '
+                                 'which drifted.')
+
+    def handle(self, *args, **options):
+        checked = drifted = 0
+        start = time.perf_counter()
+        for chunk_checked, chunk_drifted in ledger.reconcile(
+                options['chunk_size'], options['adjust']):
+            checked += chunk_checked
+            drifted += len(chunk_drifted)
+            for product_id, balance, stock in chunk_drifted:
+                self.stdout.write(f'Product {product_id}: {stock} in stock, '
+                                  f'{balance} by the ledger')
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'Checked {checked} products, {drifted} drifted'
+                          + (', adjusted' if options['adjust'] and drifted
+                             else '')
+                          + f', in {elapsed:.2f}s')
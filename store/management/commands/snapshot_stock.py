@@ -0,0 +1,17 @@
+# General
+from django.core.management.base import BaseCommand
+
+# Opply
+from store import ledger
+
+
+class Command(BaseCommand):
+    help = ('Take a snapshot of the stock by the ledger of every product '
+            'which moved since its last one, a chunk of products at a time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        taken = ledger.snapshot(options['chunk_size'])
+        self.stdout.write(f'Took {taken} snapshots')
@@ -0,0 +1,34 @@
+# General
+from django.core.management.base import BaseCommand
+
+# Opply
+from store import sales
+
+
+class Command(BaseCommand):
+    help = 'Report the products low on stock and the top sellers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=int, default=None,
+                            help='Products with at most this many units '
+                                 'in stock are low on stock.')
+        parser.add_argument('--days', type=int, default=None,
+                            help='Sales over this many days.')
+        parser.add_argument('--limit', type=int, default=None)
+
+    def handle(self, *args, **options):
+        days, limit = options['days'], options['limit']
+
+        self.stdout.write('Low stock')
+        for product in sales.low_stock(options['threshold'], days, limit):
+            days_left = ('-' if product['days_left'] is None
+                         else f'{product["days_left"]:.1f}')
+            self.stdout.write(f'{product["id"]:>8}  {product["name"]:<64}'
+                              f'{product["quantity_in_stock"]:>8} in stock'
+                              f'{product["per_day"]:>8.1f}/day'
+                              f'{days_left:>8} days left')
+
+        self.stdout.write('Top sellers')
+        for product in sales.top_sellers(days, limit):
+            self.stdout.write(f'{product["id"]:>8}  {product["name"]:<64}'
+                              f'{product["units"]:>8} sold')
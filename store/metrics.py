@@ -0,0 +1,151 @@
+# General
+import bisect
+import threading
+import time
+from collections import defaultdict
+from django.conf import settings
+
+# Upper bounds of the buckets of each of the measurements of a request
+BUCKETS = {
+    'duration_ms': (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500,
+                    5000, 10000),
+    'db_queries': (0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+    'db_ms': (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000),
+    'serialize_ms': (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100),
+    'response_bytes': (256, 1024, 4096, 16384, 65536, 262144, 1048576,
+                       4194304),
+}
+
+
+class Histogram:
+    """ Counts of observations by bucket, since the process
+        started and over a rolling window of the last
+        settings.PERF_WINDOW seconds.
+
+        The window is kept as settings.PERF_WINDOW_SLOTS slots of
+        counts, each covering an equal part of it, the oldest is
+        reused once it's fallen out of the window, so a window is
+        the last PERF_WINDOW seconds give or take a slot.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.slots = {}
+
+    def observe(self, value, now):
+        i = bisect.bisect_left(self.buckets, value)
+        self.counts[i] += 1
+        self.sum += value
+
+        width = settings.PERF_WINDOW / settings.PERF_WINDOW_SLOTS
+        index = int(now // width)
+        slot = self.slots.get(index % settings.PERF_WINDOW_SLOTS)
+        if slot is None or slot[0] != index:
+            slot = [index, [0] * len(self.counts), 0.0]
+            self.slots[index % settings.PERF_WINDOW_SLOTS] = slot
+        slot[1][i] += 1
+        slot[2] += value
+
+    def window(self, now):
+        """ The counts by bucket and sum of the observations in
+            the window.
+        """
+        width = settings.PERF_WINDOW / settings.PERF_WINDOW_SLOTS
+        oldest = int(now // width) - settings.PERF_WINDOW_SLOTS
+        counts, total = [0] * len(self.counts), 0.0
+        for index, slot_counts, slot_sum in self.slots.values():
+            if index > oldest:
+                counts = [a + b for a, b in zip(counts, slot_counts)]
+                total += slot_sum
+        return counts, total
+
+    def quantile(self, counts, q):
+        """ The q quantile estimated from counts by bucket, by
+            interpolating within the bucket it falls in, as
+            prometheus' histogram_quantile does.
+        """
+        rank = q * sum(counts)
+        if not rank:
+            return None
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0
+                return lower + (self.buckets[i] - lower) * (
+                    (rank - seen) / count)
+            seen += count
+
+    def snapshot(self, now):
+        counts, total = self.window(now)
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'sum': self.sum,
+            'count': sum(self.counts),
+            'window': {
+                'counts': counts,
+                'sum': total,
+                'count': sum(counts),
+                'p50': self.quantile(counts, 0.5),
+                'p95': self.quantile(counts, 0.95),
+                'p99': self.quantile(counts, 0.99),
+            },
+        }
+
+
+class RequestMetrics:
+    """ In process histograms of the measurements of requests,
+        by route and method, see middleware.PerformanceMiddleware.
+
+        Note: Every process has its own, a scrape of the metrics
+              endpoint only sees the process that served it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.routes = defaultdict(dict)
+            self.statuses = defaultdict(int)
+
+    def record(self, route, method, status, measurements):
+        """ Add a request's measurements, a dict of some or all
+            of those in BUCKETS, not being sampled leaves out the
+            ones about the database and serialization.
+        """
+        now = time.time()
+        with self._lock:
+            histograms = self.routes[route, method]
+            for name, value in measurements.items():
+                if name not in histograms:
+                    histograms[name] = Histogram(BUCKETS[name])
+                histograms[name].observe(value, now)
+            self.statuses[route, method, status] += 1
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'started': self.started,
+                'window_seconds': settings.PERF_WINDOW,
+                'routes': [{
+                    'route': route,
+                    'method': method,
+                    'statuses': {status: count for (r, m, status), count
+                                 in sorted(self.statuses.items())
+                                 if (r, m) == (route, method)},
+                    **{name: histogram.snapshot(now)
+                       for name, histogram in histograms.items()},
+                } for (route, method), histograms
+                    in sorted(self.routes.items())],
+            }
+
+
+metrics = RequestMetrics()
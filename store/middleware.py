@@ -0,0 +1,147 @@
+# General
+import asyncio
+import logging
+import random
+import time
+from asgiref.sync import sync_to_async
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+# Opply
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryTimer:
+    """ Database execute wrapper counting the queries of a
+        request and the time spent in them, and logging those
+        slower than settings.PERF_SLOW_QUERY_MS.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.seconds += elapsed
+            if elapsed * 1000 >= settings.PERF_SLOW_QUERY_MS:
+                logger.warning('Slow query, %.1fms, in %s %s: %s',
+                               elapsed * 1000, self.request.method,
+                               self.request.path, sql)
+
+
+class PerformanceMiddleware:
+    """ Measures every request, its wall time and response size,
+        and for a sample of settings.PERF_SAMPLE_RATE of them its
+        queries, the time spent in them and in rendering the
+        response. They're added to the histograms of the request's
+        route, see metrics, and with settings.PERF_SERVER_TIMING
+        sent back in a Server-Timing header, e.g.
+
+            Server-Timing: total;dur=12.1, db;dur=4.2;desc="3 queries",
+                serialize;dur=0.8
+
+        Note: The time of a streaming response is the time to
+              start it, its size isn't known so isn't recorded.
+
+        Note: Rendering is only timed for DRF responses, which are
+              rendered after the view returns. It's part of the
+              view's time for responses rendered in the view.
+
+        Note: It's async as well as sync, so under ASGI the async
+              views are still served in the event loop, rather than
+              every request being handed to a thread for it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # So the handler awaits it, as for MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        if random.random() < settings.PERF_SAMPLE_RATE:
+            with self.timing(request):
+                response = self.get_response(request)
+        else:
+            response = self.get_response(request)
+        return self.record(request, response, start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        if random.random() < settings.PERF_SAMPLE_RATE:
+            # The queries run in the thread of sync_to_async, on its
+            # connections rather than the event loop's
+            timing = await sync_to_async(self.timing)(request)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(timing.close)()
+        else:
+            response = await self.get_response(request)
+        return self.record(request, response, start)
+
+    def timing(self, request):
+        """ The context timing the queries of the request, on the
+            connections of the thread it's called in.
+        """
+        request.query_timer = QueryTimer(request)
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(
+                connection.execute_wrapper(request.query_timer))
+        return stack
+
+    def record(self, request, response, start):
+        """ Record the measurements of the request, from start.
+        """
+        total = time.perf_counter() - start
+        sampled = hasattr(request, 'query_timer')
+
+        measurements = {'duration_ms': total * 1000}
+        if not response.streaming:
+            measurements['response_bytes'] = len(response.content)
+        timings = [f'total;dur={total * 1000:.1f}']
+        if sampled:
+            timer = request.query_timer
+            serialize = getattr(request, 'serialize_seconds', 0.0)
+            measurements.update(db_queries=timer.queries,
+                                db_ms=timer.seconds * 1000,
+                                serialize_ms=serialize * 1000)
+            timings += [f'db;dur={timer.seconds * 1000:.1f};'
+                        f'desc="{timer.queries} queries"',
+                        f'serialize;dur={serialize * 1000:.1f}']
+
+        match = request.resolver_match
+        metrics.record(match.route if match else None, request.method,
+                       response.status_code, measurements)
+        if settings.PERF_SERVER_TIMING:
+            response.headers['Server-Timing'] = ', '.join(timings)
+        return response
+
+    def process_template_response(self, request, response):
+        """ Time the rendering of DRF responses, which happens
+            after this.
+        """
+        if hasattr(request, 'query_timer'):
+            start = time.perf_counter()
+
+            def rendered(response):
+                request.serialize_seconds = time.perf_counter() - start
+            response.add_post_render_callback(rendered)
+        return response
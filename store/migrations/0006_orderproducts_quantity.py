@@ -0,0 +1,19 @@
+# Generated by Django 4.1.3 on 2026-10-18 08:14
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_remove_order_products_alter_orderproducts_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderproducts',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
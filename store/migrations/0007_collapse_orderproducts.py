@@ -0,0 +1,55 @@
+# Generated by Django 4.1.3 on 2026-10-18 08:14
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def collapse_order_products(apps, schema_editor):
+    """ Collapse the rows of each (order, product) pair, there
+        used to be one row per unit, into the first of them,
+        carrying the number of units as its quantity.
+    """
+    order_products_model = apps.get_model('store', 'OrderProducts')
+
+    duplicates = (order_products_model.objects
+                  .values('order_id', 'product_id')
+                  .annotate(rows=Count('id'), units=Sum('quantity'),
+                            keep=Min('id'))
+                  .filter(rows__gt=1)
+                  .order_by())
+    for d in duplicates.iterator():
+        order_products_model.objects.filter(id=d['keep']).update(
+            quantity=d['units'])
+        order_products_model.objects.filter(
+            order_id=d['order_id'], product_id=d['product_id']
+        ).exclude(id=d['keep']).delete()
+
+
+def expand_order_products(apps, schema_editor):
+    """ Reverse of the above, back to one row per unit.
+    """
+    order_products_model = apps.get_model('store', 'OrderProducts')
+
+    lines = order_products_model.objects.filter(quantity__gt=1)
+    for line in lines.iterator():
+        order_products_model.objects.bulk_create(
+            [order_products_model(order_id=line.order_id,
+                                  product_id=line.product_id)
+             for _ in range(line.quantity - 1)])
+    lines.update(quantity=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_orderproducts_quantity'),
+    ]
+
+    operations = [
+        migrations.RunPython(collapse_order_products,
+                             expand_order_products),
+        migrations.AddConstraint(
+            model_name='orderproducts',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='unique_order_product'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.3 on 2026-10-18 08:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_collapse_orderproducts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'datetime', 'id'], name='order_user_datetime_id'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.1.3 on 2026-10-18 08:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Max
+
+
+def start_backfill(apps, schema_editor):
+    """ Sales are recorded as orders are placed from here on, the
+        order lines up to here are left to manage.py backfill_sales.
+    """
+    order_products_model = apps.get_model('store', 'OrderProducts')
+    sales_backfill_model = apps.get_model('store', 'SalesBackfill')
+
+    until_id = order_products_model.objects.aggregate(
+        until_id=Max('id'))['until_id'] or 0
+    sales_backfill_model.objects.create(until_id=until_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_order_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesBackfill',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('until_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales', to='store.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Product sales',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productsales',
+            index=models.Index(fields=['day', 'product', 'units'], name='product_sales_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='productsales',
+            constraint=models.UniqueConstraint(fields=('product', 'day'), name='unique_product_day'),
+        ),
+        migrations.RunPython(start_backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.1.3 on 2026-10-18 09:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('holder', models.CharField(max_length=64)),
+                ('units', models.PositiveIntegerField()),
+                ('used', models.PositiveIntegerField(default=0)),
+                ('expires', models.DateTimeField()),
+                ('released', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='hot',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='stocklease',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leases', to='store.product'),
+        ),
+        migrations.AddField(
+            model_name='orderproducts',
+            name='lease',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='lines', to='store.stocklease'),
+        ),
+        migrations.AddIndex(
+            model_name='orderproducts',
+            index=models.Index(condition=models.Q(('lease__isnull', False)), fields=['lease'], name='order_line_lease'),
+        ),
+        migrations.AddIndex(
+            model_name='stocklease',
+            index=models.Index(condition=models.Q(('released', False)), fields=['product'], name='stock_lease_open'),
+        ),
+        migrations.AddIndex(
+            model_name='stocklease',
+            index=models.Index(condition=models.Q(('released', False)), fields=['expires'], name='stock_lease_expires'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.1.3 on 2026-10-18 09:21
+
+from django.db import migrations, models
+
+# Name searches, name__istartswith and name__icontains, filter on
+# UPPER(name::text) LIKE ..., so that's what's indexed, on postgres
+# only: a btree with text_pattern_ops for prefixes and, where the
+# pg_trgm extension is available, a trigram index for substrings.
+PREFIX_INDEX = ('CREATE INDEX product_name_prefix ON store_product '
+                '(UPPER(name::text) text_pattern_ops)')
+TRIGRAM_INDEX = ('CREATE INDEX product_name_trigram ON store_product '
+                 'USING gin (UPPER(name::text) gin_trgm_ops)')
+
+
+def add_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(PREFIX_INDEX)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions "
+                       "WHERE name = 'pg_trgm'")
+        trigrams = cursor.fetchone() is not None
+    if trigrams:
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(TRIGRAM_INDEX)
+
+
+def remove_name_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS product_name_trigram')
+    schema_editor.execute('DROP INDEX IF EXISTS product_name_prefix')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_stock_lease'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price'], name='product_price'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('quantity_in_stock__gt', 0)), fields=['id'], name='product_in_stock'),
+        ),
+        migrations.RunPython(add_name_indexes, remove_name_indexes),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 4.1.3 on 2026-10-18 10:16
+
+from decimal import Decimal
+from django.db import migrations, models, transaction
+from django.db.models import F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+# Orders placed before prices were kept get their products' current
+# prices, the nearest there is, BATCH_SIZE orders at a time, each batch
+# in a transaction of its own so the orders aren't locked throughout.
+# Anything already filled in is left, so it can be run again.
+BATCH_SIZE = 5000
+
+
+def backfill_totals(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Order = apps.get_model('store', 'Order')
+    OrderProducts = apps.get_model('store', 'OrderProducts')
+    ArchivedOrder = apps.get_model('store', 'ArchivedOrder')
+    db = schema_editor.connection.alias
+
+    price = Product.objects.filter(id=OuterRef('product_id')).values('price')
+    lines = (OrderProducts.objects.filter(order=OuterRef('id'))
+                                  .order_by().values('order'))
+    total = lines.annotate(total=Sum(F('unit_price') * F('quantity'),
+                                     output_field=models.DecimalField()))
+    item_count = lines.annotate(count=Sum('quantity'))
+    last = Order.objects.using(db).aggregate(last=Max('id'))['last'] or 0
+    for start in range(0, last, BATCH_SIZE):
+        end = start + BATCH_SIZE
+        with transaction.atomic(using=db):
+            (OrderProducts.objects.using(db)
+                          .filter(order_id__gt=start, order_id__lte=end,
+                                  unit_price__isnull=True)
+                          .update(unit_price=Subquery(price)))
+            (Order.objects.using(db)
+                  .filter(id__gt=start, id__lte=end, total__isnull=True)
+                  .update(total=Coalesce(Subquery(total.values('total')),
+                                         Value(Decimal(0)),
+                                         output_field=models.DecimalField()),
+                          item_count=Coalesce(
+                              Subquery(item_count.values('count')), 0)))
+
+    prices = dict(Product.objects.using(db).values_list('id', 'price'))
+    archived = (ArchivedOrder.objects.using(db).filter(total__isnull=True)
+                                     .order_by('id'))
+    while batch := list(archived[:BATCH_SIZE]):
+        for order in batch:
+            # Archived lines' products may have been deleted since
+            quantities = [(product_id, quantity, prices.get(product_id))
+                          for product_id, quantity, *_ in order.lines]
+            order.lines = [[product_id, quantity,
+                            None if price is None else str(price)]
+                           for product_id, quantity, price in quantities]
+            order.total = sum((price * quantity for _, quantity, price
+                               in quantities if price is not None),
+                              Decimal(0))
+            order.item_count = sum(quantity for _, quantity, _
+                                   in quantities)
+        with transaction.atomic(using=db):
+            ArchivedOrder.objects.using(db).bulk_update(
+                batch, ['lines', 'total', 'item_count'])
+
+
+class Migration(migrations.Migration):
+    # The backfill commits a batch at a time
+    atomic = False
+
+    dependencies = [
+        ('store', '0015_order_partitions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='item_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='total',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=24, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=24, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderproducts',
+            name='unit_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=20, null=True),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
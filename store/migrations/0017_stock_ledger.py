@@ -0,0 +1,84 @@
+# Generated by Django 4.1.3 on 2026-10-18 10:28
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+import django.utils.timezone
+
+# The ledger starts from a snapshot of the whole stock of each product,
+# as of no movements, BATCH_SIZE products at a time. Stock sold by
+# servers still running the code from before the ledger isn't in it,
+# manage.py reconcile_stock --adjust puts that right.
+BATCH_SIZE = 5000
+
+
+def open_ledger(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    StockShard = apps.get_model('store', 'StockShard')
+    StockLease = apps.get_model('store', 'StockLease')
+    OrderProducts = apps.get_model('store', 'OrderProducts')
+    StockSnapshot = apps.get_model('store', 'StockSnapshot')
+    db = schema_editor.connection.alias
+
+    def units(queryset, group, field):
+        return Coalesce(Subquery(queryset.values(group)
+                                         .annotate(units=Sum(field))
+                                         .values('units')), 0)
+    shards = StockShard.objects.filter(product=OuterRef('pk'))
+    leases = StockLease.objects.filter(product=OuterRef('pk'),
+                                       released=False)
+    sold = OrderProducts.objects.filter(lease__product=OuterRef('pk'),
+                                        lease__released=False)
+    products = Product.objects.using(db).annotate(
+        stock=F('quantity_in_stock') + units(shards, 'product', 'quantity')
+        + units(leases, 'product', 'units')
+        - units(sold, 'lease__product', 'quantity')).order_by('id')
+    last_id = 0
+    while batch := list(products.filter(id__gt=last_id)
+                                .values_list('id', 'stock')[:BATCH_SIZE]):
+        StockSnapshot.objects.using(db).bulk_create(
+            [StockSnapshot(product_id=product_id, quantity=stock,
+                           movement_id=0)
+             for product_id, stock in batch])
+        last_id = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('movement_id', models.BigIntegerField()),
+                ('taken', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='store.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('sale', 'Sale'), ('restock', 'Restock'), ('adjustment', 'Adjustment')], max_length=16)),
+                ('quantity', models.IntegerField()),
+                ('order_id', models.BigIntegerField(blank=True, null=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='store.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stocksnapshot',
+            index=models.Index(fields=['product', 'movement_id'], name='stock_snapshot_product'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['product', 'id'], name='stock_movement_product'),
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.1.3 on 2026-10-18 14:12
+
+from django.db import migrations
+from django.db.models import F, Max
+from django.utils import timezone
+
+
+def take_over(apps, schema_editor):
+    """ The sales recorded as orders were placed stand, the catch-up
+        takes over from the first line of a pending order, or the last
+        line when there are none. The confirmed lines after that are
+        taken back off, to be counted again. If the backfill wasn't
+        done, the sales are counted again from the first line.
+    """
+    OrderProducts = apps.get_model('store', 'OrderProducts')
+    ProductSales = apps.get_model('store', 'ProductSales')
+    SalesCatchUp = apps.get_model('store', 'SalesCatchUp')
+    db = schema_editor.connection.alias
+
+    state = SalesCatchUp.objects.using(db).first()
+    lines = OrderProducts.objects.using(db)
+    if state is None or state.last_id < state.until_id:
+        ProductSales.objects.using(db).all().delete()
+        last_id = 0
+    else:
+        last_id = lines.aggregate(last_id=Max('id'))['last_id'] or 0
+        pending = (lines.filter(order__status='pending').order_by('id')
+                        .values_list('id', flat=True).first())
+        if pending is not None:
+            for product_id, datetime, quantity in (
+                    lines.filter(id__gte=pending,
+                                 order__status='confirmed')
+                         .values_list('product_id', 'order__datetime',
+                                      'quantity')):
+                ProductSales.objects.using(db).filter(
+                    product_id=product_id,
+                    day=timezone.localdate(datetime),
+                ).update(units=F('units') - quantity)
+            last_id = pending - 1
+    SalesCatchUp.objects.using(db).all().delete()
+    SalesCatchUp.objects.using(db).create(pk=1, last_id=last_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.RenameModel(
+            old_name='SalesBackfill',
+            new_name='SalesCatchUp',
+        ),
+        migrations.RunPython(take_over, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='salescatchup',
+            name='until_id',
+        ),
+    ]
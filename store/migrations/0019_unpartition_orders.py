@@ -0,0 +1,62 @@
+# Generated by Django 4.1.3 on 2026-10-18 16:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def unpartition_orders(apps, schema_editor):
+    """ Put the orders back into one table, where an earlier version of
+        migration 0015 partitioned them by month on postgres, copying
+        them over, which locks them until it's done. The ids carry on
+        from the same number, and the primary key is the id again.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Order = apps.get_model('store', 'Order')
+    table = Order._meta.db_table
+    execute = schema_editor.execute
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table '
+                       'WHERE partrelid = %s::regclass', [table])
+        if cursor.fetchone() is None:
+            return
+        # Checks deferred to the end of the transaction, e.g. of
+        # orders just written, are due before the table is dropped
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence, = cursor.fetchone()
+        cursor.execute(f'SELECT last_value, is_called FROM {sequence}')
+        last_id, called = cursor.fetchone()
+
+        execute(f'CREATE TABLE {table}_new (LIKE {table} INCLUDING '
+                f'DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS)')
+        execute(f'INSERT INTO {table}_new SELECT * FROM {table}')
+        # The monthly partitions go with it
+        execute(f'DROP TABLE {table}')
+        execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+        cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                       "%s, %s)", [table, last_id, called])
+
+    execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey '
+            f'PRIMARY KEY (id)')
+    user = Order._meta.get_field('user')
+    execute(schema_editor._create_fk_sql(Order, user,
+                                         '_fk_%(to_table)s_%(to_column)s'))
+    for index in Order._meta.indexes:
+        execute(index.create_sql(Order, schema_editor))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_sales_catch_up'),
+    ]
+
+    operations = [
+        migrations.RunPython(unpartition_orders, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='orderproducts',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='products', to='store.order'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.3 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_unpartition_orders'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', 'id'], name='archived_order_user'),
+        ),
+    ]
@@ -1,9 +1,68 @@
-from django.db import models
+from collections import defaultdict
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.query import ModelIterable
 from django.core.validators import MinValueValidator
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_stock(self):
+        """ Annotate the products with their whole stock, which
+            with settings.STOCK_SHARDING includes their slots, and
+            with settings.HOT_STOCK what's left of their leases, as
+            last flushed.
+        """
+        stock = F('quantity_in_stock')
+        if settings.STOCK_SHARDING:
+            stock += Coalesce(Sum('stock_shards__quantity'), 0)
+        if settings.HOT_STOCK:
+            leased = (StockLease.objects.filter(product=OuterRef('pk'),
+                                                released=False)
+                                        .values('product')
+                                        .annotate(left=Sum(F('units')
+                                                           - F('used')))
+                                        .values('left'))
+            stock += Coalesce(Subquery(leased), 0)
+        return self.annotate(stock=stock)
+
+    def search(self, name=None, search=None, min_price=None, max_price=None,
+               in_stock=False, ids=None):
+        """ Filter the products: name starting with name, containing
+            search, both ignoring case, priced from min_price up to
+            max_price, in stock, or in ids.
+
+            Each is backed by an index, see Product.Meta.indexes and
+            migration 0014, on postgres the name searches need at
+            least three characters for the trigram index.
+
+            Note: With settings.STOCK_SHARDING or HOT_STOCK, the
+                  stock of a product isn't only its row's, so in
+                  stock goes by the stock annotated by with_stock,
+                  without the index.
+        """
+        filters = Q()
+        if name:
+            filters &= Q(name__istartswith=name)
+        if search:
+            filters &= Q(name__icontains=search)
+        if min_price is not None:
+            filters &= Q(price__gte=min_price)
+        if max_price is not None:
+            filters &= Q(price__lte=max_price)
+        if ids is not None:
+            filters &= Q(id__in=ids)
+        if in_stock:
+            if settings.STOCK_SHARDING or settings.HOT_STOCK:
+                filters &= Q(stock__gt=0)
+            else:
+                filters &= Q(quantity_in_stock__gt=0)
+        return self.filter(filters)
+
+
 class Product(models.Model):
     """ Model to hold the product data.
 
@@ -17,6 +76,10 @@ class Product(models.Model):
         With thousands of orders the property approach
         could be slow and wouldn't solve the race condition
         anyway.
+
+        Note: Every change to the stock is also written to the
+              ledger, see StockMovement, which it can be checked
+              against, see ledger.reconcile.
     """
     name = models.CharField(max_length=64, null=False,
                             blank=False, default='', unique=True)
@@ -24,10 +87,209 @@ class Product(models.Model):
                                 decimal_places=2,
                                 validators=[MinValueValidator(0), ])
     quantity_in_stock = models.PositiveIntegerField(null=False, blank=False)
+    # Sold from leases of its stock rather than quantity_in_stock,
+    # see hotstock, with settings.HOT_STOCK.
+    hot = models.BooleanField(null=False, blank=False, default=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        # With the movement of its stock, see signals.product_saved
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     class Meta:
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
+        # For filtering the catalogue, see ProductViewSet. On postgres
+        # names are also indexed for searching, see migration 0014.
+        indexes = [
+            models.Index(fields=['price'], name='product_price'),
+            models.Index(fields=['id'], name='product_in_stock',
+                         condition=Q(quantity_in_stock__gt=0)),
+        ]
+
+
+class StockShard(models.Model):
+    """ Model to hold a slot of a product's stock, when its
+        stock is sharded, see settings.STOCK_SHARDING.
+
+        Buyers of a popular product all contend on the lock
+        of its row when they take stock from quantity_in_stock.
+        Spreading its stock over a number of slots lets them
+        take it from different rows instead.
+
+        Note: The stock of a product is its quantity_in_stock
+              plus the quantity of all of its slots. Sharding a
+              product moves all of its stock into the slots, see
+              stock.rebalance.
+    """
+    product = models.ForeignKey('Product', null=False, blank=False,
+                                on_delete=models.CASCADE,
+                                related_name='stock_shards')
+    slot = models.PositiveSmallIntegerField(null=False, blank=False)
+    quantity = models.PositiveIntegerField(null=False, blank=False,
+                                           default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'slot'],
+                                    name='unique_product_slot'),
+        ]
+
+
+class StockLease(models.Model):
+    """ Model to hold a block of a hot product's stock, leased
+        to one process, the holder, to sell from in memory, see
+        hotstock.
+
+        The units are taken out of quantity_in_stock when they're
+        leased, so no one else can sell them. Those used are
+        flushed back from time to time, and when the lease is
+        settled, after it expires, the units not sold are put back
+        into quantity_in_stock.
+
+        Note: Order lines sold from a lease refer to it, so a
+              lease can be settled from the lines alone, even if
+              its holder went away without flushing.
+    """
+    product = models.ForeignKey('Product', null=False, blank=False,
+                                on_delete=models.CASCADE,
+                                related_name='leases')
+    holder = models.CharField(max_length=64, null=False, blank=False)
+    units = models.PositiveIntegerField(null=False, blank=False)
+    used = models.PositiveIntegerField(null=False, blank=False, default=0)
+    expires = models.DateTimeField(null=False, blank=False)
+    released = models.BooleanField(null=False, blank=False, default=False)
+
+    class Meta:
+        indexes = [
+            # Backs the leases still out, by product and by expiry
+            models.Index(fields=['product'], name='stock_lease_open',
+                         condition=models.Q(released=False)),
+            models.Index(fields=['expires'], name='stock_lease_expires',
+                         condition=models.Q(released=False)),
+        ]
+
+
+class StockMovement(models.Model):
+    """ Model to hold a change to the stock of a product, units
+        sold, restocked or adjusted, never updated or deleted once
+        it's written, see ledger.
+
+        Note: It's the whole stock of the product that moves, its
+              quantity_in_stock, slots and leases together, so
+              moving units between those isn't a movement, e.g.
+              stock.rebalance or leasing hot stock.
+    """
+    SALE = 'sale'
+    RESTOCK = 'restock'
+    ADJUSTMENT = 'adjustment'
+    KINDS = [
+        (SALE, 'Sale'),
+        (RESTOCK, 'Restock'),
+        (ADJUSTMENT, 'Adjustment'),
+    ]
+
+    # Found by product and id, see the stock_movement_product index
+    product = models.ForeignKey('Product', null=False, blank=False,
+                                on_delete=models.CASCADE,
+                                related_name='movements', db_index=False)
+    kind = models.CharField(max_length=16, null=False, blank=False,
+                            choices=KINDS)
+    # Units added, or taken when negative
+    quantity = models.IntegerField(null=False, blank=False)
+    # The order the units were sold to, not a foreign key, as the
+    # order may since have been archived, see archive
+    order_id = models.BigIntegerField(null=True, blank=True)
+    created = models.DateTimeField(null=False, blank=False,
+                                   default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Backs the movements of a product since its snapshot
+            models.Index(fields=['product', 'id'],
+                         name='stock_movement_product'),
+        ]
+
+
+class StockSnapshot(models.Model):
+    """ Model to hold the stock of a product by the ledger, as of
+        a movement, so its stock can be worked out from the latest
+        snapshot and the movements since, without going through
+        all of them, see ledger.
+
+        Note: Snapshots are taken from time to time, by
+              manage.py snapshot_stock, and only for the products
+              which moved since their last one.
+    """
+    product = models.ForeignKey('Product', null=False, blank=False,
+                                on_delete=models.CASCADE,
+                                related_name='snapshots', db_index=False)
+    quantity = models.IntegerField(null=False, blank=False)
+    # The last movement counted, every product's movements up to
+    # it are, 0 for none
+    movement_id = models.BigIntegerField(null=False, blank=False)
+    taken = models.DateTimeField(null=False, blank=False,
+                                 default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Backs the latest snapshot of a product
+            models.Index(fields=['product', 'movement_id'],
+                         name='stock_snapshot_product'),
+        ]
+
+
+class OrderQuerySet(models.QuerySet):
+    """ QuerySet for orders which can fetch the product ids
+        of all of the orders it holds in a single query.
+
+        Note: The lines are read with values_list and put on
+              each order as a product_ids list, in the legacy
+              form of one id per unit. No OrderProducts objects
+              are built, which is all the order serializer needs.
+    """
+    _with_product_ids = False
+
+    def with_product_ids(self):
+        clone = self._chain()
+        clone._with_product_ids = True
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._with_product_ids = self._with_product_ids
+        return clone
+
+    def _fetch_all(self):
+        fetch = self._result_cache is None
+        super()._fetch_all()
+        if (fetch and self._with_product_ids and self._result_cache
+                and self._iterable_class is ModelIterable):
+            attach_product_ids(self._result_cache)
+
+
+def product_ids_of(order_ids):
+    """ The product ids of each of the orders, one per unit, as a
+        mapping of order id to list, with one query.
+    """
+    product_ids = defaultdict(list)
+    lines = (OrderProducts.objects
+             .filter(order__in=order_ids)
+             .order_by('id')
+             .values_list('order_id', 'product_id', 'quantity'))
+    for order_id, product_id, quantity in lines:
+        product_ids[order_id].extend([product_id] * quantity)
+    return product_ids
+
+
+def attach_product_ids(orders):
+    """ Set product_ids on each of the orders, with one query.
+    """
+    product_ids = product_ids_of([order.id for order in orders])
+    for order in orders:
+        order.product_ids = product_ids[order.id]
 
 
 class Order(models.Model):
@@ -43,16 +305,53 @@ class Order(models.Model):
         Note: We are protecting the user deletion here, so that
               a user can't be removed without explicitly deciding
               what do do with their linked orders.
+
+        Note: Old orders are moved to ArchivedOrder, see archive.
     """
+    PENDING = 'pending'
+    CONFIRMED = 'confirmed'
+    REJECTED = 'rejected'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (CONFIRMED, 'Confirmed'),
+        (REJECTED, 'Rejected'),
+    ]
+
+    # The user's orders are found with the order_user_datetime_id index
     user = models.ForeignKey(get_user_model(), null=False, blank=False,
-                             on_delete=models.PROTECT, related_name='orders')
+                             on_delete=models.PROTECT, related_name='orders',
+                             db_index=False)
     datetime = models.DateTimeField(null=False, blank=False,
                                     default=timezone.now)
+    # Orders placed asynchronously are pending until their stock
+    # is reserved, see orders.enqueue.
+    status = models.CharField(max_length=16, null=False, blank=False,
+                              choices=STATUSES, default=CONFIRMED)
+    # What the order came to and its number of units, at the prices
+    # of its lines, set when it's placed, see orders
+    total = models.DecimalField(null=True, blank=True, max_digits=24,
+                                decimal_places=2)
+    item_count = models.PositiveIntegerField(null=True, blank=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Backs the order history of a user, newest first,
+            # see KeysetPagination.
+            models.Index(fields=['user', 'datetime', 'id'],
+                         name='order_user_datetime_id'),
+            # Backs the queue of pending orders, which stays small
+            # however many orders there are.
+            models.Index(fields=['id'], name='order_pending',
+                         condition=models.Q(status='pending')),
+        ]
 
 
 class OrderProducts(models.Model):
     """ Model to hold the product information linked to an
-        order.
+        order, one row per product with the number of units
+        ordered, rather than one row per unit.
 
         Note: We are protecting the order deletion here, so that
               an order can't be removed without explicitly deciding
@@ -69,3 +368,123 @@ class OrderProducts(models.Model):
     product = models.ForeignKey('Product', null=False, blank=False,
                                 on_delete=models.PROTECT,
                                 related_name='+')
+    quantity = models.PositiveIntegerField(null=False, blank=False,
+                                           default=1,
+                                           validators=[MinValueValidator(1), ])
+    # The product's price when the order was placed
+    unit_price = models.DecimalField(null=True, blank=True, max_digits=20,
+                                     decimal_places=2)
+    # The lease the units were taken from, if they were, see hotstock.
+    lease = models.ForeignKey('StockLease', null=True, blank=True,
+                              on_delete=models.PROTECT, related_name='lines',
+                              db_index=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'],
+                                    name='unique_order_product'),
+        ]
+        indexes = [
+            # Backs the count of the units sold from a lease, when
+            # it's settled, leaving out the lines of other orders.
+            models.Index(fields=['lease'], name='order_line_lease',
+                         condition=models.Q(lease__isnull=False)),
+        ]
+
+
+class ArchivedOrder(models.Model):
+    """ Model to hold an order moved out of Order once it's old,
+        see archive, with its lines in the same row, as a list of
+        [product id, quantity, unit price], rather than a row each.
+
+        Note: It keeps the order's id, so it's still found at
+              /store/orders/<id>.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(get_user_model(), null=False, blank=False,
+                             on_delete=models.PROTECT, related_name='+',
+                             db_index=False)
+    datetime = models.DateTimeField(null=False, blank=False)
+    status = models.CharField(max_length=16, null=False, blank=False,
+                              choices=Order.STATUSES)
+    total = models.DecimalField(null=True, blank=True, max_digits=24,
+                                decimal_places=2)
+    item_count = models.PositiveIntegerField(null=True, blank=True)
+    lines = models.JSONField(null=False, blank=False)
+
+    class Meta:
+        indexes = [
+            # Backs exporting a user's archived orders, see export
+            models.Index(fields=['user', 'id'], name='archived_order_user'),
+        ]
+
+
+class ProductSales(models.Model):
+    """ Model to hold the number of units of a product sold on a
+        day, by the day the orders were placed, so sales can be
+        reported without going through every order line.
+
+        Note: It's kept up to date by manage.py catch_up_sales,
+              from the order lines, rather than as orders are
+              placed, so orders for the same products don't queue
+              on its rows, see sales.catch_up.
+    """
+    product = models.ForeignKey('Product', null=False, blank=False,
+                                on_delete=models.CASCADE,
+                                related_name='sales')
+    day = models.DateField(null=False, blank=False)
+    units = models.PositiveIntegerField(null=False, blank=False, default=0)
+
+    class Meta:
+        verbose_name_plural = 'Product sales'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'],
+                                    name='unique_product_day'),
+        ]
+        indexes = [
+            # Backs the top sellers over the last few days
+            models.Index(fields=['day', 'product', 'units'],
+                         name='product_sales_day'),
+        ]
+
+
+class SalesCatchUp(models.Model):
+    """ Model to hold how far ProductSales has got through the
+        order lines, a single row, last_id being the id of the
+        last line counted, see sales.catch_up.
+    """
+    last_id = models.BigIntegerField(null=False, blank=False, default=0)
+
+
+class IdempotencyKey(models.Model):
+    """ Model to hold an Idempotency-Key sent by a user with an
+        order, and the response it got, so a retry with the same
+        key gets the same response rather than a second order,
+        see idempotency.respond_once.
+
+        Note: Only successful responses are kept, the row is
+              inserted in the same transaction as the order, so
+              it goes with it if the order fails.
+    """
+    user = models.ForeignKey(get_user_model(), null=False, blank=False,
+                             on_delete=models.CASCADE,
+                             related_name='idempotency_keys')
+    key = models.CharField(max_length=255, null=False, blank=False)
+    # Hash of the request, a key can't be reused for another one
+    fingerprint = models.CharField(max_length=64, null=False, blank=False)
+    created = models.DateTimeField(null=False, blank=False,
+                                   default=timezone.now)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_headers = models.JSONField(null=False, blank=False,
+                                        default=dict)
+    response_body = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'],
+                                    name='unique_user_idempotency_key'),
+        ]
+        indexes = [
+            # Backs the purge of expired keys
+            models.Index(fields=['created'], name='idempotency_key_created'),
+        ]
@@ -0,0 +1,279 @@
+# General
+from collections import Counter, defaultdict
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+# Opply
+from exceptions import ProductOutOfStockException
+from . import availability, ledger, stock, workers
+from .hotstock import hot_stock
+from .models import Product, Order, OrderProducts
+
+# The results of the orders of a batch, see place_batch
+CREATED = 'created'
+OUT_OF_STOCK = 'out_of_stock'
+INVALID = 'invalid'
+NOT_PLACED = 'not_placed'
+
+
+def prices_of(product_ids):
+    """ The current prices of the products, as a mapping of
+        product id to price, leaving out those that don't exist.
+    """
+    return dict(Product.objects.filter(id__in=product_ids)
+                               .values_list('id', 'price'))
+
+
+def totals(quantities, prices):
+    """ The total and the item count of an order, at prices.
+    """
+    return {'total': sum((prices[product_id] * quantity for product_id,
+                          quantity in quantities.items()), Decimal(0)),
+            'item_count': sum(quantities.values())}
+
+
+def _create(user, quantities, prices, leases=None, **kwargs):
+    """ Insert the order, with its total, and bulk insert its
+        lines, with their prices, leases being the leases some of
+        the products were taken from, if any.
+    """
+    leases = leases or {}
+    order = Order.objects.create(user=user, **totals(quantities, prices),
+                                 **kwargs)
+    OrderProducts.objects.bulk_create(
+        [OrderProducts(order=order, product_id=product_id,
+                       quantity=quantity, unit_price=prices[product_id],
+                       lease_id=leases.get(product_id))
+         for product_id, quantity in quantities.items()])
+    order.product_ids = [product_id for product_id, quantity
+                         in quantities.items()
+                         for _ in range(quantity)]
+    return order
+
+
+@transaction.atomic
+def place(user, quantities):
+    """ Place an order, quantities is a mapping of product id
+        to the number of units wanted.
+
+        This takes a fixed number of queries, however many lines
+        the order has: the stock of all of the ordered products is
+        reserved by a single guarded UPDATE, their prices are read,
+        then the order and its lines are inserted, with the prices
+        and the total, and the stock movements recorded, see
+        ledger.record_sales.
+
+        Note: Everything runs in one transaction, so a shortfall
+              on any product rolls back the stock already taken
+              and the order itself.
+
+        Note: With settings.HOT_STOCK, hot products are taken from
+              this process' leases of them instead, without going
+              near their rows, see hotstock.
+    """
+    leases = hot_stock.take(quantities)
+    try:
+        stock.reserve({product_id: quantity
+                       for product_id, quantity in quantities.items()
+                       if product_id not in leases})
+        order = _create(user, quantities, prices_of(quantities), leases)
+        ledger.record_sales([(order.id, quantities)])
+    except BaseException:
+        hot_stock.give_back(leases, quantities)
+        raise
+    if leases:
+        transaction.on_commit(lambda: availability.invalidate(leases))
+    return order
+
+
+@transaction.atomic
+def place_batch(user, batch, all_or_nothing=True):
+    """ Place a batch of orders at once, batch is a list of
+        mappings of product id to the number of units wanted, one
+        per order. Returns the result of each order, in the same
+        order, as a (result, detail) pair, one of:
+
+            (CREATED, the order)
+            (OUT_OF_STOCK, the ids of the products short of stock)
+            (INVALID, the ids of the products that don't exist)
+            (NOT_PLACED, None), all_or_nothing and another failed
+
+        All of the products of the batch are locked once, in order
+        of id, see stock.lock, and their stock is handed out to
+        the orders in turn. Then the stock is taken, one decrement
+        per product, the prices read, the orders and all of their
+        lines inserted, and the stock movements recorded, a fixed
+        number of queries however many orders there are.
+
+        Note: With all_or_nothing, any order failing fails them
+              all and nothing is placed, otherwise the orders that
+              can be placed are.
+
+        Note: With settings.HOT_STOCK, hot products are taken from
+              this process' leases of them first, as by place, and
+              only the rest from their rows. What was taken for
+              orders that aren't placed is given back.
+    """
+    leases = [hot_stock.take(quantities) for quantities in batch]
+    try:
+        results = _place_batch(user, batch, leases, all_or_nothing)
+    except BaseException:
+        for quantities, taken in zip(batch, leases):
+            hot_stock.give_back(taken, quantities)
+        raise
+    leased = set()
+    for (result, detail), quantities, taken in zip(results, batch, leases):
+        if result == CREATED:
+            leased.update(taken)
+        else:
+            hot_stock.give_back(taken, quantities)
+    if leased:
+        transaction.on_commit(lambda: availability.invalidate(leased))
+    return results
+
+
+def _place_batch(user, batch, leases, all_or_nothing):
+    rows = [{pk: quantity for pk, quantity in quantities.items()
+             if pk not in taken}
+            for quantities, taken in zip(batch, leases)]
+    available = stock.lock(set().union(*rows))
+
+    results, placed, reserved = [], [], Counter()
+    for quantities, row in zip(batch, rows):
+        missing = sorted(set(row) - set(available))
+        short = sorted(pk for pk, quantity in row.items()
+                       if pk in available and
+                       available[pk] - reserved[pk] < quantity)
+        if missing:
+            results.append((INVALID, missing))
+        elif short:
+            results.append((OUT_OF_STOCK, short))
+        else:
+            results.append((CREATED, quantities))
+            placed.append(quantities)
+            reserved.update(row)
+
+    if all_or_nothing and len(placed) < len(batch):
+        return [(NOT_PLACED, None) if result == CREATED else
+                (result, detail) for result, detail in results]
+    if not placed:
+        return results
+
+    stock.reserve(reserved)
+    prices = prices_of(set().union(*placed))
+    now = timezone.now()
+    orders = iter(Order.objects.bulk_create(
+        [Order(user=user, datetime=now, **totals(quantities, prices))
+         for quantities in placed]))
+    lines, sold = [], []
+    for i, (result, quantities) in enumerate(results):
+        if result != CREATED:
+            continue
+        order = next(orders)
+        order.product_ids = [product_id for product_id, quantity
+                             in quantities.items() for _ in range(quantity)]
+        lines.extend(OrderProducts(order=order, product_id=product_id,
+                                   quantity=quantity,
+                                   unit_price=prices[product_id],
+                                   lease_id=leases[i].get(product_id))
+                     for product_id, quantity in quantities.items())
+        results[i] = (CREATED, order)
+        sold.append((order.id, quantities))
+    OrderProducts.objects.bulk_create(lines)
+    ledger.record_sales(sold)
+    return results
+
+
+@transaction.atomic
+def enqueue(user, quantities):
+    """ Accept an order without reserving its stock, it's left
+        pending for the workers, see process_pending. It's charged
+        at the prices of when it's accepted.
+
+        Note: The pending orders are the queue, so nothing is
+              lost if the process goes away before they're done,
+              manage.py process_orders will pick them up.
+    """
+    prices = prices_of(quantities)
+    missing = sorted(set(quantities) - set(prices))
+    if missing:
+        raise Product.DoesNotExist(missing)
+
+    order = _create(user, quantities, prices, status=Order.PENDING)
+    transaction.on_commit(workers.pool.wake)
+    return order
+
+
+def process_pending(batch_size=None):
+    """ Confirm or reject a batch of pending orders, oldest first,
+        returns how many there were.
+
+        The batch is taken with SKIP LOCKED, so any number of
+        workers can run at once, each with its own batch. Each
+        order's stock is reserved in a savepoint, so an order
+        short of stock is rejected without undoing the others,
+        and the whole batch is committed at once, with the stock
+        movements of the confirmed orders, see ledger.record_sales.
+
+        Note: With settings.HOT_STOCK, hot products are taken from
+              this process' leases of them first, as by place, and
+              the lines sold from a lease are set to refer to it,
+              one UPDATE per lease, so it's settled from them.
+    """
+    batch_size = batch_size or settings.ORDER_BATCH_SIZE
+
+    with transaction.atomic():
+        batch = list(Order.objects.select_for_update(skip_locked=True)
+                                  .filter(status=Order.PENDING)
+                                  .order_by('id')
+                                  .values_list('id', flat=True)[:batch_size])
+        if not batch:
+            return 0
+
+        lines = defaultdict(Counter)
+        for order_id, product_id, quantity in (
+                OrderProducts.objects.filter(order_id__in=batch)
+                                     .values_list('order_id', 'product_id',
+                                                  'quantity')):
+            lines[order_id][product_id] += quantity
+
+        confirmed, rejected, leases = [], [], {}
+        try:
+            for order_id in batch:
+                taken = leases[order_id] = hot_stock.take(lines[order_id])
+                try:
+                    with transaction.atomic():
+                        stock.reserve({pk: quantity for pk, quantity
+                                       in lines[order_id].items()
+                                       if pk not in taken})
+                    confirmed.append(order_id)
+                except ProductOutOfStockException:
+                    hot_stock.give_back(leases.pop(order_id),
+                                        lines[order_id])
+                    rejected.append(order_id)
+
+            Order.objects.filter(id__in=confirmed) \
+                         .update(status=Order.CONFIRMED)
+            Order.objects.filter(id__in=rejected) \
+                         .update(status=Order.REJECTED)
+            ledger.record_sales((order_id, lines[order_id])
+                                for order_id in confirmed)
+
+            sold = defaultdict(list)
+            for order_id, taken in leases.items():
+                for product_id, lease_id in taken.items():
+                    sold[product_id, lease_id].append(order_id)
+            for (product_id, lease_id), order_ids in sold.items():
+                OrderProducts.objects.filter(order_id__in=order_ids,
+                                             product_id=product_id) \
+                                     .update(lease_id=lease_id)
+        except BaseException:
+            for order_id, taken in leases.items():
+                hot_stock.give_back(taken, lines[order_id])
+            raise
+        leased = {product_id for product_id, lease_id in sold}
+        if leased:
+            transaction.on_commit(lambda: availability.invalidate(leased))
+    return len(batch)
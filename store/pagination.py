@@ -0,0 +1,216 @@
+# General
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class PageNumberPagination(pagination.PageNumberPagination):
+    """ The default page number pagination, with a page size
+        the client can choose up to max_page_size.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    async def apaginate_queryset(self, queryset, request):
+        """ paginate_queryset for async views, with the count and
+            the page fetched by the async ORM.
+        """
+        self.request = request
+        paginator = self.django_paginator_class(queryset,
+                                                self.get_page_size(request))
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)))
+        return [obj async for obj in self.page.object_list]
+
+
+class KeysetPagination(pagination.BasePagination):
+    """ Cursor based pagination, keyed on the values of the
+        ordering fields of the last row of the previous page.
+
+        Unlike page number pagination, there's no OFFSET and no
+        COUNT(*), a page is fetched with an index range scan
+        starting at the cursor, so page 10,000 costs the same
+        as page 1. With ordering ('-datetime', '-id') a page
+        after the row (d, i) is fetched with:
+
+            WHERE datetime <= d AND (datetime < d OR id < i)
+            ORDER BY datetime DESC, id DESC
+            LIMIT page_size + 1
+
+        The first term bounds the index scan, the second skips
+        the rows at the boundary already seen.
+
+        Note: The last field of the ordering must be unique,
+              usually the primary key, so every row has a
+              distinct position.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering):
+        self.ordering = tuple(ordering)
+
+    @classmethod
+    def requested(cls, request):
+        """ Clients opt in with ?pagination=cursor, subsequent
+            pages carry a cursor.
+        """
+        return (request.query_params.get('pagination') == 'cursor'
+                or cls.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, queryset.model)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self._flip(field) for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+
+        page = list(queryset[:self.page_size + 1])
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size < 1:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self._link(self.page[0], reverse=True)
+
+    def encode_cursor(self, position, reverse=False):
+        data = json.dumps({'p': position, 'r': reverse}, default=str)
+        return urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, request, model):
+        """ The position and direction of the cursor of the request,
+            the position's values coerced to the types of model's
+            ordering fields.
+
+            Note: Cursors come from clients, so a cursor that can't
+                  be a position in the ordering is a 404, rather
+                  than a query that fails.
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is None:
+            return None, False
+        try:
+            data = json.loads(urlsafe_b64decode(cursor.encode()))
+            position, reverse = data['p'], bool(data['r'])
+            if (not isinstance(position, list)
+                    or len(position) != len(self.ordering)
+                    or None in position):
+                raise ValueError
+            position = [model._meta.get_field(field.lstrip('-'))
+                                   .to_python(value)
+                        for field, value in zip(self.ordering, position)]
+        except (ValueError, TypeError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def position(self, instance):
+        return [getattr(instance, field.lstrip('-'))
+                for field in self.ordering]
+
+    def _link(self, instance, reverse):
+        cursor = self.encode_cursor(self.position(instance), reverse)
+        return replace_query_param(self.base_url,
+                                   self.cursor_query_param, cursor)
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def _after(ordering, position):
+        """ Filter for the rows after position in ordering.
+        """
+        def compare(field, inclusive=False):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            return field.lstrip('-') + '__' + lookup + ('e' if inclusive
+                                                        else '')
+
+        after = Q()
+        for i, field in enumerate(ordering):
+            equal = {f.lstrip('-'): v for f, v in zip(ordering[:i],
+                                                        position[:i])}
+            after |= Q(**equal, **{compare(field): position[i]})
+
+        first = ordering[0]
+        return Q(**{compare(first, inclusive=True): position[0]}) & after
+
+
+class KeysetPaginationMixin:
+    """ View mixin letting clients opt in to KeysetPagination,
+        keyed on the view's keyset_ordering, rather than the
+        view's default pagination_class.
+    """
+    keyset_ordering = None
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if (self.keyset_ordering
+                    and KeysetPagination.requested(self.request)):
+                self._paginator = KeysetPagination(self.keyset_ordering)
+            else:
+                self._paginator = super().paginator
+        return self._paginator
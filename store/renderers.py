@@ -0,0 +1,143 @@
+# General
+import logging
+from itertools import accumulate
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+class PrometheusRenderer(BaseRenderer):
+    """ Renders a metrics.RequestMetrics snapshot in the prometheus
+        text format, each measurement as a histogram since the
+        process started, opply_request_<name>, and the quantiles
+        of the rolling window as gauges, opply_request_<name>_window.
+        With the snapshot of an authentication.TokenCache under
+        token_cache, its hits and misses as counters and its size as
+        a gauge, opply_token_cache_<name>.
+    """
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+    prefix = 'opply_request_'
+    token_cache_prefix = 'opply_token_cache_'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = renderer_context and renderer_context.get('response')
+        if response is not None and response.exception:
+            return '\n'.join(f'# {key}: {value}'
+                             for key, value in data.items()) + '\n'
+
+        lines = [f'# TYPE {self.prefix}total counter']
+        for route in data['routes']:
+            for status, count in route['statuses'].items():
+                labels = self.labels(route, status=status)
+                lines.append(f'{self.prefix}total{{{labels}}} {count}')
+
+        names = sorted({name for route in data['routes']
+                        for name, value in route.items()
+                        if isinstance(value, dict) and 'buckets' in value})
+        for name in names:
+            metric = self.prefix + name
+            lines.append(f'# TYPE {metric} histogram')
+            for route in data['routes']:
+                if name not in route:
+                    continue
+                histogram = route[name]
+                bounds = histogram['buckets'] + ['+Inf']
+                for le, count in zip(bounds,
+                                     accumulate(histogram['counts'])):
+                    labels = self.labels(route, le=le)
+                    lines.append(f'{metric}_bucket{{{labels}}} {count}')
+                labels = self.labels(route)
+                lines.append(f'{metric}_sum{{{labels}}} {histogram["sum"]}')
+                lines.append(f'{metric}_count{{{labels}}} '
+                             f'{histogram["count"]}')
+
+            lines.append(f'# TYPE {metric}_window gauge')
+            for route in data['routes']:
+                if name not in route:
+                    continue
+                window = route[name]['window']
+                for quantile in ('p50', 'p95', 'p99'):
+                    if window[quantile] is None:
+                        continue
+                    labels = self.labels(route,
+                                         quantile=f'0.{quantile[1:]}')
+                    lines.append(f'{metric}_window{{{labels}}} '
+                                 f'{window[quantile]}')
+
+        token_cache = data.get('token_cache')
+        if token_cache is not None:
+            metric = self.token_cache_prefix
+            lines.append(f'# TYPE {metric}hits_total counter')
+            for level in ('local', 'shared'):
+                lines.append(f'{metric}hits_total{{level="{level}"}} '
+                             f'{token_cache[f"{level}_hits"]}')
+            lines.append(f'# TYPE {metric}misses_total counter')
+            lines.append(f'{metric}misses_total {token_cache["misses"]}')
+            lines.append(f'# TYPE {metric}size gauge')
+            lines.append(f'{metric}size {token_cache["size"]}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def labels(route, **extra):
+        labels = {'route': route['route'] or '', 'method': route['method'],
+                  **extra}
+        return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+class FastJSONRenderer(JSONRenderer):
+    """ JSONRenderer rendering with orjson, when it's installed,
+        with the same output, byte for byte, for the products and
+        orders: compact, not escaped to ASCII, with \u2028 and
+        \u2029 escaped, and anything orjson can't render itself,
+        dates, decimals, lazy strings, handed to the DRF encoder.
+
+        Anything orjson turns down, e.g. dicts with keys that
+        aren't strings, or integers over 64 bits, is left to
+        JSONRenderer, as are pretty printed responses, and every
+        response without orjson or settings.FAST_SERIALIZATION. A
+        warning is logged the first time orjson is missing with
+        settings.FAST_SERIALIZATION on.
+
+        Note: orjson writes floats with exponents differently,
+              1e16 rather than 1e+16, and NaN as null, so it's
+              only for responses without floats, e.g. not the
+              metrics.
+    """
+    options = (orjson.OPT_PASSTHROUGH_DATETIME
+               | orjson.OPT_PASSTHROUGH_DATACLASS) if orjson else 0
+
+    warned = False
+
+    def __init__(self):
+        self.default = self.encoder_class().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None and settings.FAST_SERIALIZATION
+                and not FastJSONRenderer.warned):
+            FastJSONRenderer.warned = True
+            logger.warning('FAST_SERIALIZATION is on but orjson is not '
+                           'installed, rendering with JSONRenderer')
+        if (orjson is None or not settings.FAST_SERIALIZATION
+                or data is None or self.ensure_ascii
+                or not self.compact or self.get_indent(
+                    accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.default,
+                               option=self.options)
+        except TypeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        if b'\xe2\x80' in ret:
+            ret = ret.replace('\u2028'.encode(), b'\\u2028') \
+                     .replace('\u2029'.encode(), b'\\u2029')
+        return ret
@@ -0,0 +1,201 @@
+# General
+import contextvars
+import logging
+import random
+import threading
+import time
+from asgiref.sync import sync_to_async
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# How far a postgres replica is behind, none when it's replayed all it's
+# received, or it's not a replica at all
+LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+'''
+
+# The replica the reads of the current request go to, None for the primary
+_replica = contextvars.ContextVar('replica', default=None)
+
+
+class ReplicaRouter:
+    """ Database router sending reads to the replica chosen for
+        the current request, see start_reading, and everything
+        else to the primary, the default database.
+
+        Writes, select_for_update included, as it's routed as a
+        write, and reads in a transaction on the primary, e.g.
+        placing an order, always go to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas have the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def lag(alias):
+    """ How far behind the primary the replica is, in seconds,
+        raises DatabaseError if it can't be reached.
+    """
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        cursor.execute(LAG_SQL if connection.vendor == 'postgresql'
+                       else 'SELECT 0')
+        return float(cursor.fetchone()[0] or 0)
+
+
+class ReplicaHealth:
+    """ Whether each replica is up and no more than
+        settings.REPLICA_MAX_LAG_SECONDS behind, see lag, checked
+        every REPLICA_CHECK_INTERVAL seconds, in process.
+
+        A replica is checked by the first request to find its last
+        check out of date, the others go on with the last result
+        meanwhile. Until it's first checked it counts as down.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # Alias to the (time, healthy) of its last check
+            self.checked = {}
+
+    def healthy(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            checked, healthy = self.checked.get(alias, (None, False))
+            if (checked is not None
+                    and now - checked < settings.REPLICA_CHECK_INTERVAL):
+                return healthy
+            self.checked[alias] = (now, healthy)
+
+        healthy = self.check(alias)
+        with self._lock:
+            self.checked[alias] = (time.monotonic(), healthy)
+        return healthy
+
+    def check(self, alias):
+        try:
+            behind = lag(alias)
+        except DatabaseError:
+            logger.warning('Replica %s is down', alias, exc_info=True)
+            return False
+        if behind > settings.REPLICA_MAX_LAG_SECONDS:
+            logger.warning('Replica %s is %.1fs behind', alias, behind)
+            return False
+        return True
+
+
+health = ReplicaHealth()
+
+
+def choose():
+    """ A healthy replica, at random, or None if there's none.
+    """
+    replicas = [alias for alias in settings.DATABASE_REPLICAS
+                if health.healthy(alias)]
+    return random.choice(replicas) if replicas else None
+
+
+def pin_key(user_id):
+    return f'replicas:pin:{user_id}'
+
+
+def pin(user):
+    """ Send the user's reads to the primary for the next
+        settings.REPLICA_PIN_SECONDS, after they've written
+        something, so they read what they've written.
+    """
+    if settings.DATABASE_REPLICAS:
+        caches[settings.REPLICA_PIN_CACHE].set(
+            pin_key(user.id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def pinned(user):
+    return (user.is_authenticated and caches[settings.REPLICA_PIN_CACHE]
+            .get(pin_key(user.id)) is not None)
+
+
+def _choose_for(user):
+    if settings.DATABASE_REPLICAS and not pinned(user):
+        return choose()
+    return None
+
+
+def start_reading(user):
+    """ Send the reads of the current request to a healthy replica,
+        unless the user is pinned to the primary, returns a token
+        for stop_reading.
+    """
+    return _replica.set(_choose_for(user))
+
+
+async def astart_reading(user):
+    """ start_reading, for the async views.
+
+        Note: The replica is chosen in a thread, as the pin is in
+              the cache and checking the replicas queries them,
+              but set in the event loop, for the token to be reset
+              there. The async ORM's threads are handed a copy of
+              it with the rest of the context.
+    """
+    alias = None
+    if settings.DATABASE_REPLICAS:
+        alias = await sync_to_async(_choose_for)(user)
+    return _replica.set(alias)
+
+
+def stop_reading(token):
+    _replica.reset(token)
+
+
+def current():
+    """ The replica the current request reads from, or None.
+    """
+    return _replica.get()
+
+
+@contextmanager
+def primary():
+    """ Read from the primary within the block, for reads that
+        have to be up to date, e.g. stock.
+    """
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def may_be_behind(since):
+    """ Whether what's read in the current request may be from
+        before since, a timestamp: it's read from a replica, which
+        can be up to REPLICA_MAX_LAG_SECONDS behind, and more until
+        it's next checked.
+    """
+    return (_replica.get() is not None
+            and time.time() - since < settings.REPLICA_MAX_LAG_SECONDS
+            + settings.REPLICA_CHECK_INTERVAL)
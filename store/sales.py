@@ -0,0 +1,151 @@
+# General
+from collections import Counter
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+# Opply
+from .models import (Product, Order, OrderProducts, ProductSales,
+                     SalesCatchUp)
+
+
+def record(sales):
+    """ Add units sold to ProductSales, sales being a mapping of
+        (product id, day) to units, in one statement.
+
+        Note: Only the catch-up writes to it, see catch_up, so
+              orders never wait on its rows.
+    """
+    if not sales:
+        return
+    table = ProductSales._meta.db_table
+    rows = sorted(sales.items())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (product_id, day, units) VALUES '
+            + ', '.join(['(%s, %s, %s)'] * len(rows))
+            + f' ON CONFLICT (product_id, day) DO UPDATE'
+              f' SET units = {table}.units + EXCLUDED.units',
+            [value for (product_id, day), units in rows
+             for value in (product_id, day, units)])
+
+
+def catch_up(batch_size=None):
+    """ Add the next batch of order lines to ProductSales, in order
+        of id from the last one done, returns how many lines were
+        done, none once it's caught up.
+
+        Note: Only confirmed orders are counted. The catch-up stops
+              short of the first pending order, until it's been
+              confirmed or rejected, and of orders placed in the
+              last settings.SALES_CATCH_UP_MARGIN seconds, as the
+              ids of lines are handed out before they're committed,
+              so one can be committed after a later one.
+    """
+    batch_size = batch_size or settings.SALES_CATCH_UP_BATCH_SIZE
+    recent = timezone.now() - timedelta(
+        seconds=settings.SALES_CATCH_UP_MARGIN)
+
+    with transaction.atomic():
+        SalesCatchUp.objects.get_or_create(pk=1)
+        state = SalesCatchUp.objects.select_for_update().get(pk=1)
+        lines = list(OrderProducts.objects
+                     .filter(id__gt=state.last_id)
+                     .order_by('id')
+                     .values_list('id', 'product_id', 'quantity',
+                                  'order__datetime', 'order__status')
+                     [:batch_size])
+        sales, done = Counter(), 0
+        for line_id, product_id, quantity, datetime, status in lines:
+            if status == Order.PENDING or datetime > recent:
+                break
+            if status == Order.CONFIRMED:
+                sales[product_id, timezone.localdate(datetime)] += quantity
+            state.last_id = line_id
+            done += 1
+        if done:
+            record(sales)
+            state.save(update_fields=['last_id'])
+        return done
+
+
+def counted():
+    """ The id of the last order line counted in ProductSales.
+    """
+    state = SalesCatchUp.objects.filter(pk=1).first()
+    return state.last_id if state is not None else 0
+
+
+def top_sellers(days=None, limit=None):
+    """ The products which sold the most units over the last
+        days days, today included, with the units sold.
+    """
+    days = days or settings.SALES_REPORT_DAYS
+    limit = limit or settings.SALES_REPORT_LIMIT
+    since = timezone.localdate() - timedelta(days=days - 1)
+    sellers = (ProductSales.objects.filter(day__gte=since)
+                                   .values('product_id', 'product__name')
+                                   .annotate(units=Sum('units'))
+                                   .order_by('-units', 'product_id')[:limit])
+    return [{'id': seller['product_id'], 'name': seller['product__name'],
+             'units': seller['units']} for seller in sellers]
+
+
+def low_stock(threshold=None, days=None, limit=None):
+    """ The products with at most threshold units in stock, the
+        lowest first, with their units sold per day over the last
+        days days, and the days of stock that leaves.
+    """
+    threshold = (settings.LOW_STOCK_THRESHOLD if threshold is None
+                 else threshold)
+    days = days or settings.SALES_REPORT_DAYS
+    limit = limit or settings.SALES_REPORT_LIMIT
+    since = timezone.localdate() - timedelta(days=days - 1)
+
+    products = list(Product.objects.with_stock()
+                                   .filter(stock__lte=threshold)
+                                   .order_by('stock', 'id')
+                                   .values('id', 'name', 'stock')[:limit])
+    sold = dict(ProductSales.objects
+                .filter(product__in=[product['id'] for product in products],
+                        day__gte=since)
+                .values('product_id')
+                .annotate(units=Sum('units'))
+                .values_list('product_id', 'units'))
+    for product in products:
+        product['quantity_in_stock'] = product.pop('stock')
+        product['per_day'] = sold.get(product['id'], 0) / days
+        product['days_left'] = (product['quantity_in_stock']
+                                / product['per_day']
+                                if product['per_day'] else None)
+    return products
+
+
+def top_spenders(days=None, limit=None):
+    """ The customers who spent the most on their confirmed orders
+        over the last days days, today included, with their number
+        of orders and units, and what all of the customers spent.
+
+        Note: It's read from the totals the orders were placed
+              with, see orders.totals, so no lines or prices are
+              read, however many orders there are.
+    """
+    days = days or settings.SALES_REPORT_DAYS
+    limit = limit or settings.SALES_REPORT_LIMIT
+    since = timezone.make_aware(datetime.combine(
+        timezone.localdate() - timedelta(days=days - 1), time.min))
+    orders = Order.objects.filter(status=Order.CONFIRMED,
+                                  datetime__gte=since)
+    spending = {'orders': Count('id'), 'units': Sum('item_count'),
+                'spent': Sum('total')}
+
+    def row(values):
+        return {'orders': values['orders'], 'units': values['units'] or 0,
+                'spent': f'{values["spent"] or 0:.2f}'}
+    customers = (orders.values('user_id').annotate(**spending)
+                       .order_by('-spent', 'user_id')[:limit])
+    return {'customers': [{'user': customer['user_id'], **row(customer)}
+                          for customer in customers],
+            'all': row(orders.aggregate(**spending))}
@@ -1,6 +1,12 @@
+from collections import Counter
+from decimal import Decimal
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 from exceptions import ProductOutOfStockException
-from .models import Product, Order, OrderProducts
+from . import availability, orders
+from .models import Product, Order, product_ids_of
+from .rows import RowSerializer
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -8,13 +14,81 @@ class ProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = ['id', 'name', 'price', 'quantity_in_stock']
 
+    def to_representation(self, instance):
+        """ Note: Reports the whole stock of the product, where
+                  it's been annotated, see ProductQuerySet.with_stock.
+        """
+        data = super().to_representation(instance)
+        stock = getattr(instance, 'stock', None)
+        if stock is not None:
+            data['quantity_in_stock'] = stock
+        return data
+
+
+class ProductsIdField(serializers.Field):
+    """ Field representing the lines of an order.
+
+        Accepts either the legacy list of product ids, with a
+        product repeated once per unit, e.g. [1, 1, 2], or a list
+        of lines, e.g. [{"product": 1, "quantity": 2}, {"product": 2}],
+        or a mix of the two. Either way the units are aggregated
+        per product, so an order has one line per product.
+
+        Note: It always renders the legacy list of product ids,
+              so existing clients keep working. The ids are taken
+              from the order's product_ids when they've already
+              been fetched, see OrderQuerySet.with_product_ids.
+
+        Note: to_internal_value only coerces the ids, it doesn't
+              look the products up. The products of an order are
+              dealt with together, in one query, when the order
+              is created, rather than one query per id here.
+    """
+    default_error_messages = {
+        'not_a_list': _('Expected a list of items but got type '
+                        '"{input_type}".'),
+        'incorrect_type': _('Incorrect type. Expected pk value, '
+                            'received {data_type}.'),
+        'invalid_quantity': _('Quantity must be a positive integer.'),
+    }
+
+    def get_attribute(self, instance):
+        product_ids = getattr(instance, 'product_ids', None)
+        if product_ids is not None:
+            return product_ids
+        return super().get_attribute(instance)
 
-class ProductsIdField(serializers.RelatedField):
     def to_representation(self, value):
-        return value.product_id
+        if isinstance(value, list):
+            return value
+        return [product_id for product_id, quantity in
+                value.order_by('id').values_list('product_id', 'quantity')
+                for _ in range(quantity)]
 
     def to_internal_value(self, data):
-        return Product.objects.get(id=data)
+        if isinstance(data, (str, dict)) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+
+        quantities = Counter()
+        for item in data:
+            if isinstance(item, dict):
+                product, quantity = item.get('product'), item.get('quantity', 1)
+            else:
+                product, quantity = item, 1
+            product = self._to_int(product, 'incorrect_type')
+            quantity = self._to_int(quantity, 'invalid_quantity')
+            if quantity < 1:
+                self.fail('invalid_quantity')
+            quantities[product] += quantity
+        return quantities
+
+    def _to_int(self, value, error):
+        if isinstance(value, bool):
+            self.fail(error, data_type=type(value).__name__)
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            self.fail(error, data_type=type(value).__name__)
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -45,22 +119,198 @@ class OrderSerializer(serializers.ModelSerializer):
 
              Of course we don't have to use PKs here, we could use
              GUIDs, SKUs etc.
+
+        Note: The total and item_count are those worked out when
+              the order was placed, at the prices of the time, see
+              orders.totals, so listing orders needs no prices.
     """
 
-    products = ProductsIdField(many=True, queryset=Product.objects.all())
+    products = ProductsIdField()
 
     class Meta:
         model = Order
-        fields = ['id', 'user', 'datetime', 'products']
-        read_only_fields = ('id', 'user', 'datetime')
+        fields = ['id', 'user', 'datetime', 'status', 'products', 'total',
+                  'item_count']
+        read_only_fields = ('id', 'user', 'datetime', 'status', 'total',
+                            'item_count')
+
+    def validate_products(self, quantities):
+        """ Turn away orders for products known to be short without
+            going near the database, from the cached stock only.
+            The stock is checked properly when it's reserved.
+        """
+        cached = availability.get_availability(quantities, cached_only=True)
+        if any(cached[pk] < quantities[pk] for pk in cached):
+            raise ProductOutOfStockException
+        return quantities
 
     def create(self, validated_data):
-        products_data = validated_data.pop('products')
-        order = Order.objects.create(
-            user=self.context['user'], **validated_data)
-
-        for product in products_data:
-            if product.quantity_in_stock < 1:
-                raise ProductOutOfStockException
-            OrderProducts(order=order, product=product).save()
-        return order
+        """ Place the order, see orders.place, or with async in
+            the context leave it pending, see orders.enqueue.
+        """
+        quantities = validated_data.pop('products')
+        place = orders.enqueue if self.context.get('async') else orders.place
+
+        try:
+            return place(self.context['user'], quantities)
+        except Product.DoesNotExist as e:
+            missing = e.args[0]
+            raise serializers.ValidationError(
+                {'products': [f'Invalid pk "{pk}" - object does not exist.'
+                              for pk in missing]})
+
+
+class ProductRowSerializer(RowSerializer):
+    """ ProductSerializer for rows, see RowSerializer, reporting
+        the whole stock, so for products read with_stock.
+    """
+    serializer_class = ProductSerializer
+    columns = {'id': 'id', 'name': 'name', 'price': 'price',
+               'quantity_in_stock': 'stock'}
+
+
+class OrderRowSerializer(RowSerializer):
+    """ OrderSerializer for rows, see RowSerializer, with the
+        product ids of all of the orders read in one query.
+    """
+    serializer_class = OrderSerializer
+    columns = {'id': 'id', 'user': 'user_id', 'datetime': 'datetime',
+               'status': 'status', 'products': None, 'total': 'total',
+               'item_count': 'item_count'}
+    passthrough = RowSerializer.passthrough + (ProductsIdField, )
+
+    def prepare(self, rows):
+        product_ids = product_ids_of([row.id for row in rows])
+        return [(*row, product_ids[row.id]) for row in rows]
+
+
+class OrderBatchItemSerializer(serializers.Serializer):
+    products = ProductsIdField()
+
+
+class OrderBatchSerializer(serializers.Serializer):
+    """ Serializer for a batch of orders, see orders.place_batch,
+        e.g. {"mode": "best_effort", "orders": [{"products": [1, 2]},
+                                                {"products": [3]}]}
+
+        Note: Each order's products are in the same forms as those
+              of OrderSerializer, they come out as a list of mappings
+              of product id to units, one per order.
+    """
+    ALL_OR_NOTHING = 'all_or_nothing'
+    BEST_EFFORT = 'best_effort'
+
+    mode = serializers.ChoiceField(choices=[ALL_OR_NOTHING, BEST_EFFORT],
+                                   default=ALL_OR_NOTHING)
+    orders = OrderBatchItemSerializer(many=True, allow_empty=False)
+
+    def validate_orders(self, orders):
+        if len(orders) > settings.ORDER_BATCH_MAX_ORDERS:
+            raise serializers.ValidationError(
+                _('At most {max} orders at a time.').format(
+                    max=settings.ORDER_BATCH_MAX_ORDERS))
+        return [order['products'] for order in orders]
+
+
+class OrderExportSerializer(serializers.Serializer):
+    """ Serializer for the query parameters of an order export,
+        e.g. /store/orders/export?output=csv&since=2022-11-01
+
+        Note: user is only for staff, who can export the orders
+              of anyone, or everyone if it's left out. Everyone
+              else only exports their own.
+
+        Note: Archived orders, see archive, are only exported
+              with archived=true.
+    """
+    output = serializers.ChoiceField(choices=['ndjson', 'csv'],
+                                     default='ndjson')
+    user = serializers.IntegerField(required=False)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    archived = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if 'since' in data and 'until' in data \
+                and data['since'] >= data['until']:
+            raise serializers.ValidationError(
+                {'until': _('Must be after since.')})
+        return data
+
+
+class ProductImportSerializer(ProductSerializer):
+    """ ProductSerializer for validating imported rows, without
+        the query per row checking the name is unique. Products are
+        upserted by name, see importer.
+    """
+    class Meta(ProductSerializer.Meta):
+        fields = ['name', 'price', 'quantity_in_stock']
+        extra_kwargs = {'name': {'validators': []}}
+
+
+class StockDeltaSerializer(serializers.Serializer):
+    """ Serializer for a row of a stock delta import, a number of
+        units to add to a product's stock.
+    """
+    name = serializers.CharField(max_length=64)
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class ProductFilterSerializer(serializers.Serializer):
+    """ Serializer for the query parameters filtering the products,
+        see ProductQuerySet.search, e.g.
+        /store/products?name=ch&min_price=10&max_price=100&in_stock=true
+        or /store/products?ids=1,2,3
+    """
+    max_ids = 1000
+
+    name = serializers.CharField(max_length=64, required=False,
+                                 allow_blank=True)
+    search = serializers.CharField(max_length=64, required=False,
+                                   allow_blank=True)
+    min_price = serializers.DecimalField(max_digits=20, decimal_places=2,
+                                         min_value=Decimal(0), required=False)
+    max_price = serializers.DecimalField(max_digits=20, decimal_places=2,
+                                         min_value=Decimal(0), required=False)
+    in_stock = serializers.BooleanField(required=False)
+    ids = serializers.CharField(required=False)
+
+    def validate_ids(self, ids):
+        try:
+            ids = [int(pk) for pk in ids.split(',') if pk]
+        except ValueError:
+            raise serializers.ValidationError(
+                _('Expected a comma separated list of product ids.'))
+        if len(ids) > self.max_ids:
+            raise serializers.ValidationError(
+                _('At most {max} ids at a time.').format(max=self.max_ids))
+        return ids
+
+    def validate(self, data):
+        if data.get('min_price') is not None \
+                and data.get('max_price') is not None \
+                and data['min_price'] > data['max_price']:
+            raise serializers.ValidationError(
+                {'max_price': _('Must be at least min_price.')})
+        return data
+
+
+class StockReportSerializer(serializers.Serializer):
+    """ Serializer for the query parameters of the stock report,
+        see sales.low_stock and sales.top_sellers.
+    """
+    threshold = serializers.IntegerField(min_value=0, required=False)
+    days = serializers.IntegerField(min_value=1, max_value=366,
+                                    required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100,
+                                     required=False)
+
+
+class SpendingReportSerializer(serializers.Serializer):
+    """ Serializer for the query parameters of the spending report,
+        see sales.top_spenders.
+    """
+    days = serializers.IntegerField(min_value=1, max_value=366,
+                                    required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100,
+                                     required=False)
@@ -1,24 +1,96 @@
 # General
-from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.db import transaction
+from rest_authtoken.models import AuthToken
 
 # Opply
-from .models import OrderProducts, Product
+from . import availability, catalogue, ledger
+from .authentication import tokens
+from .models import Product, StockMovement
 
 
-@receiver(post_save, sender=OrderProducts)
-def order_products_changed(sender, instance, **kwargs):
-    """ One method to deal with the decrement of quantity
-        counter is to have a post save signal.
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, **kwargs):
+    """ Any change to a product starts a new version of the
+        cached catalogue, and drops its cached stock, once it's
+        committed.
 
-        There is a race condition here though, if two
-        products are simultaneously bought, so we add
-        a row lock mechanism via select_for_update, so
-        subsequent queries have to wait on this completing.
+        Note: Queryset update() and bulk operations don't send
+              these signals, anything changing products that way
+              has to do this itself, e.g. stock.reserve.
     """
+    def changed():
+        catalogue.bump()
+        availability.invalidate([instance.id])
 
-    with transaction.atomic():
-        product = Product.objects.select_for_update().get(id=instance.product.id)
-        product.quantity_in_stock -= 1
-        product.save()
+    transaction.on_commit(changed)
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, raw=False, update_fields=None,
+                   **kwargs):
+    """ Lock the row of a product being saved and note its stock,
+        for product_saved.
+
+        Note: Product.save runs in a transaction, so the row stays
+              locked until its movement is written.
+    """
+    instance._stock_before = None
+    if raw or (update_fields is not None
+               and 'quantity_in_stock' not in update_fields):
+        return
+    instance._stock_before = 0
+    if instance.pk is not None:
+        instance._stock_before = (
+            Product.objects.select_for_update(no_key=True)
+                           .filter(id=instance.pk)
+                           .values_list('quantity_in_stock', flat=True)
+                           .first() or 0)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+    """ Write the change to the stock of a product saved to the
+        ledger, a restock for a new product, an adjustment
+        otherwise.
+
+        Note: As for product_changed, queryset update() and bulk
+              operations have to do this themselves, e.g.
+              importer.upsert.
+    """
+    before = getattr(instance, '_stock_before', None)
+    if before is None:
+        return
+    ledger.record(StockMovement.RESTOCK if created
+                  else StockMovement.ADJUSTMENT,
+                  {instance.pk: instance.quantity_in_stock - before})
+
+
+@receiver(post_delete, sender=AuthToken)
+def token_deleted(sender, instance, **kwargs):
+    """ Forget a token as soon as it's deleted, e.g. on logout,
+        and again on commit, in case it was cached in between.
+    """
+    tokens.invalidate([instance.hashed_token])
+    transaction.on_commit(lambda: tokens.invalidate([instance.hashed_token]))
+
+
+@receiver(post_save, sender=get_user_model())
+def user_saved(sender, instance, **kwargs):
+    """ Forget the tokens of a user who's been deactivated, as
+        for token_deleted.
+
+        Note: Deactivating users with queryset update() doesn't
+              send this signal, their tokens are only refused once
+              their cache entries expire.
+    """
+    if instance.is_active:
+        return
+    hashed_tokens = list(AuthToken.objects.filter(user=instance)
+                                          .values_list('hashed_token',
+                                                       flat=True))
+    tokens.invalidate(hashed_tokens)
+    transaction.on_commit(lambda: tokens.invalidate(hashed_tokens))
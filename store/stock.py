@@ -0,0 +1,249 @@
+# General
+import threading
+from collections import defaultdict
+import time
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, When
+
+# Opply
+from exceptions import ProductOutOfStockException
+from . import availability
+from .models import Product, StockShard
+
+
+class ReservationStats:
+    """ In process counters for the stock reservations.
+
+        Note: lock_wait is the time spent in the guarded UPDATE.
+              It's a single statement with no reads, so under
+              contention almost all of that time is spent waiting
+              on the row locks held by other transactions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.monotonic()
+            self.reservations = 0
+            self.rejections = 0
+            self.units = 0
+            self.lock_wait = 0.0
+            self.max_lock_wait = 0.0
+            self.products = defaultdict(lambda: [0, 0.0])
+
+    def record(self, units, wait, success, product_ids=()):
+        with self._lock:
+            for product_id in product_ids:
+                counts = self.products[product_id]
+                counts[0] += 1
+                counts[1] += wait
+            if success:
+                self.reservations += 1
+                self.units += units
+            else:
+                self.rejections += 1
+            self.lock_wait += wait
+            self.max_lock_wait = max(self.max_lock_wait, wait)
+
+    def contention(self):
+        """ The reservations of each product, and the time spent
+            waiting on them, since this was last called, as a
+            mapping of product id to (reservations, seconds).
+        """
+        with self._lock:
+            products = self.products
+            self.products = defaultdict(lambda: [0, 0.0])
+        return {product_id: tuple(counts)
+                for product_id, counts in products.items()}
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            attempts = self.reservations + self.rejections
+            return {
+                'reservations': self.reservations,
+                'rejections': self.rejections,
+                'units': self.units,
+                'reservations_per_second':
+                    self.reservations / elapsed if elapsed else 0.0,
+                'lock_wait_seconds': self.lock_wait,
+                'mean_lock_wait_seconds':
+                    self.lock_wait / attempts if attempts else 0.0,
+                'max_lock_wait_seconds': self.max_lock_wait,
+            }
+
+
+stats = ReservationStats()
+
+
+def reserve(quantities):
+    """ Take stock for an order, quantities is a mapping of
+        product id to the number of units wanted.
+
+        The stock of every product is decremented by a single
+        UPDATE ... SET quantity_in_stock = quantity_in_stock - n
+        WHERE quantity_in_stock >= n, the current values are never
+        read into python. If any product is short, fewer rows are
+        updated than asked for and ProductOutOfStockException is
+        raised, or Product.DoesNotExist for unknown ids.
+
+        With settings.STOCK_SHARDING, products whose stock is
+        sharded take it from one of their slots instead, see
+        _reserve_sharded.
+
+        Note: This has to run inside the transaction placing the
+              order, so that raising here rolls back the stock
+              already taken along with the rest of the order.
+    """
+    if not connection.in_atomic_block:
+        raise RuntimeError('Stock must be reserved inside a transaction.')
+    if not quantities:
+        return
+
+    sharded = set()
+    if settings.STOCK_SHARDING:
+        sharded = set(StockShard.objects.filter(product_id__in=quantities)
+                                        .values_list('product_id', flat=True)
+                                        .distinct())
+
+    start = time.monotonic()
+    success = (_reserve({pk: quantity for pk, quantity in quantities.items()
+                         if pk not in sharded})
+               and all(_reserve_sharded(pk, quantities[pk])
+                       for pk in sorted(sharded)))
+    stats.record(sum(quantities.values()), time.monotonic() - start, success,
+                 [pk for pk in quantities if pk not in sharded])
+
+    if not success:
+        # Only on the failure path, work out whether it was
+        # a shortfall or a product that doesn't exist.
+        existing = set(Product.objects.filter(id__in=quantities)
+                                      .values_list('id', flat=True))
+        missing = sorted(set(quantities) - existing)
+        if missing:
+            raise Product.DoesNotExist(missing)
+        raise ProductOutOfStockException
+
+    transaction.on_commit(lambda: availability.invalidate(quantities))
+
+
+def lock(product_ids):
+    """ Lock the products, in order of id, and return their whole
+        stock, as a mapping of product id to quantity, leaving out
+        products that don't exist.
+
+        With the products locked, their stock can't change until
+        the transaction ends, so what's taken from it, by reserve,
+        can be worked out up front, e.g. for a batch of orders.
+
+        Note: With settings.STOCK_SHARDING, the slots of the
+              products are locked too, after all of the products.
+    """
+    if not connection.in_atomic_block:
+        raise RuntimeError('Stock must be locked inside a transaction.')
+    stock = dict(Product.objects.select_for_update()
+                                .filter(id__in=product_ids)
+                                .order_by('id')
+                                .values_list('id', 'quantity_in_stock'))
+    if settings.STOCK_SHARDING:
+        for product_id, quantity in (
+                StockShard.objects.select_for_update()
+                                  .filter(product_id__in=stock)
+                                  .order_by('product_id', 'slot')
+                                  .values_list('product_id', 'quantity')):
+            stock[product_id] += quantity
+    return stock
+
+
+def _reserve(quantities):
+    """ The guarded UPDATE of reserve, returns whether all of
+        the products had the stock.
+    """
+    if not quantities:
+        return True
+
+    in_stock = Q()
+    decrement = []
+    for product_id, quantity in sorted(quantities.items()):
+        in_stock |= Q(id=product_id, quantity_in_stock__gte=quantity)
+        decrement.append(When(id=product_id,
+                              then=F('quantity_in_stock') - quantity))
+
+    updated = Product.objects.filter(in_stock).update(
+        quantity_in_stock=Case(*decrement))
+    return updated == len(quantities)
+
+
+def _reserve_sharded(product_id, quantity):
+    """ Take stock from one of the slots of a sharded product,
+        returns whether it had the stock.
+
+        A slot with enough units is picked at random from those
+        no other transaction has locked (SKIP LOCKED), so
+        concurrent buyers of the product spread over its slots
+        rather than queuing on one row. When they're all locked,
+        the buyer queues on just one of them, again at random.
+
+        Note: If no one slot has enough units, as they've been
+              spread too thinly, this falls back to locking all
+              of the slots and taking the units from as many of
+              them as needed.
+    """
+    shards = StockShard.objects.filter(product_id=product_id,
+                                       quantity__gte=quantity)
+
+    # If a slot is drained while we wait for it, Postgres still
+    # holds its lock after skipping it, both for the SELECT FOR
+    # UPDATE and the UPDATE. Holding that lock while waiting on
+    # all of the slots below could deadlock, so it's let go of
+    # by rolling back to this savepoint.
+    savepoint = transaction.savepoint()
+    for locking in (shards.select_for_update(skip_locked=True), shards):
+        shard_id = locking.order_by('?').values_list('id', flat=True).first()
+        if shard_id is not None and shards.filter(id=shard_id).update(
+                quantity=F('quantity') - quantity):
+            transaction.savepoint_commit(savepoint)
+            return True
+    transaction.savepoint_rollback(savepoint)
+
+    shards = list(StockShard.objects.select_for_update()
+                                    .filter(product_id=product_id)
+                                    .order_by('slot'))
+    if sum(shard.quantity for shard in shards) < quantity:
+        return False
+    for shard in shards:
+        taken = min(shard.quantity, quantity)
+        shard.quantity -= taken
+        quantity -= taken
+    StockShard.objects.bulk_update(shards, ['quantity'])
+    return True
+
+
+@transaction.atomic
+def rebalance(product_id, shards):
+    """ Spread the whole stock of a product evenly over shards
+        slots, or, with no shards, move it all back into the
+        product's quantity_in_stock.
+
+        Note: Slots drain unevenly, as buyers take from whichever
+              is free, rebalancing from time to time keeps units
+              in all of them.
+    """
+    product = Product.objects.select_for_update().get(id=product_id)
+    slots = list(StockShard.objects.select_for_update()
+                                   .filter(product=product))
+    total = product.quantity_in_stock + sum(slot.quantity for slot in slots)
+
+    StockShard.objects.filter(product=product).delete()
+    StockShard.objects.bulk_create(
+        [StockShard(product=product, slot=slot,
+                    quantity=total // shards + (slot < total % shards))
+         for slot in range(shards)])
+    Product.objects.filter(id=product.id).update(
+        quantity_in_stock=0 if shards else total)
+
+    transaction.on_commit(lambda: availability.invalidate([product_id]))
@@ -0,0 +1,136 @@
+# General
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework import status
+
+# Opply
+from store import archive, catalogue, orders, sales
+from store.models import (ArchivedOrder, Order, OrderProducts, Product,
+                          StockLease)
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    return Product.objects.order_by('id')
+
+
+def place(user, quantities, days_ago, status=Order.CONFIRMED):
+    order = orders.place(user, quantities)
+    Order.objects.filter(id=order.id).update(
+        datetime=timezone.now() - timedelta(days=days_ago), status=status)
+    sales.catch_up()
+    return order
+
+
+@pytest.mark.django_db
+class TestArchive:
+
+    def test_archive(self, user, products, settings):
+        computer, chair = products
+        settings.ORDER_ARCHIVE_AFTER_DAYS = 30
+        old = place(user, {computer.id: 2, chair.id: 1}, days_ago=40)
+        rejected = place(user, {chair.id: 1}, days_ago=50,
+                         status=Order.REJECTED)
+        pending = place(user, {chair.id: 1}, days_ago=60,
+                        status=Order.PENDING)
+        recent = place(user, {chair.id: 1}, days_ago=20)
+
+        assert archive.archive(batch_size=1) == 2
+        assert set(Order.objects.values_list('id', flat=True)) == \
+            {pending.id, recent.id}
+        assert not OrderProducts.objects.filter(order__in=[old.id,
+                                                           rejected.id])
+        archived = ArchivedOrder.objects.get(id=old.id)
+        assert archived.user_id == user.id
+        assert archived.status == Order.CONFIRMED
+        assert archived.lines == [[computer.id, 2, '2234.56'],
+                                  [chair.id, 1, '56.00']]
+        assert archived.total == Decimal('4525.12')
+        assert archived.item_count == 3
+        assert ArchivedOrder.objects.get(id=rejected.id).status == \
+            Order.REJECTED
+        assert archive.archive() == 0
+
+    def test_unsettled_lease(self, user, products):
+        computer, chair = products
+        order = place(user, {computer.id: 1}, days_ago=400)
+        lease = StockLease.objects.create(
+            product=computer, holder='test', units=10, used=1,
+            expires=timezone.now())
+        OrderProducts.objects.filter(order=order).update(lease=lease)
+        assert archive.archive() == 0
+
+        lease.released = True
+        lease.save()
+        assert archive.archive() == 1
+
+    def test_find(self, user, products):
+        computer, chair = products
+        order = place(user, {computer.id: 2, chair.id: 1}, days_ago=400)
+        archive.archive()
+        found = archive.find(user, order.id)
+        assert found.product_ids == [computer.id, computer.id, chair.id]
+        other = User.objects.create_user(username='other')
+        assert archive.find(other, order.id) is None
+        assert archive.find(user, 'x') is None
+
+    def test_command(self, user, products):
+        computer, chair = products
+        place(user, {chair.id: 1}, days_ago=10)
+        out = StringIO()
+        call_command('archive_orders', '--before',
+                     (timezone.now() - timedelta(days=5)).isoformat(),
+                     stdout=out)
+        assert 'Archived 1 orders' in out.getvalue()
+
+    def test_not_counted(self, user, products):
+        computer, chair = products
+        order = orders.place(user, {chair.id: 1})
+        Order.objects.filter(id=order.id).update(
+            datetime=timezone.now() - timedelta(days=400))
+        # The lines would be gone before they're counted in the sales
+        assert archive.archive() == 0
+        sales.catch_up()
+        assert archive.archive() == 1
+
+
+@pytest.mark.django_db
+class TestArchivedOrderView:
+
+    @pytest.fixture(autouse=True)
+    def authenticate(self, request_client, user):
+        request_client.force_authenticate(user)
+
+    @pytest.mark.parametrize('fast', [False, True])
+    def test_retrieve(self, request_client, settings, user, products, fast):
+        settings.FAST_SERIALIZATION = fast
+        computer, chair = products
+        order = place(user, {computer.id: 2, chair.id: 1}, days_ago=400)
+        live = request_client.get(f'/store/orders/{order.id}')
+        archive.archive()
+        catalogue.bump()
+        r = request_client.get(f'/store/orders/{order.id}')
+        assert r.status_code == status.HTTP_200_OK
+        assert r.content == live.content
+        # Not listed
+        assert request_client.get('/store/orders').json()['count'] == 0
+
+        other = User.objects.create_user(username='other')
+        request_client.force_authenticate(other)
+        r = request_client.get(f'/store/orders/{order.id}')
+        assert r.status_code == status.HTTP_404_NOT_FOUND
+        r = request_client.get('/store/orders/999999')
+        assert r.status_code == status.HTTP_404_NOT_FOUND
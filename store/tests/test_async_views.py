@@ -0,0 +1,145 @@
+# General
+import json
+import pytest
+from asgiref.sync import async_to_sync
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.test import AsyncRequestFactory
+from rest_framework import status
+from rest_authtoken.models import AuthToken
+
+# Opply
+from store import async_views
+from store.models import Product, Order, OrderProducts
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def token(user, request_client):
+    r = request_client.post('/auth/login/',
+                            content_type='application/json',
+                            data=json.dumps({'username': 'test_user',
+                                             'password': 'test_password'}))
+    return r.json()['token']
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    Product(name='TV', price=345.11, quantity_in_stock=15).save()
+    return Product.objects.order_by('id')
+
+
+@pytest.fixture
+def orders(user, products):
+    computer, chair, tv = products
+    orders = []
+    for _ in range(5):
+        order = Order.objects.create(user=user)
+        OrderProducts.objects.bulk_create([
+            OrderProducts(order=order, product=computer, quantity=2),
+            OrderProducts(order=order, product=tv),
+        ])
+        orders.append(order)
+    return orders
+
+
+@pytest.mark.django_db
+class TestAsyncViews:
+
+    @pytest.fixture
+    def call(self, token):
+        factory = AsyncRequestFactory()
+
+        def call(view, path, *args, method='get', auth=True, **kwargs):
+            if auth:
+                kwargs['authorization'] = f'Token {token}'
+            request = getattr(factory, method)(path, **kwargs)
+            return async_to_sync(view)(request, *args)
+        return call
+
+    @pytest.fixture
+    def sync_client(self, request_client, token):
+        request_client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        return request_client
+
+    @pytest.mark.parametrize('path', ['/store/products',
+                                      '/store/products?page=2',
+                                      '/store/products?page_size=3'])
+    def test_product_list(self, call, sync_client, products, path):
+        """ The async views respond as the sync views do.
+        """
+        r = call(async_views.product_list, path)
+        assert r.status_code == status.HTTP_200_OK
+        assert json.loads(r.content) == sync_client.get(path).json()
+
+    def test_product_detail(self, call, sync_client, products):
+        path = f'/store/products/{products[1].id}'
+        r = call(async_views.product_detail, path, products[1].id)
+        assert r.status_code == status.HTTP_200_OK
+        assert json.loads(r.content) == sync_client.get(path).json()
+
+    @pytest.mark.parametrize('path', ['/store/orders',
+                                      '/store/orders?page=3',
+                                      '/store/orders?page=last&page_size=4'])
+    def test_order_list(self, call, sync_client, orders, path):
+        r = call(async_views.order_list, path)
+        assert r.status_code == status.HTTP_200_OK
+        assert json.loads(r.content) == sync_client.get(path).json()
+
+    def test_order_detail(self, call, sync_client, orders):
+        path = f'/store/orders/{orders[0].id}'
+        r = call(async_views.order_detail, path, orders[0].id)
+        assert r.status_code == status.HTTP_200_OK
+        assert json.loads(r.content) == sync_client.get(path).json()
+
+    def test_not_found(self, call, orders):
+        other = User.objects.create_user(username='other')
+        order = Order.objects.create(user=other)
+        r = call(async_views.order_detail, f'/store/orders/{order.id}',
+                 order.id)
+        assert r.status_code == status.HTTP_404_NOT_FOUND
+        r = call(async_views.product_list, '/store/products?page=9')
+        assert r.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_bad_auth(self, call, user, token, products):
+        r = call(async_views.product_list, '/store/products', auth=False)
+        assert r.status_code == status.HTTP_401_UNAUTHORIZED
+        assert r.headers['WWW-Authenticate'] == 'Token'
+
+        r = call(async_views.product_list, '/store/products', auth=False,
+                 authorization='Token bm9uc2Vuc2U=')
+        assert r.status_code == status.HTTP_401_UNAUTHORIZED
+
+        user.is_active = False
+        user.save()
+        r = call(async_views.product_list, '/store/products')
+        assert r.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_expired_token(self, call, token, products):
+        AuthToken.objects.update(
+            created=AuthToken.objects.get().created
+            - AuthToken.TOKEN_VALIDITY - timedelta(seconds=1))
+        r = call(async_views.product_list, '/store/products')
+        assert r.status_code == status.HTTP_401_UNAUTHORIZED
+        assert not AuthToken.objects.exists()
+
+    def test_sync_fallback(self, call, products):
+        """ Anything other than a plain GET goes to the sync view.
+        """
+        r = call(async_views.product_list,
+                 '/store/products?pagination=cursor')
+        assert r.status_code == status.HTTP_200_OK
+        assert 'count' not in json.loads(r.content)
+
+        r = call(async_views.order_list, '/store/orders', method='post',
+                 data={'products': [products[0].id]},
+                 content_type='application/json')
+        assert r.status_code == status.HTTP_201_CREATED
+        assert Order.objects.count() == 1
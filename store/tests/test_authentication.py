@@ -0,0 +1,115 @@
+# General
+import json
+import pytest
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_authtoken.models import AuthToken
+
+# Opply
+from store.authentication import TokenCache, tokens
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def token(user, request_client):
+    r = request_client.post('/auth/login/',
+                            content_type='application/json',
+                            data=json.dumps({'username': 'test_user',
+                                             'password': 'test_password'}))
+    return r.json()['token']
+
+
+@pytest.mark.django_db
+class TestCachingAuthentication:
+    api_path = '/store/orders'
+
+    @pytest.fixture
+    def client(self, request_client, token):
+        request_client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        return request_client
+
+    def get(self, client):
+        with CaptureQueriesContext(connection) as ctx:
+            r = client.get(self.api_path)
+        return r, [query['sql'] for query in ctx.captured_queries]
+
+    def test_cached(self, client):
+        r, queries = self.get(client)
+        assert r.status_code == status.HTTP_200_OK
+        assert any('rest_authtoken_authtoken' in sql for sql in queries)
+        assert tokens.snapshot()['misses'] == 1
+
+        # The token and user queries are gone
+        r, cached = self.get(client)
+        assert r.status_code == status.HTTP_200_OK
+        assert len(cached) == len(queries) - 1
+        assert not any('rest_authtoken_authtoken' in sql or 'auth_user' in sql
+                       for sql in cached)
+        assert tokens.snapshot()['local_hits'] == 1
+
+    def test_logout(self, client):
+        assert self.get(client)[0].status_code == status.HTTP_200_OK
+        r = client.delete('/auth/logout/')
+        assert r.status_code == status.HTTP_204_NO_CONTENT
+        assert self.get(client)[0].status_code == \
+            status.HTTP_401_UNAUTHORIZED
+
+    def test_deactivated(self, client, user):
+        assert self.get(client)[0].status_code == status.HTTP_200_OK
+        user.is_active = False
+        user.save()
+        assert self.get(client)[0].status_code == \
+            status.HTTP_401_UNAUTHORIZED
+
+    def test_expired(self, client):
+        assert self.get(client)[0].status_code == status.HTTP_200_OK
+        token = AuthToken.objects.get()
+        tokens.set(bytes(token.hashed_token),
+                   (token.user_id, True,
+                    (token.created - timedelta(seconds=1)).timestamp()))
+        assert self.get(client)[0].status_code == \
+            status.HTTP_401_UNAUTHORIZED
+        assert not AuthToken.objects.exists()
+
+    def test_invalid_token(self, request_client, token):
+        request_client.credentials(HTTP_AUTHORIZATION='Token bm9uc2Vuc2U=')
+        r = request_client.get(self.api_path)
+        assert r.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_shared_cache(self, client, settings):
+        settings.AUTH_TOKEN_CACHE = 'default'
+        self.get(client)
+        # As if in another process
+        tokens.reset()
+        r, queries = self.get(client)
+        assert r.status_code == status.HTTP_200_OK
+        assert not any('rest_authtoken_authtoken' in sql for sql in queries)
+        assert tokens.snapshot()['shared_hits'] == 1
+
+        client.delete('/auth/logout/')
+        tokens.reset()
+        assert self.get(client)[0].status_code == \
+            status.HTTP_401_UNAUTHORIZED
+
+
+def test_token_cache_lru(settings):
+    settings.AUTH_TOKEN_LOCAL_CACHE_SIZE = 2
+    cache = TokenCache()
+    for i in range(3):
+        cache.set(bytes([i]), (i, True, 0))
+        cache.get(bytes([0]))
+    # 0 was used most recently, so 1 was evicted
+    assert cache.get(bytes([0])) == (0, True, 0)
+    assert cache.get(bytes([1])) is None
+    assert cache.get(bytes([2])) == (2, True, 0)
+    assert cache.snapshot() == {'hits': 5, 'local_hits': 5,
+                                'shared_hits': 0, 'misses': 1,
+                                'hit_rate': 5 / 6, 'size': 2}
@@ -0,0 +1,150 @@
+# General
+import pytest
+from django.contrib.auth.models import User
+from rest_framework import status
+
+# Opply
+from store.stock import rebalance
+from store.models import Product, Order, OrderProducts
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    Product(name='TV', price=345.11, quantity_in_stock=1).save()
+    return Product.objects.order_by('id')
+
+
+def stock():
+    return list(Product.objects.order_by('id')
+                               .values_list('quantity_in_stock', flat=True))
+
+
+@pytest.mark.django_db
+class TestBatchOrderView:
+    api_path = '/store/orders/batch'
+
+    @pytest.fixture(autouse=True)
+    def authenticate(self, request_client, user):
+        request_client.force_authenticate(user)
+
+    def place(self, request_client, orders, mode=None, **headers):
+        data = {'orders': [{'products': products} for products in orders]}
+        if mode:
+            data['mode'] = mode
+        return request_client.post(self.api_path, format='json', data=data,
+                                   **headers)
+
+    def test_create(self, request_client, user, products):
+        computer, chair, tv = products
+        r = self.place(request_client, [
+            [computer.id, computer.id, chair.id],
+            [{'product': chair.id, 'quantity': 3}],
+            [tv.id],
+        ])
+        assert r.status_code == status.HTTP_201_CREATED
+        assert r.json()['created'] == 3
+        results = r.json()['results']
+        assert [result['result'] for result in results] == ['created'] * 3
+        assert [result['order']['products'] for result in results] == \
+            [[computer.id, computer.id, chair.id], [chair.id] * 3, [tv.id]]
+        assert [result['order']['user'] for result in results] == \
+            [user.id] * 3
+
+        assert stock() == [31, 17, 0]
+        assert Order.objects.count() == 3
+        lines = OrderProducts.objects.order_by('order_id', 'product_id')
+        assert [(line.order_id, line.product_id, line.quantity)
+                for line in lines] == [
+            (results[0]['order']['id'], computer.id, 2),
+            (results[0]['order']['id'], chair.id, 1),
+            (results[1]['order']['id'], chair.id, 3),
+            (results[2]['order']['id'], tv.id, 1),
+        ]
+
+    def test_all_or_nothing(self, request_client, products):
+        computer, chair, tv = products
+        r = self.place(request_client, [[computer.id], [tv.id], [tv.id],
+                                        [999999]])
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
+        assert r.json()['created'] == 0
+        # The second TV is short, as the first order has it
+        assert r.json()['results'] == [
+            {'result': 'not_placed'},
+            {'result': 'not_placed'},
+            {'result': 'out_of_stock', 'products': [tv.id]},
+            {'result': 'invalid', 'products': [999999]},
+        ]
+        assert not Order.objects.exists()
+        assert stock() == [33, 21, 1]
+
+    def test_best_effort(self, request_client, products):
+        computer, chair, tv = products
+        r = self.place(request_client, [[computer.id, tv.id], [tv.id],
+                                        [chair.id] * 22, [chair.id] * 21],
+                       mode='best_effort')
+        assert r.status_code == status.HTTP_200_OK
+        assert r.json()['created'] == 2
+        assert [result['result'] for result in r.json()['results']] == \
+            ['created', 'out_of_stock', 'out_of_stock', 'created']
+        assert Order.objects.count() == 2
+        assert stock() == [32, 0, 0]
+
+    def test_query_count(self, request_client, products,
+                         django_assert_num_queries):
+        """ The number of queries doesn't depend on the number of
+            orders in the batch.
+        """
+        computer, chair, tv = products
+        # savepoint, lock the products, decrement stock, read
+        # prices, insert orders, insert lines, record stock
+        # movements, release savepoint
+        with django_assert_num_queries(8):
+            r = self.place(request_client,
+                           [[computer.id, chair.id]] * 10)
+        assert r.status_code == status.HTTP_201_CREATED
+        assert stock() == [23, 11, 1]
+
+    @pytest.mark.parametrize('data', [{}, {'orders': []},
+                                      {'orders': [{'products': [0, 'a']}]},
+                                      {'orders': [{}]},
+                                      {'orders': [{'products': [1]}],
+                                       'mode': 'sometimes'}])
+    def test_invalid(self, request_client, products, data):
+        r = request_client.post(self.api_path, format='json', data=data)
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Order.objects.exists()
+
+    def test_max_orders(self, request_client, products, settings):
+        settings.ORDER_BATCH_MAX_ORDERS = 2
+        r = self.place(request_client, [[products[0].id]] * 3)
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
+        assert r.json() == {'orders': ['At most 2 orders at a time.']}
+
+    def test_idempotency_key(self, request_client, products):
+        computer, chair, tv = products
+        first = self.place(request_client, [[computer.id]] * 2,
+                           HTTP_IDEMPOTENCY_KEY='batch-1')
+        second = self.place(request_client, [[computer.id]] * 2,
+                            HTTP_IDEMPOTENCY_KEY='batch-1')
+        assert second.json() == first.json()
+        assert second.headers['Idempotent-Replayed'] == 'true'
+        assert Order.objects.count() == 2
+
+    def test_sharded(self, request_client, products, settings):
+        settings.STOCK_SHARDING = True
+        computer, chair, tv = products
+        rebalance(computer.id, 4)
+        r = self.place(request_client, [[{'product': computer.id,
+                                          'quantity': 20}]] * 2,
+                       mode='best_effort')
+        assert [result['result'] for result in r.json()['results']] == \
+            ['created', 'out_of_stock']
+        assert Product.objects.with_stock().get(id=computer.id).stock == 13
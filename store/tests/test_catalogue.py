@@ -0,0 +1,183 @@
+# General
+import pytest
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import QueryDict
+from rest_framework import status
+
+# Opply
+from store import catalogue, stock
+from store.models import Product
+
+
+@pytest.fixture
+def user():
+    user = User.objects.create_user(username='test_user',
+                                    password='test_password')
+    user.save()
+    return user
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    Product(name='TV', price=345.11, quantity_in_stock=15).save()
+    return Product.objects.order_by('id')
+
+
+@pytest.mark.django_db
+class TestCatalogueCache:
+    api_path = '/store/products'
+
+    @pytest.fixture(autouse=True)
+    def authenticate(self, request_client, user):
+        request_client.force_authenticate(user)
+
+    def test_cached(self, request_client, products,
+                    django_assert_num_queries):
+        first = request_client.get(self.api_path)
+        assert first.status_code == status.HTTP_200_OK
+        assert first['ETag']
+        assert first['Last-Modified']
+
+        with django_assert_num_queries(0):
+            second = request_client.get(self.api_path)
+        assert second.status_code == status.HTTP_200_OK
+        assert second.content == first.content
+        assert second['ETag'] == first['ETag']
+
+        # Pages are cached separately
+        third = request_client.get(f'{self.api_path}?page=2')
+        assert third.json()['results'][0]['name'] == 'TV'
+
+    def test_unknown_params_not_cached(self, request_client, products,
+                                       django_assert_num_queries):
+        request_client.get(f'{self.api_path}?utm_source=x')
+        with django_assert_num_queries(2):
+            r = request_client.get(f'{self.api_path}?utm_source=x')
+        assert r.status_code == status.HTTP_200_OK
+        assert catalogue.page_key(catalogue.version(),
+                                  'http://testserver/store/products',
+                                  QueryDict('utm_source=x')) is None
+
+    @pytest.mark.parametrize('query', ['ids={id}' + ',{id}' * 50,
+                                       'page=1&page=2'])
+    def test_long_params_not_cached(self, request_client, products,
+                                    django_assert_num_queries, query):
+        query = query.format(id=products[0].id)
+        request_client.get(f'{self.api_path}?{query}')
+        with django_assert_num_queries(2):
+            request_client.get(f'{self.api_path}?{query}')
+
+    def test_params_sorted(self, request_client, products,
+                           django_assert_num_queries):
+        request_client.get(f'{self.api_path}?page=2&page_size=1')
+        with django_assert_num_queries(0):
+            r = request_client.get(f'{self.api_path}?page_size=1&page=2')
+        assert r.json()['results'][0]['name'] == 'Chair'
+
+    def test_bump(self, request_client, products):
+        request_client.get(self.api_path)
+        key = catalogue.page_key(catalogue.version(),
+                                 'http://testserver/store/products',
+                                 QueryDict())
+        assert catalogue.get_page(key)
+        catalogue.bump()
+        # Evicted, rather than left to expire
+        assert catalogue.get_page(key) is None
+        assert catalogue.page_key(catalogue.version(),
+                                  'http://testserver/store/products',
+                                  QueryDict()) != key
+
+    def test_retrieve(self, request_client, products,
+                      django_assert_num_queries):
+        path = f'{self.api_path}/{products[0].id}'
+        first = request_client.get(path)
+        with django_assert_num_queries(0):
+            second = request_client.get(path)
+        assert second.json() == first.json() == {
+            'id': products[0].id,
+            'name': 'Computer',
+            'price': '2234.56',
+            'quantity_in_stock': 33,
+        }
+
+        r = request_client.get(f'{self.api_path}/0')
+        assert r.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_not_modified(self, request_client, products,
+                          django_assert_num_queries):
+        r = request_client.get(self.api_path)
+        with django_assert_num_queries(0):
+            r = request_client.get(self.api_path,
+                                   HTTP_IF_NONE_MATCH=r['ETag'])
+        assert r.status_code == status.HTTP_304_NOT_MODIFIED
+        assert not r.content
+
+    def test_product_change(self, request_client, products,
+                            django_capture_on_commit_callbacks):
+        etag = request_client.get(self.api_path)['ETag']
+
+        computer = products[0]
+        with django_capture_on_commit_callbacks(execute=True):
+            computer.name = 'Desktop'
+            computer.save()
+
+        r = request_client.get(self.api_path, HTTP_IF_NONE_MATCH=etag)
+        assert r.status_code == status.HTTP_200_OK
+        assert r['ETag'] != etag
+        assert r.json()['results'][0]['name'] == 'Desktop'
+
+    def test_stock_change(self, request_client, products,
+                          django_capture_on_commit_callbacks,
+                          django_assert_num_queries):
+        etag = request_client.get(self.api_path)['ETag']
+        key = catalogue.page_key(catalogue.version(),
+                                 'http://testserver/store/products',
+                                 QueryDict())
+
+        with django_capture_on_commit_callbacks(execute=True):
+            with transaction.atomic():
+                stock.reserve({products[0].id: 3})
+
+        # The cold page stands, only the stock is read again
+        assert catalogue.get_page(key)
+        with django_assert_num_queries(1):
+            r = request_client.get(self.api_path, HTTP_IF_NONE_MATCH=etag)
+        assert r.status_code == status.HTTP_200_OK
+        assert r['ETag'] != etag
+        assert r.json()['results'][0]['quantity_in_stock'] == 30
+
+    def test_availability(self, request_client, products,
+                          django_assert_num_queries):
+        computer, chair, tv = products
+        path = f'{self.api_path}/availability?ids={tv.id},{computer.id}'
+        expected = [{'id': computer.id, 'quantity_in_stock': 33},
+                    {'id': tv.id, 'quantity_in_stock': 15}]
+
+        with django_assert_num_queries(1):
+            r = request_client.get(path)
+        assert r.status_code == status.HTTP_200_OK
+        assert r.json() == expected
+        assert 'max-age' in r['Cache-Control']
+
+        with django_assert_num_queries(0):
+            r = request_client.get(path)
+        assert r.json() == expected
+
+    @pytest.mark.parametrize('ids', ['a,b', ','.join(['1'] * 1001)])
+    def test_availability_invalid(self, request_client, ids):
+        r = request_client.get(f'{self.api_path}/availability?ids={ids}')
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_order_short_on_cached_availability(self, request_client,
+                                                products,
+                                                django_assert_num_queries):
+        tv = products[2]
+        request_client.get(f'{self.api_path}/availability?ids={tv.id}')
+        with django_assert_num_queries(0):
+            r = request_client.post('/store/orders', format='json',
+                                    data={'products': [{'product': tv.id,
+                                                        'quantity': 16}]})
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
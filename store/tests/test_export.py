@@ -0,0 +1,213 @@
+# General
+import csv
+import json
+import tracemalloc
+from datetime import timedelta
+from io import StringIO
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import AsyncClient
+from django.utils import timezone
+from rest_framework import status
+
+# Opply
+from store.export import export_orders
+from store.models import ArchivedOrder, Product, Order, OrderProducts
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    return Product.objects.order_by('id')
+
+
+@pytest.fixture
+def orders(user, products):
+    """ An order a day for the last 5 days, from the user, and
+        one from someone else.
+    """
+    computer, chair = products
+    other = User.objects.create_user(username='other')
+    now = timezone.now()
+    orders = Order.objects.bulk_create(
+        [Order(user=user, datetime=now - timedelta(days=i))
+         for i in range(5, 0, -1)] + [Order(user=other, datetime=now)])
+    OrderProducts.objects.bulk_create(
+        [OrderProducts(order=order, product=product, quantity=2)
+         for order in orders for product in (computer, chair)])
+    return orders
+
+
+def archive(order):
+    """ Move the order to the archive, as archive.archive does, with
+        its lines in another order than by product.
+    """
+    lines = order.products.order_by('-product_id')
+    ArchivedOrder.objects.create(
+        id=order.id, user_id=order.user_id, datetime=order.datetime,
+        status=order.status, lines=[[line.product_id, line.quantity, None]
+                                    for line in lines])
+    lines.delete()
+    Order.objects.filter(id=order.id).delete()
+
+
+@pytest.fixture
+def token(user, request_client):
+    r = request_client.post('/auth/login/',
+                            content_type='application/json',
+                            data=json.dumps({'username': 'test_user',
+                                             'password': 'test_password'}))
+    return r.json()['token']
+
+
+@pytest.mark.django_db
+class TestExportView:
+    api_path = '/store/orders/export'
+
+    @pytest.fixture(autouse=True)
+    def authenticate(self, request_client, user):
+        request_client.force_authenticate(user)
+
+    def export(self, request_client, query=''):
+        r = request_client.get(f'{self.api_path}{query}')
+        assert r.status_code == status.HTTP_200_OK
+        return r, b''.join(r.streaming_content).decode()
+
+    def test_ndjson(self, request_client, products, orders):
+        computer, chair = products
+        r, content = self.export(request_client)
+        assert r.headers['Content-Type'] == 'application/x-ndjson'
+        exported = [json.loads(line) for line in content.splitlines()]
+        # Only the user's own orders
+        assert [order['id'] for order in exported] == \
+            [order.id for order in orders[:5]]
+        assert exported[0]['products'] == [
+            {'product': computer.id, 'quantity': 2},
+            {'product': chair.id, 'quantity': 2}]
+        assert exported[0]['status'] == 'confirmed'
+
+        # As the orders endpoint has them
+        order = request_client.get(f'/store/orders/{orders[0].id}').json()
+        assert exported[0]['datetime'] == order['datetime']
+
+    def test_csv(self, request_client, products, orders):
+        r, content = self.export(request_client, '?output=csv')
+        assert r.headers['Content-Type'] == 'text/csv'
+        rows = list(csv.reader(StringIO(content)))
+        assert rows[0] == ['order', 'user', 'datetime', 'status',
+                           'product', 'quantity']
+        assert len(rows) == 1 + 5 * 2
+        assert rows[1][0] == str(orders[0].id)
+
+    def test_date_range(self, request_client, orders):
+        since = orders[1].datetime.isoformat().replace('+00:00', 'Z')
+        until = orders[3].datetime.isoformat().replace('+00:00', 'Z')
+        r, content = self.export(request_client,
+                                 f'?since={since}&until={until}')
+        assert [json.loads(line)['id'] for line in content.splitlines()] == \
+            [orders[1].id, orders[2].id]
+
+    def test_staff(self, request_client, user, orders):
+        user.is_staff = True
+        user.save()
+        r, content = self.export(request_client)
+        assert len(content.splitlines()) == 6
+        r, content = self.export(request_client,
+                                 f'?user={orders[-1].user_id}')
+        assert len(content.splitlines()) == 1
+
+    @pytest.mark.parametrize('output', ['ndjson', 'csv'])
+    def test_archived(self, request_client, orders, output):
+        r, live = self.export(request_client, f'?output={output}')
+        for order in (orders[1], orders[3], orders[-1]):
+            archive(order)
+        r, content = self.export(request_client, f'?output={output}')
+        assert len(content.splitlines()) < len(live.splitlines())
+
+        # Merged in by id, as they were, and only the user's own
+        r, content = self.export(request_client,
+                                 f'?output={output}&archived=true')
+        assert content == live
+
+    @pytest.mark.parametrize('query', ['?output=xml', '?since=yesterday',
+                                       '?since=2022-11-02&until=2022-11-01'])
+    def test_invalid(self, request_client, query):
+        r = request_client.get(f'{self.api_path}{query}')
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.parametrize('output', ['ndjson', 'csv'])
+    def test_asgi(self, token, orders, output):
+        @async_to_sync
+        async def export():
+            r = await AsyncClient().get(
+                f'{self.api_path}?output={output}',
+                AUTHORIZATION=f'Token {token}')
+            # Read in the event loop, as the ASGI handler does
+            return r, b''.join(r.streaming_content).decode()
+        r, content = export()
+        assert r.status_code == status.HTTP_200_OK
+        assert r.headers['Content-Disposition'] == \
+            f'attachment; filename="orders.{output}"'
+        assert len(content.splitlines()) == \
+            (5 if output == 'ndjson' else 11)
+
+
+@pytest.mark.django_db
+class TestExportOrders:
+
+    def test_command(self, user, orders):
+        out = StringIO()
+        call_command('export_orders', '--output', 'csv',
+                     '--user', 'test_user', stdout=out)
+        assert len(out.getvalue().splitlines()) == 1 + 5 * 2
+
+        archive(orders[0])
+        out = StringIO()
+        call_command('export_orders', '--output', 'csv', '--archived',
+                     '--user', 'test_user', stdout=out)
+        assert len(out.getvalue().splitlines()) == 1 + 5 * 2
+
+        out = StringIO()
+        call_command('export_orders', '--since',
+                     orders[-1].datetime.isoformat(), stdout=out)
+        assert [json.loads(line)['id']
+                for line in out.getvalue().splitlines()] == [orders[-1].id]
+
+    def test_memory_ceiling(self, user, products):
+        """ The memory used doesn't grow with the number of orders,
+            exporting 20 times as many doesn't take twice as much.
+        """
+        computer, chair = products
+
+        def add_orders(count):
+            orders = Order.objects.bulk_create(
+                [Order(user=user) for _ in range(count)])
+            OrderProducts.objects.bulk_create(
+                [OrderProducts(order=order, product=product)
+                 for order in orders for product in (computer, chair)])
+
+        def peak():
+            tracemalloc.start()
+            try:
+                size = sum(len(chunk) for chunk in
+                           export_orders('ndjson', chunk_size=200))
+                return size, tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        add_orders(500)
+        small_size, small_peak = peak()
+        add_orders(9500)
+        size, large_peak = peak()
+        assert size > 19 * small_size
+        assert large_peak < 2 * small_peak
+        assert large_peak < size / 5
@@ -0,0 +1,289 @@
+# General
+import threading
+from datetime import timedelta
+from io import StringIO
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+# Opply
+from exceptions import ProductOutOfStockException
+from store import hotstock, orders, stock
+from store.hotstock import HotStock, hot_stock
+from store.models import Product, OrderProducts, StockLease
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    return Product.objects.order_by('id')
+
+
+@pytest.fixture(autouse=True)
+def hot_settings(settings):
+    settings.HOT_STOCK = True
+    settings.HOT_STOCK_FLUSH_INTERVAL = None
+    settings.HOT_STOCK_LEASE_UNITS = 10
+
+
+def quantity(product):
+    return Product.objects.get(id=product.id).quantity_in_stock
+
+
+def whole_stock(product):
+    return Product.objects.with_stock().get(id=product.id).stock
+
+
+def expire(**filters):
+    StockLease.objects.filter(**filters).update(
+        expires=timezone.now() - timedelta(seconds=1))
+
+
+@pytest.mark.django_db
+class TestHotStock:
+
+    @pytest.fixture
+    def hot(self, products):
+        computer, chair = products
+        Product.objects.filter(id=computer.id).update(hot=True)
+        hot_stock.cycle()
+        return computer
+
+    def test_lease(self, hot):
+        lease = StockLease.objects.get()
+        assert (lease.product_id, lease.units, lease.used) == (hot.id, 10, 0)
+        assert lease.holder == hot_stock.holder
+        assert quantity(hot) == 23
+        # The leased units still count as stock
+        assert whole_stock(hot) == 33
+
+    def test_place(self, user, hot, products, django_assert_num_queries):
+        computer, chair = products
+        # No stock update for the hot product: the savepoint, the
+        # chair's stock, prices, insert order, insert lines, record
+        # stock movements and release the savepoint
+        with django_assert_num_queries(7):
+            orders.place(user, {computer.id: 3, chair.id: 1})
+        assert quantity(computer) == 23
+        assert quantity(chair) == 20
+        lines = dict(OrderProducts.objects.values_list('product_id',
+                                                       'lease_id'))
+        assert lines == {computer.id: StockLease.objects.get().id,
+                         chair.id: None}
+
+        # Flushed, the used units are written back
+        hot_stock.flush()
+        assert StockLease.objects.get().used == 3
+        assert whole_stock(computer) == 30
+
+    def test_refill(self, user, hot):
+        for _ in range(4):
+            orders.place(user, {hot.id: 2})
+        # More than half used, another block is added to the lease
+        hot_stock.cycle()
+        lease = StockLease.objects.get()
+        assert (lease.units, lease.used) == (20, 8)
+        assert quantity(hot) == 13
+
+    def test_lease_runs_out(self, user, hot):
+        orders.place(user, {hot.id: 8})
+        # Short, so it's taken from the row
+        orders.place(user, {hot.id: 5})
+        assert quantity(hot) == 18
+        assert list(OrderProducts.objects.order_by('id')
+                                 .values_list('lease_id', flat=True)) == \
+            [StockLease.objects.get().id, None]
+
+    def test_out_of_stock_gives_back(self, user, hot, products):
+        computer, chair = products
+        with pytest.raises(ProductOutOfStockException):
+            orders.place(user, {computer.id: 4, chair.id: 50})
+        hot_stock.flush()
+        assert StockLease.objects.get().used == 0
+
+    def test_batch(self, user, hot, products):
+        computer, chair = products
+        results = orders.place_batch(user, [{computer.id: 3, chair.id: 1},
+                                            {computer.id: 7}],
+                                     all_or_nothing=False)
+        assert [result for result, detail in results] == \
+            [orders.CREATED, orders.CREATED]
+        # Both from the lease, with the row untouched
+        assert quantity(computer) == 23
+        lease = StockLease.objects.get()
+        assert list(OrderProducts.objects.filter(product=computer)
+                                 .values_list('lease_id', flat=True)) == \
+            [lease.id, lease.id]
+
+        # Short on the chair, what it took of the lease goes back
+        results = orders.place_batch(user, [{computer.id: 1, chair.id: 50}])
+        assert results[0][0] == orders.OUT_OF_STOCK
+        hot_stock.flush()
+        assert StockLease.objects.get().used == 10
+        expire()
+        hotstock.settle_expired()
+        assert whole_stock(computer) == 23
+
+    def test_pending(self, user, hot, products):
+        computer, chair = products
+        confirmed = orders.enqueue(user, {computer.id: 4, chair.id: 1})
+        rejected = orders.enqueue(user, {computer.id: 2, chair.id: 50})
+        orders.process_pending()
+        confirmed.refresh_from_db()
+        rejected.refresh_from_db()
+        assert (confirmed.status, rejected.status) == \
+            (confirmed.CONFIRMED, rejected.REJECTED)
+        assert quantity(computer) == 23
+        lease = StockLease.objects.get()
+        assert dict(OrderProducts.objects.filter(order=confirmed)
+                                 .values_list('product_id', 'lease_id')) == \
+            {computer.id: lease.id, chair.id: None}
+        hot_stock.flush()
+        assert StockLease.objects.get().used == 4
+
+        expire()
+        hotstock.settle_expired()
+        assert whole_stock(computer) == 29
+
+    def test_settle(self, user, hot):
+        orders.place(user, {hot.id: 4})
+        # Settling waits for the lease to expire
+        assert hotstock.settle_expired() == 0
+        expire()
+        assert hotstock.settle_expired() == 1
+        lease = StockLease.objects.get()
+        assert (lease.released, lease.used) == (True, 4)
+        assert quantity(hot) == 29
+        assert whole_stock(hot) == 29
+
+    def test_crashed_holder(self, user, hot):
+        """ A holder that went away without flushing, having
+            counted units that never made it into an order, only
+            has the units in its lines taken.
+        """
+        orders.place(user, {hot.id: 2})
+        orders.place(user, {hot.id: 3})
+        lease = StockLease.objects.get()
+        hotstock.get_cache().incr(hotstock.key(lease.id), 4)
+        assert StockLease.objects.get().used == 0
+
+        hot_stock.reset()
+        expire()
+        call_command('hot_stock', 'settle', stdout=StringIO())
+        assert quantity(hot) == 28
+        sold = OrderProducts.objects.aggregate(sold=Sum('quantity'))['sold']
+        assert quantity(hot) + sold == 33
+
+    def test_lost_count(self, user, hot):
+        """ If the cache loses the count, orders go to the row and
+            the lease is given up.
+        """
+        orders.place(user, {hot.id: 2})
+        hotstock.get_cache().clear()
+        orders.place(user, {hot.id: 1})
+        assert quantity(hot) == 22
+
+        hot_stock.flush()
+        assert not hot_stock.leases
+        lease = StockLease.objects.get()
+        assert not lease.released and lease.expires < timezone.now() + \
+            timedelta(seconds=11)
+
+    def test_demote(self, user, hot):
+        Product.objects.filter(id=hot.id).update(hot=False)
+        hot_stock.cycle()
+        assert not hot_stock.leases
+        orders.place(user, {hot.id: 1})
+        assert quantity(hot) == 22
+        expire()
+        hot_stock.cycle()
+        assert quantity(hot) == 32
+        assert StockLease.objects.get().released
+
+    def test_off(self, user, hot, settings):
+        settings.HOT_STOCK = False
+        orders.place(user, {hot.id: 1})
+        assert OrderProducts.objects.get().lease_id is None
+        assert quantity(hot) == 22
+
+    def test_review(self, products, settings):
+        computer, chair = products
+        settings.HOT_STOCK_PROMOTE_RATE = 10
+        settings.HOT_STOCK_PROMOTE_WAIT_MS = 5
+        hot = HotStock()
+        hot.reviewed -= 1
+        stock.stats.contention()
+        for _ in range(20):
+            stock.stats.record(1, 0.01, True, [computer.id])
+            stock.stats.record(1, 0.0001, True, [chair.id])
+        assert hot.review() == ([computer.id], [])
+        assert Product.objects.get(id=computer.id).hot
+        assert not Product.objects.get(id=chair.id).hot
+
+        # Barely sold since, it's demoted
+        hot.hot, hot.leases = {computer.id}, {computer.id: None}
+        hot.reviewed -= 1
+        assert hot.review() == ([], [computer.id])
+        assert not Product.objects.get(id=computer.id).hot
+
+    def test_command(self, products):
+        computer, chair = products
+        out = StringIO()
+        call_command('hot_stock', 'promote', computer.id, stdout=out)
+        hot_stock.cycle()
+        call_command('hot_stock', 'status', stdout=out)
+        call_command('hot_stock', 'demote', computer.id, stdout=out)
+        assert out.getvalue().splitlines() == [
+            'Promoted 1 products',
+            f'Product {computer.id}: 23 in stock, 10 in 1 leases',
+            'Demoted 1 products',
+        ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_orders(user, products):
+    """ Orders from many threads for a hot product, while it's
+        flushed and leased again, never sell more than there is.
+    """
+    computer, chair = products
+    Product.objects.filter(id=computer.id).update(hot=True)
+    hot_stock.cycle()
+    placed = []
+
+    def buy():
+        try:
+            for _ in range(6):
+                try:
+                    orders.place(user, {computer.id: 1})
+                    placed.append(1)
+                except ProductOutOfStockException:
+                    pass
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=buy) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        hot_stock.cycle()
+    for thread in threads:
+        thread.join()
+
+    assert len(placed) == 33
+    sold = OrderProducts.objects.aggregate(sold=Sum('quantity'))['sold']
+    assert sold == 33
+    assert OrderProducts.objects.exclude(lease=None).exists()
+
+    expire()
+    hotstock.settle_expired()
+    assert quantity(computer) == 0
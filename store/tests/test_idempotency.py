@@ -0,0 +1,181 @@
+# General
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+# Opply
+from store import orders
+from store.models import IdempotencyKey, Order, Product
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='TV', price=345.11, quantity_in_stock=1).save()
+    return Product.objects.order_by('id')
+
+
+@pytest.mark.django_db
+class TestIdempotency:
+    api_path = '/store/orders'
+
+    @pytest.fixture(autouse=True)
+    def authenticate(self, request_client, user):
+        request_client.force_authenticate(user)
+
+    def place(self, request_client, product_ids, key='key-1', **headers):
+        return request_client.post(self.api_path, format='json',
+                                   data={'products': product_ids},
+                                   HTTP_IDEMPOTENCY_KEY=key, **headers)
+
+    def test_replay(self, request_client, products,
+                    django_assert_num_queries):
+        computer, tv = products
+        first = self.place(request_client, [computer.id])
+        assert first.status_code == status.HTTP_201_CREATED
+        assert 'Idempotent-Replayed' not in first.headers
+
+        # Read back the key, without touching the products, in a
+        # savepoint as the test runs in a transaction
+        with django_assert_num_queries(3):
+            second = self.place(request_client, [computer.id])
+        assert second.status_code == status.HTTP_201_CREATED
+        assert second.json() == first.json()
+        assert second.headers['Idempotent-Replayed'] == 'true'
+
+        assert Order.objects.count() == 1
+        computer.refresh_from_db()
+        assert computer.quantity_in_stock == 32
+
+    def test_other_keys(self, request_client, user, products):
+        computer, tv = products
+        self.place(request_client, [computer.id], key='key-1')
+        self.place(request_client, [computer.id], key='key-2')
+        # Keys are per user
+        other = User.objects.create_user(username='other')
+        request_client.force_authenticate(other)
+        self.place(request_client, [computer.id], key='key-1')
+        assert Order.objects.count() == 3
+        assert IdempotencyKey.objects.count() == 3
+
+    def test_reused_for_another_request(self, request_client, products):
+        computer, tv = products
+        self.place(request_client, [computer.id])
+        r = self.place(request_client, [computer.id, computer.id])
+        assert r.status_code == 422
+        assert r.json()['detail'] == ('This Idempotency-Key has already '
+                                      'been used for another request.')
+        assert Order.objects.count() == 1
+
+    def test_failure_not_kept(self, request_client, products):
+        computer, tv = products
+        r = self.place(request_client, [tv.id, tv.id])
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
+        assert not IdempotencyKey.objects.exists()
+
+        # The retry is placed afresh, once there's stock
+        Product.objects.filter(id=tv.id).update(quantity_in_stock=2)
+        r = self.place(request_client, [tv.id, tv.id])
+        assert r.status_code == status.HTTP_201_CREATED
+
+    def test_async(self, request_client, products):
+        computer, tv = products
+        first = self.place(request_client, [computer.id],
+                           HTTP_PREFER='respond-async')
+        assert first.status_code == status.HTTP_202_ACCEPTED
+        orders.process_pending()
+
+        second = self.place(request_client, [computer.id],
+                            HTTP_PREFER='respond-async')
+        assert second.status_code == status.HTTP_202_ACCEPTED
+        assert second.json() == first.json()
+        assert second.headers['Location'] == first.headers['Location']
+        assert Order.objects.count() == 1
+
+    def test_invalid_key(self, request_client, products):
+        r = self.place(request_client, [products[0].id], key='k' * 256)
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'Idempotency-Key' in r.json()
+        assert not Order.objects.exists()
+
+    def test_expired(self, request_client, products, settings):
+        computer, tv = products
+        self.place(request_client, [computer.id])
+        IdempotencyKey.objects.update(
+            created=timezone.now() - timedelta(
+                seconds=settings.IDEMPOTENCY_KEY_TIMEOUT + 1))
+        r = self.place(request_client, [computer.id])
+        assert 'Idempotent-Replayed' not in r.headers
+        assert Order.objects.count() == 2
+        assert IdempotencyKey.objects.count() == 1
+
+    def test_purge(self, request_client, products, settings):
+        computer, tv = products
+        for key in ('a', 'b', 'c'):
+            self.place(request_client, [computer.id], key=key)
+        IdempotencyKey.objects.exclude(key='c').update(
+            created=timezone.now() - timedelta(
+                seconds=settings.IDEMPOTENCY_KEY_TIMEOUT + 1))
+        out = StringIO()
+        call_command('purge_idempotency_keys', '--batch-size', 1, stdout=out)
+        assert out.getvalue() == 'Purged 2 keys\n'
+        assert list(IdempotencyKey.objects.values_list('key', flat=True)) \
+            == ['c']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_duplicates(user, products, monkeypatch):
+    """ A repeat sent while the first is still being placed waits
+        for it and replays its response.
+    """
+    computer, tv = products
+    place = orders.place
+    started = threading.Event()
+
+    def slow_place(*args, **kwargs):
+        order = place(*args, **kwargs)
+        started.set()
+        time.sleep(0.5)
+        return order
+    monkeypatch.setattr(orders, 'place', slow_place)
+
+    responses = {}
+
+    def post(name):
+        client = APIClient()
+        client.force_authenticate(user)
+        try:
+            responses[name] = client.post(
+                '/store/orders', format='json',
+                data={'products': [computer.id]},
+                HTTP_IDEMPOTENCY_KEY='key-1')
+        finally:
+            connection.close()
+
+    first = threading.Thread(target=post, args=('first', ))
+    first.start()
+    assert started.wait(10)
+    second = threading.Thread(target=post, args=('second', ))
+    second.start()
+    first.join()
+    second.join()
+
+    assert responses['first'].status_code == status.HTTP_201_CREATED
+    assert responses['second'].json() == responses['first'].json()
+    assert responses['second'].headers['Idempotent-Replayed'] == 'true'
+    assert Order.objects.count() == 1
+    assert Product.objects.get(id=computer.id).quantity_in_stock == 32
@@ -0,0 +1,136 @@
+# General
+import json
+from io import StringIO
+from math import ceil
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.utils import timezone
+
+# Opply
+from store import importer, ledger, stock as stock_
+from store.models import Product, StockLease, StockMovement
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    return Product.objects.order_by('id')
+
+
+def stock():
+    return dict(Product.objects.values_list('name', 'quantity_in_stock'))
+
+
+def inserts(model, count):
+    """ The statements bulk_create takes to insert count rows of
+        model, more than one where the backend limits the
+        parameters of a query, e.g. sqlite.
+    """
+    fields = [field for field in model._meta.concrete_fields
+              if not field.primary_key]
+    return ceil(count / connection.ops.bulk_batch_size(fields,
+                                                       [None] * count))
+
+
+@pytest.mark.django_db
+class TestImportProducts:
+
+    def run(self, tmp_path, name, content, *args):
+        path = tmp_path / name
+        path.write_text(content)
+        out, err = StringIO(), StringIO()
+        call_command('import_products', str(path), *args,
+                     stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv(self, tmp_path, products):
+        out, err = self.run(tmp_path, 'products.csv',
+                            'name,price,quantity_in_stock\n'
+                            'Computer,1999.99,40\n'
+                            'TV,345.11,15\n'
+                            'Lamp,-1,3\n'
+                            'Desk,12.50,x\n')
+        assert out.startswith('Imported 2 rows, rejected 2,')
+        assert 'Line 4: {"price": ' in err
+        assert 'Line 5: {"quantity_in_stock": ' in err
+
+        computer = Product.objects.get(name='Computer')
+        assert str(computer.price) == '1999.99'
+        assert stock() == {'Computer': 40, 'Chair': 21, 'TV': 15}
+
+    def test_ndjson(self, tmp_path, products):
+        rows = [{'name': 'TV', 'price': '345.11', 'quantity_in_stock': 15},
+                {'name': 'TV', 'price': '1', 'quantity_in_stock': 1},
+                {'name': 'Chair', 'price': '50'},
+                ['Lamp']]
+        out, err = self.run(tmp_path, 'products.ndjson',
+                            '\n'.join(json.dumps(row) for row in rows)
+                            + '\nnonsense\n', '--batch-size', '2')
+        assert out.startswith('Imported 1 rows, rejected 4,')
+        assert 'Duplicate name' in err
+        assert stock() == {'Computer': 33, 'Chair': 21, 'TV': 15}
+
+    def test_stock_delta(self, tmp_path, products):
+        out, err = self.run(tmp_path, 'delta.csv',
+                            'name,quantity\n'
+                            'Computer,7\n'
+                            'Chair,1\n'
+                            'Lamp,3\n'
+                            'Chair,0\n',
+                            '--stock-delta')
+        assert out.startswith('Imported 2 rows, rejected 2,')
+        assert 'Line 4: {"name": ["Product does not exist."]}' in err
+        assert stock() == {'Computer': 40, 'Chair': 22}
+
+    def test_rejects_file(self, tmp_path, products):
+        rejects = tmp_path / 'rejects.ndjson'
+        self.run(tmp_path, 'products.csv',
+                 'name,price,quantity_in_stock\nLamp,-1,3\n',
+                 '--rejects', str(rejects))
+        assert json.loads(rejects.read_text())['line'] == 2
+
+    def test_unknown_format(self, tmp_path):
+        with pytest.raises(CommandError):
+            self.run(tmp_path, 'products.txt', '')
+
+    def test_query_count(self, products, django_assert_num_queries):
+        """ Each batch is written in one statement, however
+            big it is.
+        """
+        rows = [(i, {'name': f'Product {i}', 'price': '1',
+                     'quantity_in_stock': i}) for i in range(500)]
+        # savepoint, lock those that exist, upsert, fetch ids, record
+        # stock movements, but Product 0's, release, for each batch
+        with django_assert_num_queries(
+                8 + 2 * inserts(Product, 250) + inserts(StockMovement, 249)
+                + inserts(StockMovement, 250)):
+            results = list(importer.import_products(rows, batch_size=250))
+        assert results == [(250, []), (250, [])]
+        assert Product.objects.count() == 502
+
+    def test_held_stock(self, tmp_path, products):
+        """ The units in a sharded product's slots, and those left
+            of a hot product's lease, stay where they are.
+        """
+        computer, chair = products
+        stock_.rebalance(computer.id, 2)
+        StockLease.objects.create(product=chair, holder='test', units=10,
+                                  expires=timezone.now())
+        Product.objects.filter(id=chair.id).update(quantity_in_stock=11)
+
+        out, err = self.run(tmp_path, 'products.csv',
+                            'name,price,quantity_in_stock\n'
+                            'Computer,2234.56,40\n'
+                            'Chair,56,5\n')
+        assert out.startswith('Imported 1 rows, rejected 1,')
+        assert 'Line 3: {"quantity_in_stock": ["Ensure this value is ' \
+               'greater than or equal to 10' in err
+        assert stock() == {'Computer': 7, 'Chair': 11}
+        assert dict(ledger.with_stock(Product.objects)
+                          .values_list('name', 'stock')) == \
+            {'Computer': 40, 'Chair': 21}
+        assert StockMovement.objects.get(
+            product=computer, kind=StockMovement.ADJUSTMENT).quantity == 7
@@ -0,0 +1,176 @@
+# General
+from datetime import timedelta
+from io import StringIO
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+
+# Opply
+from store import importer, ledger, orders, stock
+from store.hotstock import hot_stock
+from store.models import Product, StockMovement, StockSnapshot
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    return Product.objects.order_by('id')
+
+
+@pytest.fixture
+def no_margin(settings):
+    settings.STOCK_SNAPSHOT_MARGIN = 0
+
+
+def movements(**filters):
+    return list(StockMovement.objects.filter(**filters).order_by('id')
+                                     .values_list('product_id', 'kind',
+                                                  'quantity', 'order_id'))
+
+
+def reconcile(**kwargs):
+    drifted = []
+    for checked, chunk in ledger.reconcile(**kwargs):
+        drifted += chunk
+    return drifted
+
+
+@pytest.mark.django_db
+class TestMovements:
+
+    def test_products(self, products):
+        computer, chair = products
+        assert movements() == [
+            (computer.id, StockMovement.RESTOCK, 33, None),
+            (chair.id, StockMovement.RESTOCK, 21, None),
+        ]
+        chair.quantity_in_stock = 25
+        chair.save()
+        chair.price = 60
+        chair.save(update_fields=['price'])
+        assert movements(product=chair)[1:] == [
+            (chair.id, StockMovement.ADJUSTMENT, 4, None)]
+
+    def test_orders(self, user, products):
+        computer, chair = products
+        placed = orders.place(user, {computer.id: 2, chair.id: 1})
+        results = orders.place_batch(user, [{chair.id: 3}, {computer.id: 1}])
+        sales = movements(kind=StockMovement.SALE)
+        assert sales == [
+            (computer.id, StockMovement.SALE, -2, placed.id),
+            (chair.id, StockMovement.SALE, -1, placed.id),
+            (chair.id, StockMovement.SALE, -3, results[0][1].id),
+            (computer.id, StockMovement.SALE, -1, results[1][1].id),
+        ]
+        assert ledger.balances([computer.id, chair.id]) == \
+            {computer.id: 30, chair.id: 17}
+
+    def test_pending(self, user, products):
+        computer, chair = products
+        confirmed = orders.enqueue(user, {chair.id: 20})
+        orders.enqueue(user, {chair.id: 2})
+        assert not movements(kind=StockMovement.SALE)
+        orders.process_pending()
+        assert movements(kind=StockMovement.SALE) == [
+            (chair.id, StockMovement.SALE, -20, confirmed.id)]
+
+    def test_import(self, products):
+        computer, chair = products
+        list(importer.import_products([
+            (1, {'name': 'Chair', 'price': '50', 'quantity_in_stock': 30}),
+            (2, {'name': 'TV', 'price': '345.11', 'quantity_in_stock': 15}),
+        ]))
+        tv = Product.objects.get(name='TV')
+        list(importer.import_products([(1, {'name': 'TV', 'quantity': 5})],
+                                      stock_delta=True))
+        assert movements()[2:] == [
+            (tv.id, StockMovement.RESTOCK, 15, None),
+            (chair.id, StockMovement.ADJUSTMENT, 9, None),
+            (tv.id, StockMovement.RESTOCK, 5, None),
+        ]
+        assert reconcile() == []
+
+
+@pytest.mark.django_db
+class TestSnapshots:
+
+    def test_snapshot(self, user, products, no_margin):
+        computer, chair = products
+        assert ledger.snapshot() == 2
+        assert dict(StockSnapshot.objects.values_list('product_id',
+                                                      'quantity')) == \
+            {computer.id: 33, chair.id: 21}
+        # Only the products which moved since
+        assert ledger.snapshot() == 0
+        orders.place(user, {chair.id: 1})
+        assert ledger.snapshot(chunk_size=1) == 1
+        assert StockSnapshot.objects.filter(product=chair) \
+                                    .latest('movement_id').quantity == 20
+
+        orders.place(user, {chair.id: 2})
+        assert ledger.balances([chair.id]) == {chair.id: 18}
+
+    def test_margin(self, user, products, settings):
+        computer, chair = products
+        settings.STOCK_SNAPSHOT_MARGIN = 60
+        assert ledger.snapshot() == 0
+        StockMovement.objects.update(
+            created=timezone.now() - timedelta(minutes=2))
+        orders.place(user, {chair.id: 1})
+        assert ledger.snapshot() == 2
+        # The sale is left for the next snapshot
+        assert StockSnapshot.objects.get(product=chair).quantity == 21
+        assert ledger.balances([chair.id]) == {chair.id: 20}
+
+
+@pytest.mark.django_db
+class TestReconcile:
+
+    def test_reconcile(self, user, products, settings, no_margin):
+        computer, chair = products
+        settings.STOCK_SHARDING = True
+        settings.HOT_STOCK = True
+        settings.HOT_STOCK_FLUSH_INTERVAL = None
+        settings.HOT_STOCK_LEASE_UNITS = 10
+        stock.rebalance(chair.id, 3)
+        Product.objects.filter(id=computer.id).update(hot=True)
+        hot_stock.cycle()
+        orders.place(user, {computer.id: 2, chair.id: 4})
+        ledger.snapshot()
+        orders.place(user, {computer.id: 1})
+        # The leased units not sold and the slots count as stock
+        assert reconcile(chunk_size=1) == []
+
+        Product.objects.filter(id=computer.id).update(quantity_in_stock=0)
+        assert reconcile() == [(computer.id, 30, 7)]
+        assert reconcile(adjust=True) == [(computer.id, 30, 7)]
+        assert reconcile() == []
+        assert movements(kind=StockMovement.ADJUSTMENT) == [
+            (computer.id, StockMovement.ADJUSTMENT, -23, None)]
+
+    def test_command(self, products):
+        computer, chair = products
+        Product.objects.filter(id=chair.id).update(quantity_in_stock=20)
+        out = StringIO()
+        call_command('reconcile_stock', '--chunk-size', '1', stdout=out)
+        assert f'Product {chair.id}: 20 in stock, 21 by the ledger' \
+            in out.getvalue()
+        assert 'Checked 2 products, 1 drifted' in out.getvalue()
+
+        call_command('reconcile_stock', '--adjust', stdout=out)
+        out = StringIO()
+        call_command('reconcile_stock', stdout=out)
+        assert 'Checked 2 products, 0 drifted' in out.getvalue()
+
+    def test_snapshot_command(self, products, no_margin):
+        out = StringIO()
+        call_command('snapshot_stock', stdout=out)
+        assert 'Took 2 snapshots' in out.getvalue()
@@ -0,0 +1,215 @@
+# General
+import asyncio
+import json
+import logging
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.http import JsonResponse
+from django.test import AsyncClient
+from django.urls import path
+from rest_framework import status
+
+# Opply
+from store.authentication import tokens
+from store.metrics import Histogram, metrics
+from store.models import Order, Product
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    return Product.objects.order_by('id')
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+
+
+def route(method, path):
+    return next(route for route in metrics.snapshot()['routes']
+                if (route['method'], route['route']) == (method, path))
+
+
+async def task_view(request):
+    await Product.objects.acount()
+    return JsonResponse({'task': id(asyncio.current_task())})
+
+
+urlpatterns = [path('task', task_view)]
+
+
+@pytest.mark.django_db
+class TestPerformanceMiddleware:
+
+    @pytest.fixture(autouse=True)
+    def authenticate(self, request_client, user):
+        request_client.force_authenticate(user)
+
+    def test_sampled(self, settings, request_client, user):
+        settings.PERF_SAMPLE_RATE = 1
+        Order.objects.create(user=user)
+        r = request_client.get('/store/orders')
+        assert r.status_code == status.HTTP_200_OK
+        total, db, serialize = r.headers['Server-Timing'].split(', ')
+        assert total.startswith('total;dur=')
+        # Count the orders, fetch the page and its lines
+        assert db.startswith('db;dur=') and db.endswith(';desc="3 queries"')
+        assert serialize.startswith('serialize;dur=')
+
+        orders = route('GET', 'store/orders')
+        assert orders['statuses'] == {200: 1}
+        assert orders['db_queries']['sum'] == 3
+        assert orders['response_bytes']['sum'] == len(r.content)
+        assert orders['duration_ms']['window']['count'] == 1
+
+    def test_not_sampled(self, settings, request_client, products):
+        settings.PERF_SAMPLE_RATE = 0
+        for product in products:
+            r = request_client.get(f'/store/products/{product.id}')
+        assert r.headers['Server-Timing'].startswith('total;dur=')
+        assert 'db;' not in r.headers['Server-Timing']
+
+        product = route('GET', 'store/products/<int:pk>')
+        assert product['duration_ms']['count'] == 2
+        assert 'db_queries' not in product
+
+    def test_no_server_timing(self, settings, request_client, products):
+        settings.PERF_SERVER_TIMING = False
+        r = request_client.get('/store/products')
+        assert 'Server-Timing' not in r.headers
+        assert route('GET', 'store/products')['duration_ms']['count'] == 1
+
+    def test_unmatched(self, request_client):
+        r = request_client.get('/store/nothing')
+        assert r.status_code == status.HTTP_404_NOT_FOUND
+        assert route('GET', None)['statuses'] == {404: 1}
+
+    def test_slow_query_log(self, settings, request_client, products,
+                            caplog):
+        settings.PERF_SAMPLE_RATE = 1
+        settings.PERF_SLOW_QUERY_MS = 0
+        with caplog.at_level(logging.WARNING, logger='store.middleware'):
+            request_client.get(f'/store/products/{products[0].id}')
+        slow = [record.getMessage() for record in caplog.records
+                if record.name == 'store.middleware']
+        assert slow
+        assert all(message.startswith('Slow query') for message in slow)
+        assert 'GET /store/products/' in slow[0]
+
+    @pytest.mark.urls('store.tests.test_metrics')
+    def test_async(self, settings):
+        settings.PERF_SAMPLE_RATE = 1
+
+        @async_to_sync
+        async def get():
+            return (id(asyncio.current_task()),
+                    await AsyncClient().get('/task'))
+        task, r = get()
+        # Awaited all the way down, rather than handed to a thread
+        # and back to the event loop
+        assert r.json()['task'] == task
+        assert 'desc="1 queries"' in r.headers['Server-Timing']
+        assert route('GET', 'task')['db_queries']['sum'] == 1
+
+
+@pytest.mark.django_db
+class TestMetricsView:
+    api_path = '/store/metrics'
+
+    def test_staff_only(self, request_client, user):
+        request_client.force_authenticate(user)
+        r = request_client.get(self.api_path)
+        assert r.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_prometheus(self, request_client, user, products):
+        user.is_staff = True
+        user.save()
+        request_client.force_authenticate(user)
+        request_client.get('/store/products')
+        r = request_client.get(self.api_path)
+        assert r.status_code == status.HTTP_200_OK
+        assert r.headers['Content-Type'] == 'text/plain; charset=utf-8'
+        lines = r.content.decode().splitlines()
+        labels = 'route="store/products",method="GET"'
+        assert f'opply_request_total{{{labels},status="200"}} 1' in lines
+        assert '# TYPE opply_request_duration_ms histogram' in lines
+        assert (f'opply_request_duration_ms_bucket{{{labels},le="+Inf"}} 1'
+                in lines)
+        assert f'opply_request_duration_ms_count{{{labels}}} 1' in lines
+        assert any(line.startswith(
+            f'opply_request_duration_ms_window{{{labels},quantile="0.95"}}')
+            for line in lines)
+
+    def test_json(self, request_client, user):
+        user.is_staff = True
+        user.save()
+        request_client.force_authenticate(user)
+        r = request_client.get(f'{self.api_path}?format=json')
+        assert r.status_code == status.HTTP_200_OK
+        assert r.json()['window_seconds'] == 60
+        assert set(r.json()['token_cache']) == {
+            'hits', 'local_hits', 'shared_hits', 'misses', 'hit_rate',
+            'size'}
+
+    def test_token_cache(self, request_client, user):
+        user.is_staff = True
+        user.save()
+        r = request_client.post('/auth/login/',
+                                content_type='application/json',
+                                data=json.dumps({'username': 'test_user',
+                                                 'password': 'test_password'}))
+        request_client.credentials(
+            HTTP_AUTHORIZATION=f'Token {r.json()["token"]}')
+        tokens.reset()
+        # A miss, then hits in the process
+        for _ in range(3):
+            r = request_client.get(self.api_path)
+            assert r.status_code == status.HTTP_200_OK
+        lines = r.content.decode().splitlines()
+        assert 'opply_token_cache_hits_total{level="local"} 2' in lines
+        assert 'opply_token_cache_hits_total{level="shared"} 0' in lines
+        assert 'opply_token_cache_misses_total 1' in lines
+        assert 'opply_token_cache_size 1' in lines
+
+
+class TestHistogram:
+
+    def test_buckets(self):
+        histogram = Histogram((1, 10, 100))
+        for value in (0.5, 1, 5, 50, 500):
+            histogram.observe(value, now=0)
+        snapshot = histogram.snapshot(now=0)
+        assert snapshot['counts'] == [2, 1, 1, 1]
+        assert snapshot['sum'] == 556.5
+        assert snapshot['window']['counts'] == [2, 1, 1, 1]
+
+    def test_quantile(self):
+        histogram = Histogram((10, 20))
+        # Half of the observations up to 10, the rest from 10 to 20
+        assert histogram.quantile([5, 5, 0], 0.5) == 10
+        assert histogram.quantile([5, 5, 0], 0.75) == 15
+        assert histogram.quantile([0, 0, 1], 0.99) == 20
+        assert histogram.quantile([0, 0, 0], 0.5) is None
+
+    def test_rolling_window(self, settings):
+        settings.PERF_WINDOW = 60
+        settings.PERF_WINDOW_SLOTS = 6
+        histogram = Histogram((10, ))
+        histogram.observe(1, now=5)
+        histogram.observe(1, now=35)
+        assert histogram.snapshot(now=59)['window']['count'] == 2
+        # The first slot, 0 to 10s, has left the window
+        assert histogram.snapshot(now=75)['window']['count'] == 1
+        histogram.observe(1, now=125)
+        snapshot = histogram.snapshot(now=125)
+        assert snapshot['window']['count'] == 1
+        assert snapshot['count'] == 3
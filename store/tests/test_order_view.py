@@ -0,0 +1,311 @@
+# General
+import json
+import time
+from base64 import urlsafe_b64encode
+from io import StringIO
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+# Opply
+from store import orders
+from store.models import Product, Order, OrderProducts
+
+
+@pytest.fixture
+def user():
+    user = User.objects.create_user(username='test_user',
+                                    password='test_password')
+    user.save()
+    return user
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    Product(name='TV', price=345.11, quantity_in_stock=1).save()
+    return Product.objects.order_by('id')
+
+
+@pytest.mark.django_db
+class TestOrderView:
+    api_path = '/store/orders'
+
+    @pytest.fixture(autouse=True)
+    def authenticate(self, request_client, user):
+        request_client.force_authenticate(user)
+
+    def test_create(self, request_client, products):
+        computer, chair, tv = products
+        r = request_client.post(self.api_path, format='json',
+                                data={'products': [computer.id, chair.id,
+                                                   computer.id]})
+        assert r.status_code == status.HTTP_201_CREATED
+        assert r.json()['products'] == [computer.id, computer.id, chair.id]
+
+        computer.refresh_from_db()
+        chair.refresh_from_db()
+        assert computer.quantity_in_stock == 31
+        assert chair.quantity_in_stock == 20
+        assert OrderProducts.objects.count() == 2
+
+    def test_create_lines(self, request_client, products):
+        computer, chair, tv = products
+        r = request_client.post(self.api_path, format='json',
+                                data={'products': [
+                                    {'product': computer.id, 'quantity': 2},
+                                    {'product': chair.id},
+                                    computer.id,
+                                ]})
+        assert r.status_code == status.HTTP_201_CREATED
+        assert r.json()['products'] == [computer.id] * 3 + [chair.id]
+
+        lines = OrderProducts.objects.order_by('id')
+        assert [(line.product_id, line.quantity) for line in lines] == \
+            [(computer.id, 3), (chair.id, 1)]
+        computer.refresh_from_db()
+        assert computer.quantity_in_stock == 30
+
+    def test_out_of_stock_rolls_back(self, request_client, products):
+        computer, chair, tv = products
+        r = request_client.post(self.api_path, format='json',
+                                data={'products': [computer.id, tv.id,
+                                                   tv.id]})
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
+        assert r.json()['detail'] == \
+            'Sorry the product you have requested is out of stock.'
+
+        assert not Order.objects.exists()
+        assert not OrderProducts.objects.exists()
+        computer.refresh_from_db()
+        tv.refresh_from_db()
+        assert computer.quantity_in_stock == 33
+        assert tv.quantity_in_stock == 1
+
+    @pytest.mark.parametrize('data', [[0], ['a'], [True], 1, {'product': 1},
+                                      [{'quantity': 1}],
+                                      [{'product': 1, 'quantity': 0}]])
+    def test_invalid_product(self, request_client, products, data):
+        r = request_client.post(self.api_path, format='json',
+                                data={'products': data})
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Order.objects.exists()
+
+    def test_create_query_count(self, request_client, products):
+        """ The number of queries to place an order mustn't
+            depend on the number of lines in it.
+        """
+        computer, chair, tv = products
+
+        def place(product_ids):
+            with CaptureQueriesContext(connection) as ctx:
+                r = request_client.post(self.api_path, format='json',
+                                        data={'products': product_ids})
+            assert r.status_code == status.HTTP_201_CREATED
+            return len(ctx.captured_queries)
+
+        small = place([computer.id])
+        large = place([computer.id, chair.id] * 10)
+        assert small == large
+        # savepoint, decrement stock, read prices, insert order,
+        # insert lines, record stock movements, release savepoint
+        assert large == 7
+
+    @pytest.fixture
+    def orders(self, user, products):
+        computer, chair, tv = products
+        orders = []
+        for _ in range(20):
+            order = Order.objects.create(user=user)
+            OrderProducts.objects.bulk_create([
+                OrderProducts(order=order, product=computer, quantity=2),
+                OrderProducts(order=order, product=chair),
+            ])
+            orders.append(order)
+        return orders
+
+    def test_list(self, request_client, products, orders):
+        computer, chair, tv = products
+        r = request_client.get(self.api_path)
+        assert r.status_code == status.HTTP_200_OK
+        assert r.json()['count'] == 20
+        assert [order['products'] for order in r.json()['results']] == \
+            [[computer.id, computer.id, chair.id]] * 2
+
+    @pytest.mark.parametrize('page_size', [2, 20])
+    def test_list_query_count(self, request_client, orders, page_size,
+                              django_assert_num_queries):
+        """ Count the orders, fetch a page of them and fetch all
+            of the page's lines, whatever the size of the page.
+        """
+        with django_assert_num_queries(3):
+            r = request_client.get(f'{self.api_path}?page_size={page_size}')
+        assert len(r.json()['results']) == page_size
+
+    def test_max_page_size(self, request_client, orders):
+        r = request_client.get(f'{self.api_path}?page_size=1000')
+        assert len(r.json()['results']) == 20
+
+    def test_keyset_pagination(self, request_client, orders,
+                               django_assert_num_queries):
+        expected = [order.id for order in reversed(orders)]
+
+        seen = []
+        url = f'{self.api_path}?pagination=cursor&page_size=3'
+        while url:
+            # No count, just the page and its lines
+            with django_assert_num_queries(2):
+                r = request_client.get(url)
+            assert r.status_code == status.HTTP_200_OK
+            assert 'count' not in r.json()
+            seen.extend(order['id'] for order in r.json()['results'])
+            last, url = url, r.json()['next']
+        assert seen == expected
+
+        seen = []
+        url = last
+        while url:
+            r = request_client.get(url)
+            seen[:0] = [order['id'] for order in r.json()['results']]
+            url = r.json()['previous']
+        assert seen == expected
+
+    def test_keyset_pagination_same_datetime(self, request_client, user,
+                                             orders):
+        """ Orders placed at the same instant are told apart
+            by their ids.
+        """
+        Order.objects.update(datetime=orders[0].datetime)
+        seen = []
+        url = f'{self.api_path}?pagination=cursor&page_size=7'
+        while url:
+            r = request_client.get(url)
+            seen.extend(order['id'] for order in r.json()['results'])
+            url = r.json()['next']
+        assert seen == [order.id for order in reversed(orders)]
+
+    @pytest.mark.parametrize('data', [
+        'nonsense',
+        {'p': ['abc', 1], 'r': False},
+        {'p': ['2022-11-17T01:20:45Z', 'abc'], 'r': False},
+        {'p': [None, 1], 'r': True},
+        {'p': 'ab', 'r': False},
+    ])
+    def test_keyset_invalid_cursor(self, request_client, orders, data):
+        cursor = data if isinstance(data, str) else urlsafe_b64encode(
+            json.dumps(data).encode()).decode()
+        r = request_client.get(f'{self.api_path}?cursor={cursor}')
+        assert r.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_retrieve(self, request_client, products, orders,
+                      django_assert_num_queries):
+        computer, chair, tv = products
+        with django_assert_num_queries(2):
+            r = request_client.get(f'{self.api_path}/{orders[0].id}')
+        assert r.status_code == status.HTTP_200_OK
+        assert r.json()['products'] == [computer.id, computer.id, chair.id]
+
+
+@pytest.mark.django_db
+class TestAsyncOrderView:
+    api_path = '/store/orders'
+    headers = {'HTTP_PREFER': 'respond-async'}
+
+    @pytest.fixture(autouse=True)
+    def authenticate(self, request_client, user):
+        request_client.force_authenticate(user)
+
+    def place(self, request_client, product_ids):
+        return request_client.post(self.api_path, format='json',
+                                   data={'products': product_ids},
+                                   **self.headers)
+
+    def test_accepted(self, request_client, products):
+        computer, chair, tv = products
+        r = self.place(request_client, [computer.id, computer.id, chair.id])
+        assert r.status_code == status.HTTP_202_ACCEPTED
+        order = Order.objects.get()
+        assert r.json() == {'id': order.id, 'status': 'pending'}
+        assert r.headers['Location'] == f'{self.api_path}/{order.id}/status'
+
+        # Nothing is reserved until it's processed
+        computer.refresh_from_db()
+        assert computer.quantity_in_stock == 33
+
+        assert orders.process_pending() == 1
+        order.refresh_from_db()
+        assert order.status == Order.CONFIRMED
+        computer.refresh_from_db()
+        chair.refresh_from_db()
+        assert computer.quantity_in_stock == 31
+        assert chair.quantity_in_stock == 20
+
+        r = request_client.get(r.headers['Location'])
+        assert r.json() == {'id': order.id, 'status': 'confirmed'}
+
+    def test_rejected(self, request_client, products):
+        computer, chair, tv = products
+        first = self.place(request_client, [tv.id]).json()['id']
+        second = self.place(request_client, [computer.id, tv.id]).json()['id']
+        third = self.place(request_client, [computer.id]).json()['id']
+
+        assert orders.process_pending(batch_size=2) == 2
+        assert orders.process_pending(batch_size=2) == 1
+        assert orders.process_pending(batch_size=2) == 0
+
+        statuses = dict(Order.objects.values_list('id', 'status'))
+        assert statuses == {first: Order.CONFIRMED, second: Order.REJECTED,
+                            third: Order.CONFIRMED}
+        # Only the confirmed orders took any stock
+        computer.refresh_from_db()
+        tv.refresh_from_db()
+        assert computer.quantity_in_stock == 32
+        assert tv.quantity_in_stock == 0
+
+    def test_invalid_product(self, request_client, products):
+        r = self.place(request_client, [products[0].id, 0])
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
+        r = self.place(request_client, [{'product': 999999}])
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Order.objects.exists()
+
+    def test_status_of_other_users_order(self, request_client, products):
+        other = User.objects.create_user(username='other')
+        order = Order.objects.create(user=other, status=Order.PENDING)
+        r = request_client.get(f'{self.api_path}/{order.id}/status')
+        assert r.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_command(self, request_client, products):
+        computer, chair, tv = products
+        self.place(request_client, [computer.id])
+        self.place(request_client, [tv.id, tv.id])
+        out = StringIO()
+        call_command('process_orders', '--once', stdout=out)
+        assert out.getvalue() == 'Processed 2 orders\n'
+        assert sorted(Order.objects.values_list('status', flat=True)) == \
+            [Order.CONFIRMED, Order.REJECTED]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_order_workers(request_client, user, products):
+    """ The worker pool is woken on commit and confirms the order
+        in the background.
+    """
+    request_client.force_authenticate(user)
+    r = request_client.post('/store/orders', format='json',
+                            data={'products': [products[0].id]},
+                            HTTP_PREFER='respond-async')
+    assert r.status_code == status.HTTP_202_ACCEPTED
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        order_status = request_client.get(r.headers['Location']).json()
+        if order_status['status'] != Order.PENDING:
+            break
+        time.sleep(0.05)
+    assert order_status['status'] == Order.CONFIRMED
+    assert Product.objects.get(id=products[0].id).quantity_in_stock == 32
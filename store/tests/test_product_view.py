@@ -1,6 +1,7 @@
 # General
 import pytest
 import json
+from base64 import urlsafe_b64encode
 from rest_framework import status
 from django.contrib.auth.models import User
 
@@ -104,3 +105,111 @@ class TestProductView:
             ]
         }
         assert r.json() == expected_json
+
+    def test_keyset_pagination(self, request_client, user, products):
+        request_client.force_authenticate(user)
+
+        r = request_client.get(f'{self.api_path}?pagination=cursor',
+                               content_type='application/json')
+        assert r.status_code == status.HTTP_200_OK
+        assert r.json()['previous'] is None
+        assert [p['id'] for p in r.json()['results']] == \
+            [products[0].id, products[1].id]
+
+        r = request_client.get(r.json()['next'],
+                               content_type='application/json')
+        assert r.json()['next'] is None
+        assert [p['id'] for p in r.json()['results']] == [products[2].id]
+        assert r.json()['results'][0] == {
+            "id": products[2].id,
+            "name": "TV",
+            "price": '345.11',
+            "quantity_in_stock": 15
+        }
+
+
+@pytest.mark.django_db
+class TestProductFilters:
+    api_path = '/store/products'
+
+    @pytest.fixture(autouse=True)
+    def catalogue(self, request_client, user):
+        request_client.force_authenticate(user)
+        for name, price, quantity in (('Chair', 56, 21), ('Armchair', 310, 0),
+                                      ('Chaise longue', 745.50, 2),
+                                      ('Desk', 120, 4), ('Lamp', 19.99, 0)):
+            Product(name=name, price=price, quantity_in_stock=quantity).save()
+
+    def names(self, request_client, query):
+        r = request_client.get(f'{self.api_path}?page_size=100&{query}')
+        assert r.status_code == status.HTTP_200_OK, r.json()
+        return [product['name'] for product in r.json()['results']]
+
+    @pytest.mark.parametrize('query, expected', [
+        ('', ['Chair', 'Armchair', 'Chaise longue', 'Desk', 'Lamp']),
+        ('name=cha', ['Chair', 'Chaise longue']),
+        ('search=CHAIR', ['Chair', 'Armchair']),
+        ('search=air&name=ch', ['Chair']),
+        ('min_price=100', ['Armchair', 'Chaise longue', 'Desk']),
+        ('min_price=56&max_price=310', ['Chair', 'Armchair', 'Desk']),
+        ('max_price=19.99', ['Lamp']),
+        ('in_stock=true', ['Chair', 'Chaise longue', 'Desk']),
+        ('in_stock=false', ['Chair', 'Armchair', 'Chaise longue', 'Desk',
+                            'Lamp']),
+        ('search=chair&in_stock=1&max_price=100', ['Chair']),
+        ('name=', ['Chair', 'Armchair', 'Chaise longue', 'Desk', 'Lamp']),
+        ('name=sofa', []),
+    ])
+    def test_filters(self, request_client, query, expected):
+        assert self.names(request_client, query) == expected
+
+    def test_ids(self, request_client):
+        desk, lamp, chair = (Product.objects.get(name=name).id
+                             for name in ('Desk', 'Lamp', 'Chair'))
+        assert self.names(request_client, f'ids={lamp},{desk},{chair},999') \
+            == ['Chair', 'Desk', 'Lamp']
+        assert self.names(request_client, f'ids={lamp},{desk}&in_stock=on') \
+            == ['Desk']
+
+    @pytest.mark.parametrize('query, field', [
+        ('ids=1,a', 'ids'),
+        (f'ids={",".join(str(i) for i in range(1001))}', 'ids'),
+        ('min_price=-1', 'min_price'),
+        ('min_price=cheap', 'min_price'),
+        ('min_price=20&max_price=10', 'max_price'),
+        ('in_stock=maybe', 'in_stock'),
+    ])
+    def test_invalid(self, request_client, query, field):
+        r = request_client.get(f'{self.api_path}?{query}')
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
+        assert field in r.json()
+
+    def test_cursor(self, request_client):
+        r = request_client.get(f'{self.api_path}?pagination=cursor'
+                               f'&page_size=2&search=ch')
+        assert [p['name'] for p in r.json()['results']] == \
+            ['Chair', 'Armchair']
+        r = request_client.get(r.json()['next'])
+        assert [p['name'] for p in r.json()['results']] == ['Chaise longue']
+
+    @pytest.mark.parametrize('fast', [False, True])
+    @pytest.mark.parametrize('position', [['abc'], ['1.5'], [[1]]])
+    def test_tampered_cursor(self, request_client, settings, fast,
+                             position):
+        settings.FAST_SERIALIZATION = fast
+        cursor = urlsafe_b64encode(json.dumps(
+            {'p': position, 'r': False}).encode()).decode()
+        r = request_client.get(f'{self.api_path}?cursor={cursor}')
+        assert r.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_in_stock_not_cached(self, request_client):
+        assert 'Desk' in self.names(request_client, 'in_stock=true')
+        Product.objects.filter(name='Desk').update(quantity_in_stock=0)
+        assert 'Desk' not in self.names(request_client, 'in_stock=true')
+
+    def test_sharded_in_stock(self, request_client, settings):
+        settings.STOCK_SHARDING = True
+        lamp = Product.objects.get(name='Lamp')
+        lamp.stock_shards.create(slot=0, quantity=3)
+        assert self.names(request_client, 'in_stock=true&search=la') == \
+            ['Lamp']
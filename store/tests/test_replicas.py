@@ -0,0 +1,227 @@
+# General
+import json
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import DatabaseError, connections, transaction
+from django.test import AsyncRequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+# Opply
+from store import async_views, replicas
+from store.models import Order, Product
+from store.replicas import ReplicaRouter
+
+# The replica is another alias of the test database, so tests commit
+# what they write, for it to be seen from its connection.
+pytestmark = pytest.mark.django_db(transaction=True,
+                                   databases=['default', 'replica1'])
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    return Product.objects.order_by('id')
+
+
+@pytest.fixture(autouse=True)
+def replica(settings):
+    settings.DATABASE_REPLICAS = ['replica1']
+    settings.REPLICA_CHECK_INTERVAL = 60
+
+
+class Queries:
+    """ The queries run on the primary and on the replica.
+    """
+
+    def __enter__(self):
+        self.primary = CaptureQueriesContext(connections['default'])
+        self.replica = CaptureQueriesContext(connections['replica1'])
+        self.primary.__enter__()
+        self.replica.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self.primary.__exit__(*args)
+        self.replica.__exit__(*args)
+
+
+class TestRouter:
+
+    def test_route(self, user):
+        router = ReplicaRouter()
+        assert router.db_for_read(Product) is None
+        token = replicas.start_reading(user)
+        try:
+            assert router.db_for_read(Product) == 'replica1'
+            assert router.db_for_write(Product) == 'default'
+            with transaction.atomic():
+                # Reads in a transaction on the primary stay there
+                assert router.db_for_read(Product) is None
+                assert Product.objects.select_for_update().db == 'default'
+            with replicas.primary():
+                assert router.db_for_read(Product) is None
+        finally:
+            replicas.stop_reading(token)
+        assert router.db_for_read(Product) is None
+
+    def test_no_replicas(self, user, settings):
+        settings.DATABASE_REPLICAS = []
+        token = replicas.start_reading(user)
+        assert replicas.current() is None
+        replicas.stop_reading(token)
+
+    def test_lag(self):
+        assert replicas.lag('replica1') == 0
+
+
+class TestReplicaReads:
+
+    @pytest.fixture(autouse=True)
+    def authenticate(self, request_client, user):
+        request_client.force_authenticate(user)
+
+    def test_orders(self, request_client, user, products):
+        computer, chair = products
+        with Queries() as queries:
+            r = request_client.post('/store/orders', format='json',
+                                    data={'products': [computer.id]})
+        assert r.status_code == status.HTTP_201_CREATED
+        assert queries.primary.captured_queries
+        assert not queries.replica.captured_queries
+
+        # Pinned to the primary, having just placed an order
+        with Queries() as queries:
+            r = request_client.get('/store/orders')
+        assert [order['id'] for order in r.json()['results']] == \
+            [r.json()['results'][0]['id']]
+        assert queries.primary.captured_queries
+        assert not queries.replica.captured_queries
+
+        caches['default'].delete(replicas.pin_key(user.id))
+        order = Order.objects.get()
+        for path in ('/store/orders', f'/store/orders/{order.id}'):
+            with Queries() as queries:
+                r = request_client.get(path)
+            assert r.status_code == status.HTTP_200_OK
+            assert not queries.primary.captured_queries
+            assert queries.replica.captured_queries
+
+    def test_products(self, request_client, products):
+        with Queries() as queries:
+            r = request_client.get('/store/products?in_stock=true')
+        assert r.json()['count'] == 2
+        assert not queries.primary.captured_queries
+        assert queries.replica.captured_queries
+
+    def test_stock_from_primary(self, request_client, products):
+        """ The stock filled in to the catalogue pages is read from
+            the primary, see availability.
+        """
+        with Queries() as queries:
+            r = request_client.get('/store/products')
+        assert r.status_code == status.HTTP_200_OK
+        assert ['store_product' in query['sql']
+                for query in queries.primary.captured_queries] == [True]
+        assert queries.replica.captured_queries
+
+    def test_catalogue_not_cached_behind(self, request_client, products):
+        request_client.get('/store/products')
+        # Just after the catalogue changed, the page is read again
+        with Queries() as queries:
+            request_client.get('/store/products')
+        assert queries.replica.captured_queries
+
+    def test_writes_on_primary(self, request_client, user, products):
+        computer, chair = products
+        caches['default'].delete(replicas.pin_key(user.id))
+        with Queries() as queries:
+            r = request_client.post('/store/orders/batch', format='json',
+                                    data={'orders': [
+                                        {'products': [computer.id]},
+                                        {'products': [chair.id]}]})
+        assert r.status_code == status.HTTP_201_CREATED
+        assert not queries.replica.captured_queries
+        assert replicas.pinned(user)
+
+
+class TestAsyncReads:
+
+    @pytest.fixture
+    def token(self, user, request_client):
+        r = request_client.post('/auth/login/',
+                                content_type='application/json',
+                                data=json.dumps({'username': 'test_user',
+                                                 'password': 'test_password'}))
+        return r.json()['token']
+
+    def call(self, token, view, path, *args):
+        request = AsyncRequestFactory().get(
+            path, authorization=f'Token {token}')
+        return async_to_sync(view)(request, *args)
+
+    def test_reads(self, token, user, products):
+        order = Order.objects.create(user=user)
+        for view, path, args in [
+                (async_views.product_list, '/store/products', ()),
+                (async_views.product_detail,
+                 f'/store/products/{products[0].id}', (products[0].id, )),
+                (async_views.order_list, '/store/orders', ()),
+                (async_views.order_detail, f'/store/orders/{order.id}',
+                 (order.id, ))]:
+            with Queries() as queries:
+                r = self.call(token, view, path, *args)
+            assert r.status_code == status.HTTP_200_OK
+            assert any('"store_' in query['sql']
+                       for query in queries.replica.captured_queries)
+            # Only the token, before it's cached
+            assert all('"store_' not in query['sql']
+                       for query in queries.primary.captured_queries)
+        assert replicas.current() is None
+
+    def test_pinned(self, token, user, products):
+        replicas.pin(user)
+        with Queries() as queries:
+            r = self.call(token, async_views.product_list, '/store/products')
+        assert r.status_code == status.HTTP_200_OK
+        assert queries.primary.captured_queries
+        assert not queries.replica.captured_queries
+
+
+class TestHealth:
+
+    def test_down(self, user, monkeypatch, settings, caplog):
+        def down(alias):
+            raise DatabaseError('connection refused')
+        monkeypatch.setattr(replicas, 'lag', down)
+        assert replicas.choose() is None
+        assert 'Replica replica1 is down' in caplog.text
+
+        # Not checked again until REPLICA_CHECK_INTERVAL is up
+        monkeypatch.setattr(replicas, 'lag', lambda alias: 0)
+        assert replicas.choose() is None
+        settings.REPLICA_CHECK_INTERVAL = 0
+        assert replicas.choose() == 'replica1'
+
+    def test_behind(self, user, monkeypatch, settings, request_client,
+                    products):
+        settings.REPLICA_CHECK_INTERVAL = 0
+        monkeypatch.setattr(replicas, 'lag', lambda alias: 6)
+        request_client.force_authenticate(user)
+        with Queries() as queries:
+            r = request_client.get('/store/orders')
+        assert r.status_code == status.HTTP_200_OK
+        assert queries.primary.captured_queries
+        assert not queries.replica.captured_queries
+
+        monkeypatch.setattr(replicas, 'lag', lambda alias: 4)
+        assert replicas.choose() == 'replica1'
@@ -0,0 +1,178 @@
+# General
+import json
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+import pytest
+from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+# Opply
+from store import catalogue, orders, renderers
+from store.models import Product, Order
+from store.renderers import FastJSONRenderer
+from store.rows import compile_row, datetime_to_string, decimal_to_string
+from store.serializers import (ProductSerializer, ProductRowSerializer,
+                               OrderSerializer, OrderRowSerializer)
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def products():
+    for name, price in (('Computer', '2234.56'), ('Chair', '56'),
+                        ('TV', '0.1'), ('Lamp   "é"', '0'),
+                        ('Desk', '123456789012345678.99')):
+        Product(name=name, price=Decimal(price), quantity_in_stock=33).save()
+    return Product.objects.order_by('id')
+
+
+def test_compile_row():
+    to_dict = compile_row(['id', 'name'], {'name': str.upper}, [1, 0])
+    assert to_dict(('chair', 2)) == {'id': 2, 'name': 'CHAIR'}
+    assert list(to_dict(('chair', 2))) == ['id', 'name']
+    assert compile_row(['id'], {})((3, )) == {'id': 3}
+
+
+@pytest.mark.parametrize('value', ['2234.56', '56', '0.1', '0', '1.005',
+                                   '-3.999', '123456789012345678.99'])
+def test_decimal_to_string(value):
+    field = ProductSerializer().fields['price']
+    assert decimal_to_string(field)(Decimal(value)) == \
+        field.to_representation(Decimal(value))
+
+
+@pytest.mark.parametrize('zone', ['UTC', 'Europe/London', 'Asia/Kolkata'])
+@pytest.mark.parametrize('value', [
+    datetime(2022, 11, 16, 18, 57, 5, 944491, tzinfo=dt_timezone.utc),
+    datetime(2022, 7, 1, tzinfo=dt_timezone.utc),
+    datetime(2022, 7, 1, 12, 30),
+    None,
+])
+def test_datetime_to_string(zone, value):
+    field = OrderSerializer().fields['datetime']
+    with timezone.override(zone):
+        assert datetime_to_string(field)(value) == \
+            field.to_representation(value)
+
+
+@pytest.mark.parametrize('data', [
+    {'id': 1, 'name': 'Lamp    "é" \x00\n', 'price': '2.00',
+     'nested': [None, True, False, -1, {'a': []}]},
+    [],
+    {1: 'int keys'},
+    {'big': 2 ** 70},
+    {'decimal': Decimal('1.50')},
+])
+def test_fast_renderer(data):
+    assert FastJSONRenderer().render(data) == JSONRenderer().render(data)
+
+
+def test_fast_renderer_indent():
+    data = {'id': 1, 'products': [1, 2]}
+    assert FastJSONRenderer().render(data, 'application/json; indent=2') \
+        == JSONRenderer().render(data, 'application/json; indent=2')
+
+
+def test_fast_renderer_without_orjson(monkeypatch, settings, caplog):
+    settings.FAST_SERIALIZATION = True
+    monkeypatch.setattr(renderers, 'orjson', None)
+    monkeypatch.setattr(FastJSONRenderer, 'warned', False)
+    data = {'id': 1}
+    for _ in range(2):
+        assert FastJSONRenderer().render(data) == JSONRenderer().render(data)
+    assert [record.message for record in caplog.records] == [
+        'FAST_SERIALIZATION is on but orjson is not installed, rendering '
+        'with JSONRenderer']
+
+
+@pytest.mark.django_db
+class TestRowSerializers:
+
+    def test_products(self, products):
+        queryset = Product.objects.order_by('id').with_stock()
+        rows = ProductRowSerializer()
+        assert rows.many(rows.values(queryset)) == \
+            ProductSerializer(queryset, many=True).data
+
+    def test_orders(self, user, products, django_assert_num_queries):
+        computer, chair = products[:2]
+        orders.place(user, {computer.id: 2, chair.id: 1})
+        orders.place(user, {chair.id: 3})
+        queryset = Order.objects.filter(user=user).with_product_ids() \
+                                .order_by('-id')
+        expected = [{'id': order.id, 'user': user.id,
+                     'datetime': order.datetime.isoformat()
+                                               .replace('+00:00', 'Z'),
+                     'status': order.status,
+                     'products': order.product_ids,
+                     'total': f'{order.total:.2f}',
+                     'item_count': order.item_count} for order in queryset]
+
+        rows = OrderRowSerializer()
+        # The orders, then their lines
+        with django_assert_num_queries(2):
+            assert rows.many(rows.values(queryset)) == expected
+        assert rows.many([]) == []
+
+
+@pytest.mark.django_db
+class TestFastViews:
+    """ The responses are the same, byte for byte, with and
+        without fast serialization.
+    """
+
+    @pytest.fixture(autouse=True)
+    def authenticate(self, request_client, user):
+        request_client.force_authenticate(user)
+
+    def compare(self, request_client, settings, path):
+        responses = []
+        for fast in (False, True):
+            settings.FAST_SERIALIZATION = fast
+            # Not from the other's cached catalogue pages
+            catalogue.bump()
+            responses.append(request_client.get(path))
+        slow, fast = responses
+        assert fast.status_code == slow.status_code
+        assert fast.content == slow.content
+        return json.loads(fast.content)
+
+    @pytest.mark.parametrize('path', [
+        '/store/products?page_size=10',
+        '/store/products?page=2&page_size=2',
+        '/store/products?pagination=cursor&page_size=2',
+        '/store/products/999',
+    ])
+    def test_products(self, request_client, settings, products, path):
+        self.compare(request_client, settings, path)
+
+    def test_product(self, request_client, settings, products):
+        data = self.compare(request_client, settings,
+                            f'/store/products/{products[3].id}')
+        assert data['name'] == 'Lamp   "é"'
+        assert data['price'] == '0.00'
+
+    def test_orders(self, request_client, settings, user, products):
+        computer, chair = products[:2]
+        order = orders.place(user, {computer.id: 2, chair.id: 1})
+        for _ in range(3):
+            orders.place(user, {chair.id: 1})
+
+        data = self.compare(request_client, settings,
+                            '/store/orders?page_size=10')
+        assert data['results'][-1]['products'] == \
+            [computer.id, computer.id, chair.id]
+        data = self.compare(request_client, settings,
+                            '/store/orders?pagination=cursor&page_size=3')
+        self.compare(request_client, settings, data['next'])
+        self.compare(request_client, settings, f'/store/orders/{order.id}')
+
+        # Not someone else's
+        other = User.objects.create_user(username='other')
+        request_client.force_authenticate(other)
+        self.compare(request_client, settings, f'/store/orders/{order.id}')
@@ -0,0 +1,163 @@
+# General
+from datetime import timedelta
+from io import StringIO
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework import status
+
+# Opply
+from store import orders, sales
+from store.models import Product, Order, OrderProducts, ProductSales
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    Product(name='TV', price=345.11, quantity_in_stock=3).save()
+    return Product.objects.order_by('id')
+
+
+def sold():
+    return {(product_id, day): units for product_id, day, units in
+            ProductSales.objects.values_list('product_id', 'day', 'units')}
+
+
+@pytest.mark.django_db
+class TestSales:
+
+    @pytest.fixture(autouse=True)
+    def no_margin(self, settings):
+        settings.SALES_CATCH_UP_MARGIN = 0
+
+    def test_place(self, user, products, django_assert_num_queries):
+        computer, chair, tv = products
+        today = timezone.localdate()
+        assert sales.catch_up() == 0
+        orders.place(user, {computer.id: 2, chair.id: 1})
+        orders.place_batch(user, [{computer.id: 1}, {tv.id: 1}])
+        # Counted by the catch-up, rather than as they're placed
+        assert sold() == {}
+        # The savepoint, its state, locked, the lines, the sales,
+        # the state and releasing the savepoint
+        with django_assert_num_queries(7):
+            assert sales.catch_up() == 4
+        assert sold() == {(computer.id, today): 3, (chair.id, today): 1,
+                          (tv.id, today): 1}
+        assert sales.catch_up() == 0
+        assert sales.counted() == OrderProducts.objects.latest('id').id
+
+    def test_batches(self, user, products):
+        computer, chair, tv = products
+        now = timezone.now()
+        for days, status in ((0, Order.CONFIRMED), (1, Order.CONFIRMED),
+                             (1, Order.REJECTED), (1, Order.CONFIRMED)):
+            order = Order.objects.create(user=user, status=status,
+                                         datetime=now - timedelta(days=days))
+            OrderProducts.objects.create(order=order, product=computer,
+                                         quantity=2)
+
+        assert sales.catch_up(batch_size=3) == 3
+        assert sales.catch_up(batch_size=3) == 1
+        assert sales.catch_up(batch_size=3) == 0
+        today = timezone.localdate(now)
+        yesterday = timezone.localdate(now - timedelta(days=1))
+        assert sold() == {(computer.id, today): 2,
+                          (computer.id, yesterday): 4}
+
+    def test_pending(self, user, products):
+        computer, chair, tv = products
+        today = timezone.localdate()
+        orders.enqueue(user, {tv.id: 2})
+        orders.enqueue(user, {tv.id: 2, chair.id: 1})
+        orders.place(user, {computer.id: 1})
+        # Not past the pending orders until they're done with
+        assert sales.catch_up() == 0
+        orders.process_pending()
+        assert sales.catch_up() == 4
+        # Only the confirmed orders
+        assert sold() == {(tv.id, today): 2, (computer.id, today): 1}
+
+    def test_margin(self, user, products, settings):
+        computer, chair, tv = products
+        settings.SALES_CATCH_UP_MARGIN = 60
+        order = orders.place(user, {chair.id: 3})
+        # Its line may yet be committed after a later one
+        assert sales.catch_up() == 0
+        Order.objects.filter(id=order.id).update(
+            datetime=timezone.now() - timedelta(minutes=2))
+        assert sales.catch_up() == 1
+        assert sold() == {(chair.id, timezone.localdate()): 3}
+
+    def test_reports(self, user, products, django_assert_num_queries):
+        computer, chair, tv = products
+        today = timezone.localdate()
+        ProductSales.objects.bulk_create([
+            ProductSales(product=computer, day=today, units=7),
+            ProductSales(product=chair, day=today, units=3),
+            ProductSales(product=tv, day=today - timedelta(days=1), units=7),
+            ProductSales(product=chair, day=today - timedelta(days=7),
+                         units=100),
+        ])
+
+        with django_assert_num_queries(1):
+            top = sales.top_sellers(days=7)
+        assert top == [
+            {'id': computer.id, 'name': 'Computer', 'units': 7},
+            {'id': tv.id, 'name': 'TV', 'units': 7},
+            {'id': chair.id, 'name': 'Chair', 'units': 3},
+        ]
+
+        with django_assert_num_queries(2):
+            low = sales.low_stock(threshold=21, days=7)
+        assert low == [
+            {'id': tv.id, 'name': 'TV', 'quantity_in_stock': 3,
+             'per_day': 1.0, 'days_left': 3.0},
+            {'id': chair.id, 'name': 'Chair', 'quantity_in_stock': 21,
+             'per_day': 3 / 7, 'days_left': 49.0},
+        ]
+
+    def test_command(self, user, products):
+        orders.place(user, {products[2].id: 1})
+        out = StringIO()
+        call_command('catch_up_sales', '--once', stdout=out)
+        assert 'Counted 1 lines' in out.getvalue()
+        call_command('stock_report', stdout=out)
+        assert 'TV' in out.getvalue()
+        assert '1 sold' in out.getvalue()
+
+
+@pytest.mark.django_db
+class TestStockReportView:
+    api_path = '/store/reports/stock'
+
+    def test_staff_only(self, request_client, settings, user, products):
+        settings.SALES_CATCH_UP_MARGIN = 0
+        request_client.force_authenticate(user)
+        r = request_client.get(self.api_path)
+        assert r.status_code == status.HTTP_403_FORBIDDEN
+
+        user.is_staff = True
+        user.save()
+        orders.place(user, {products[2].id: 2})
+        sales.catch_up()
+        r = request_client.get(f'{self.api_path}?threshold=1')
+        assert r.status_code == status.HTTP_200_OK
+        assert r.json()['low_stock'][0]['name'] == 'TV'
+        assert r.json()['top_sellers'] == [
+            {'id': products[2].id, 'name': 'TV', 'units': 2}]
+
+    def test_invalid(self, request_client, user):
+        user.is_staff = True
+        user.save()
+        request_client.force_authenticate(user)
+        r = request_client.get(f'{self.api_path}?days=0')
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,209 @@
+# General
+import pytest
+import threading
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from rest_framework import status
+from rest_framework.test import APIClient
+
+# Opply
+from exceptions import ProductOutOfStockException
+from store import availability, stock
+from store.models import Product, OrderProducts, StockShard
+
+
+@pytest.fixture
+def product():
+    product = Product(name='Computer', price=2234.56, quantity_in_stock=5)
+    product.save()
+    return product
+
+
+@pytest.mark.django_db
+class TestReserve:
+    def test_reserve(self, product):
+        with transaction.atomic():
+            stock.reserve({product.id: 3})
+        product.refresh_from_db()
+        assert product.quantity_in_stock == 2
+
+    def test_shortfall(self, product):
+        with pytest.raises(ProductOutOfStockException):
+            with transaction.atomic():
+                stock.reserve({product.id: 6})
+        product.refresh_from_db()
+        assert product.quantity_in_stock == 5
+
+    def test_partial_shortfall_rolls_back(self, product):
+        other = Product(name='Chair', price=56, quantity_in_stock=1)
+        other.save()
+        with pytest.raises(ProductOutOfStockException):
+            with transaction.atomic():
+                stock.reserve({product.id: 1, other.id: 2})
+        product.refresh_from_db()
+        assert product.quantity_in_stock == 5
+
+    def test_missing_product(self, product):
+        with pytest.raises(Product.DoesNotExist):
+            with transaction.atomic():
+                stock.reserve({product.id: 1, product.id + 1: 1})
+
+    def test_stats(self, product):
+        stock.stats.reset()
+        with transaction.atomic():
+            stock.reserve({product.id: 2})
+        with pytest.raises(ProductOutOfStockException):
+            with transaction.atomic():
+                stock.reserve({product.id: 4})
+        snapshot = stock.stats.snapshot()
+        assert snapshot['reservations'] == 1
+        assert snapshot['rejections'] == 1
+        assert snapshot['units'] == 2
+        assert snapshot['lock_wait_seconds'] > 0
+
+
+def shard_quantities(product):
+    return list(StockShard.objects.filter(product=product)
+                                  .order_by('slot')
+                                  .values_list('quantity', flat=True))
+
+
+@pytest.mark.django_db
+class TestShardedStock:
+    @pytest.fixture(autouse=True)
+    def sharding(self, settings):
+        settings.STOCK_SHARDING = True
+
+    def test_rebalance(self, product):
+        stock.rebalance(product.id, 3)
+        product.refresh_from_db()
+        assert product.quantity_in_stock == 0
+        assert shard_quantities(product) == [2, 2, 1]
+
+        stock.rebalance(product.id, 0)
+        product.refresh_from_db()
+        assert product.quantity_in_stock == 5
+        assert shard_quantities(product) == []
+
+    def test_reserve(self, product):
+        stock.rebalance(product.id, 2)
+        with transaction.atomic():
+            stock.reserve({product.id: 2})
+        assert sum(shard_quantities(product)) == 3
+        assert availability.get_availability([product.id]) == \
+            {product.id: 3}
+
+    def test_reserve_across_shards(self, product):
+        """ No one shard has the units, but between them they do.
+        """
+        stock.rebalance(product.id, 5)
+        with transaction.atomic():
+            stock.reserve({product.id: 4})
+        assert sum(shard_quantities(product)) == 1
+
+    def test_shortfall(self, product):
+        stock.rebalance(product.id, 5)
+        with pytest.raises(ProductOutOfStockException):
+            with transaction.atomic():
+                stock.reserve({product.id: 6})
+        assert shard_quantities(product) == [1] * 5
+
+    def test_mixed_order(self, product):
+        other = Product(name='Chair', price=56, quantity_in_stock=1)
+        other.save()
+        stock.rebalance(product.id, 2)
+        with transaction.atomic():
+            stock.reserve({product.id: 1, other.id: 1})
+        other.refresh_from_db()
+        assert other.quantity_in_stock == 0
+        assert sum(shard_quantities(product)) == 4
+
+    def test_product_view(self, request_client, product):
+        request_client.force_authenticate(
+            User.objects.create_user(username='test_user'))
+        stock.rebalance(product.id, 2)
+        r = request_client.get(f'/store/products/{product.id}')
+        assert r.json()['quantity_in_stock'] == 5
+        r = request_client.get(f'/store/products/{product.id}?format=api')
+        assert b'&quot;quantity_in_stock&quot;: 5' in r.content
+
+    def test_command(self, product):
+        call_command('rebalance_stock', product.id, shards=4)
+        assert shard_quantities(product) == [2, 1, 1, 1]
+        StockShard.objects.filter(product=product, slot=0).update(quantity=0)
+        call_command('rebalance_stock', all=True)
+        assert shard_quantities(product) == [1, 1, 1, 0]
+
+    def test_sharding_off(self, product, settings):
+        settings.STOCK_SHARDING = False
+        with pytest.raises(CommandError):
+            call_command('rebalance_stock', product.id, shards=4)
+        assert shard_quantities(product) == []
+
+        # The stock can still be moved back out of the slots
+        stock.rebalance(product.id, 2)
+        call_command('rebalance_stock', product.id, shards=0)
+        assert shard_quantities(product) == []
+        product.refresh_from_db()
+        assert product.quantity_in_stock == 5
+
+    def test_admin(self, admin_client, product, settings):
+        settings.STOCK_SHARDING = False
+        r = admin_client.post('/admin/store/product/', follow=True, data={
+            'action': 'rebalance_stock', '_selected_action': [product.id]})
+        assert b'Stock sharding is off' in r.content
+        assert shard_quantities(product) == []
+
+        settings.STOCK_SHARDING = True
+        admin_client.post('/admin/store/product/', data={
+            'action': 'rebalance_stock', '_selected_action': [product.id]})
+        assert len(shard_quantities(product)) == settings.STOCK_SHARDS
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentOrders:
+    """ Many buyers racing for the same few units of stock
+        through the API, each in its own thread and db
+        connection. Exactly the units in stock must be sold.
+    """
+    threads = 8
+    orders_per_thread = 5
+
+    def test_outside_transaction(self, product):
+        with pytest.raises(RuntimeError):
+            stock.reserve({product.id: 1})
+
+    @pytest.mark.parametrize('shards', [0, 3])
+    def test_no_overselling(self, product, shards, settings):
+        settings.STOCK_SHARDING = True
+        stock.rebalance(product.id, shards)
+        user = User.objects.create_user(username='test_user',
+                                        password='test_password')
+        barrier = threading.Barrier(self.threads)
+        results = []
+
+        def buy():
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                for _ in range(self.orders_per_thread):
+                    r = client.post('/store/orders', format='json',
+                                    data={'products': [product.id]})
+                    results.append(r.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy)
+                   for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert availability.get_availability([product.id]) == {product.id: 0}
+        assert results.count(status.HTTP_201_CREATED) == 5
+        assert results.count(status.HTTP_400_BAD_REQUEST) == \
+            self.threads * self.orders_per_thread - 5
+        assert OrderProducts.objects.filter(product=product).count() == 5
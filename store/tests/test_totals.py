@@ -0,0 +1,197 @@
+# General
+import json
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from types import SimpleNamespace
+import pytest
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+
+# Opply
+from store import catalogue, orders, sales
+from store.models import ArchivedOrder, Order, OrderProducts, Product
+
+
+@pytest.fixture
+def user():
+    return User.objects.create_user(username='test_user',
+                                    password='test_password')
+
+
+@pytest.fixture
+def products():
+    Product(name='Computer', price=2234.56, quantity_in_stock=33).save()
+    Product(name='Chair', price=56, quantity_in_stock=21).save()
+    Product(name='TV', price='345.11', quantity_in_stock=3).save()
+    return Product.objects.order_by('id')
+
+
+def unit_prices(order):
+    return dict(OrderProducts.objects.filter(order=order)
+                                     .values_list('product_id', 'unit_price'))
+
+
+@pytest.mark.django_db
+class TestTotals:
+
+    def test_place(self, user, products):
+        computer, chair, tv = products
+        order = orders.place(user, {computer.id: 2, chair.id: 1})
+        assert order.total == Decimal('4525.12')
+        assert order.item_count == 3
+        assert unit_prices(order) == {computer.id: Decimal('2234.56'),
+                                      chair.id: Decimal('56.00')}
+
+        # Later price changes don't change what was paid
+        Product.objects.filter(id=computer.id).update(price=1)
+        order.refresh_from_db()
+        assert order.total == Decimal('4525.12')
+        assert unit_prices(order)[computer.id] == Decimal('2234.56')
+
+    def test_place_batch(self, user, products):
+        computer, chair, tv = products
+        results = orders.place_batch(user, [{computer.id: 1},
+                                            {chair.id: 2, tv.id: 1}])
+        assert [(order.total, order.item_count)
+                for result, order in results] == \
+            [(Decimal('2234.56'), 1), (Decimal('457.11'), 3)]
+        order = Order.objects.get(id=results[1][1].id)
+        assert order.total == Decimal('457.11')
+        assert unit_prices(order) == {chair.id: Decimal('56.00'),
+                                      tv.id: Decimal('345.11')}
+
+    def test_enqueue(self, user, products):
+        computer, chair, tv = products
+        order = orders.enqueue(user, {tv.id: 2})
+        Product.objects.filter(id=tv.id).update(price=1)
+        orders.process_pending()
+        order.refresh_from_db()
+        assert order.status == Order.CONFIRMED
+        assert order.total == Decimal('690.22')
+
+    def test_backfill(self, user, products):
+        computer, chair, tv = products
+        order = Order.objects.create(user=user)
+        OrderProducts.objects.create(order=order, product=computer,
+                                     quantity=2)
+        OrderProducts.objects.create(order=order, product=tv, quantity=1)
+        empty = Order.objects.create(user=user)
+        placed = orders.place(user, {chair.id: 1})
+        Product.objects.filter(id=chair.id).update(price=1)
+        ArchivedOrder.objects.create(id=10 ** 9, user=user,
+                                     datetime=timezone.now(),
+                                     status=Order.CONFIRMED,
+                                     lines=[[chair.id, 3], [10 ** 9, 1]])
+
+        migration = import_module('store.migrations.0016_order_totals')
+        # It only needs the schema editor's connection, sqlite's
+        # can't be had inside the test's transaction
+        migration.backfill_totals(apps, SimpleNamespace(connection=connection))
+
+        order.refresh_from_db()
+        assert order.total == Decimal('4814.23')
+        assert order.item_count == 3
+        assert unit_prices(order)[tv.id] == Decimal('345.11')
+        empty.refresh_from_db()
+        assert (empty.total, empty.item_count) == (0, 0)
+        # Left as it was placed
+        placed.refresh_from_db()
+        assert placed.total == Decimal('56.00')
+        archived = ArchivedOrder.objects.get()
+        assert archived.lines == [[chair.id, 3, '1.00'], [10 ** 9, 1, None]]
+        assert (archived.total, archived.item_count) == (Decimal('3.00'), 4)
+
+
+@pytest.mark.django_db
+class TestTotalsView:
+
+    @pytest.fixture(autouse=True)
+    def authenticate(self, request_client, user):
+        request_client.force_authenticate(user)
+
+    @pytest.mark.parametrize('fast', [False, True])
+    def test_orders(self, request_client, settings, user, products, fast):
+        settings.FAST_SERIALIZATION = fast
+        computer, chair, tv = products
+        r = request_client.post('/store/orders', format='json',
+                                data={'products': [chair.id, chair.id,
+                                                   tv.id]})
+        assert r.json()['total'] == '457.11'
+        assert r.json()['item_count'] == 3
+        # From before totals were kept
+        Order.objects.create(user=user)
+
+        r = request_client.get('/store/orders')
+        assert [(order['total'], order['item_count'])
+                for order in r.json()['results']] == \
+            [(None, None), ('457.11', 3)]
+
+    def test_same_fast_and_slow(self, request_client, settings, user,
+                                products):
+        computer, chair, tv = products
+        orders.place(user, {computer.id: 3})
+        Order.objects.create(user=user)
+        responses = []
+        for fast in (False, True):
+            settings.FAST_SERIALIZATION = fast
+            catalogue.bump()
+            responses.append(request_client.get('/store/orders').content)
+        assert responses[0] == responses[1]
+        assert json.loads(responses[1])['results'][1]['total'] == '6703.68'
+
+
+@pytest.mark.django_db
+class TestSpendingReport:
+    api_path = '/store/reports/spending'
+
+    def test_top_spenders(self, user, products):
+        computer, chair, tv = products
+        other = User.objects.create_user(username='other')
+        orders.place(user, {chair.id: 2})
+        orders.place(user, {tv.id: 1})
+        orders.place(other, {computer.id: 1})
+        Order.objects.filter(id=orders.place(user, {chair.id: 1}).id) \
+                     .update(status=Order.REJECTED)
+        Order.objects.filter(id=orders.place(other, {chair.id: 1}).id) \
+                     .update(datetime=timezone.now() - timedelta(days=7))
+
+        with CaptureQueriesContext(connection) as queries:
+            report = sales.top_spenders(days=7)
+        assert not any('store_orderproducts' in query['sql']
+                       for query in queries.captured_queries)
+        assert report == {
+            'customers': [
+                {'user': other.id, 'orders': 1, 'units': 1,
+                 'spent': '2234.56'},
+                {'user': user.id, 'orders': 2, 'units': 3,
+                 'spent': '457.11'},
+            ],
+            'all': {'orders': 3, 'units': 4, 'spent': '2691.67'},
+        }
+        assert sales.top_spenders(days=7, limit=1)['customers'][0]['user'] \
+            == other.id
+
+    def test_nothing(self):
+        assert sales.top_spenders() == {
+            'customers': [], 'all': {'orders': 0, 'units': 0,
+                                     'spent': '0.00'}}
+
+    def test_staff_only(self, request_client, user, products):
+        request_client.force_authenticate(user)
+        r = request_client.get(self.api_path)
+        assert r.status_code == status.HTTP_403_FORBIDDEN
+
+        user.is_staff = True
+        user.save()
+        orders.place(user, {products[1].id: 2})
+        r = request_client.get(f'{self.api_path}?days=30&limit=5')
+        assert r.status_code == status.HTTP_200_OK
+        assert r.json()['customers'] == [{'user': user.id, 'orders': 1,
+                                          'units': 2, 'spent': '112.00'}]
+        r = request_client.get(f'{self.api_path}?days=0')
+        assert r.status_code == status.HTTP_400_BAD_REQUEST
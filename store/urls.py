@@ -1,11 +1,36 @@
+from django.conf import settings
 from django.urls import path
 
-from .views import ProductViewSet, OrderViewSet
+from . import async_views
+from .views import (ProductViewSet, OrderViewSet, StockReportView,
+                    SpendingReportView, MetricsView)
 
 urlpatterns = [
     path('products', ProductViewSet.as_view({'get': 'list'})),
     path('products/<int:pk>', ProductViewSet.as_view({'get': 'retrieve'})),
+    path('products/availability',
+         ProductViewSet.as_view({'get': 'availability'})),
     path('orders', OrderViewSet.as_view({'get': 'list', 'post': 'create'})),
     path('orders/<int:pk>', OrderViewSet.as_view({'get': 'retrieve'})),
+    path('orders/export', OrderViewSet.as_view({'get': 'export'})),
+    path('orders/batch', OrderViewSet.as_view({'post': 'batch'})),
+    path('orders/<int:pk>/status',
+         OrderViewSet.as_view({'get': 'order_status'}),
+         name='order-status'),
+    path('reports/stock', StockReportView.as_view()),
+    path('reports/spending', SpendingReportView.as_view()),
+    path('metrics', MetricsView.as_view()),
 
 ]
+
+# Native async views at the same URLs, see async_views, they hand
+# anything they don't serve themselves to the views above.
+async_urlpatterns = [
+    path('products', async_views.product_list),
+    path('products/<int:pk>', async_views.product_detail),
+    path('orders', async_views.order_list),
+    path('orders/<int:pk>', async_views.order_detail),
+] + urlpatterns
+
+if settings.ASYNC_VIEWS:
+    urlpatterns = async_urlpatterns
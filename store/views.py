@@ -1,28 +1,362 @@
 # General
-from rest_framework import viewsets
-from rest_framework.permissions import IsAuthenticated
-from rest_authtoken.auth import AuthTokenAuthentication
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.urls import reverse
+from rest_framework import status, viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import (SAFE_METHODS, IsAdminUser,
+                                        IsAuthenticated)
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 # Opply
+from . import (archive, availability, catalogue, export, idempotency,
+               orders, replicas, sales)
+from .authentication import CachingAuthTokenAuthentication, tokens
+from .metrics import metrics
 from .models import Product, Order
-from .serializers import ProductSerializer, OrderSerializer
+from .pagination import KeysetPaginationMixin
+from .renderers import FastJSONRenderer, PrometheusRenderer
+from .serializers import (ProductSerializer, ProductRowSerializer,
+                          ProductFilterSerializer, OrderSerializer,
+                          OrderRowSerializer, OrderBatchSerializer,
+                          OrderExportSerializer, SpendingReportSerializer,
+                          StockReportSerializer)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+class ReplicaReadMixin:
+    """ View mixin sending the database reads of replica_actions
+        to a read replica, if there are any, see store.replicas.
+
+        Users who've just written something, with any other method
+        than GET, HEAD or OPTIONS, are pinned to the primary for a
+        while, so they read what they've written, e.g. the order
+        they've just placed, see replicas.pin.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.replica_actions:
+            self.replica_token = replicas.start_reading(request.user)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, 'replica_token', None)
+        if token is not None:
+            replicas.stop_reading(token)
+            self.replica_token = None
+        if request.method not in SAFE_METHODS \
+                and response.status_code < 400:
+            replicas.pin(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class RowSerializationMixin:
+    """ View mixin for list and retrieve to read rows, rather than
+        model instances, and serialize them with row_serializer,
+        see store.rows, with settings.FAST_SERIALIZATION.
+    """
+    row_serializer = None
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
+
+    def get_rows(self):
+        return self.row_serializer.values(
+            self.filter_queryset(self.get_queryset()))
+
+    def list(self, request, *args, **kwargs):
+        if not settings.FAST_SERIALIZATION:
+            return super().list(request, *args, **kwargs)
+        rows = self.get_rows()
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.row_serializer.many(page))
+        return Response(self.row_serializer.many(rows))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.FAST_SERIALIZATION:
+            return super().retrieve(request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(
+            self.get_rows(),
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(request, row)
+        return Response(self.row_serializer.one(row))
+
+
+class ProductViewSet(ReplicaReadMixin, RowSerializationMixin,
+                     KeysetPaginationMixin, viewsets.ModelViewSet):
+    queryset = Product.objects.order_by('id')
     serializer_class = ProductSerializer
-    authentication_classes = (AuthTokenAuthentication, )
+    row_serializer = ProductRowSerializer()
+    authentication_classes = (CachingAuthTokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    keyset_ordering = ('id', )
+    max_availability_ids = 1000
+
+    def get_queryset(self):
+        return super().get_queryset().with_stock()
 
+    def get_filters(self):
+        if not hasattr(self, '_filters'):
+            serializer = ProductFilterSerializer(
+                data=self.request.query_params)
+            serializer.is_valid(raise_exception=True)
+            self._filters = serializer.validated_data
+        return self._filters
 
-class OrderViewSet(viewsets.ModelViewSet):
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list':
+            queryset = queryset.search(**self.get_filters())
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """ The products, filtered by the query parameters, see
+            ProductFilterSerializer.
+
+            Note: Which products are in stock changes with every
+                  order, so those lists aren't cached, see
+                  catalogue.cached_response.
+        """
+        if self.get_filters().get('in_stock'):
+            return super().list(request, *args, **kwargs)
+        return catalogue.cached_response(
+            request, lambda: super(ProductViewSet, self).list(
+                request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return catalogue.cached_response(
+            request, lambda: super(ProductViewSet, self).retrieve(
+                request, *args, **kwargs))
+
+    def availability(self, request, *args, **kwargs):
+        """ The stock of a batch of products, e.g.
+            /store/products/availability?ids=1,2,3
+
+            Note: Stock is only cached briefly, and so is the
+                  response, unlike the rest of the catalogue.
+        """
+        try:
+            ids = [int(pk) for pk in
+                   request.query_params.get('ids', '').split(',') if pk]
+        except ValueError:
+            raise ValidationError({'ids': 'Expected a comma separated '
+                                          'list of product ids.'})
+        if len(ids) > self.max_availability_ids:
+            raise ValidationError({'ids': f'At most '
+                                          f'{self.max_availability_ids} '
+                                          f'ids at a time.'})
+
+        stock = availability.get_availability(ids)
+        response = Response([{'id': pk, 'quantity_in_stock': stock[pk]}
+                             for pk in sorted(stock)])
+        patch_cache_control(response, private=True,
+                            max_age=settings.AVAILABILITY_CACHE_TIMEOUT)
+        return response
+
+
+class OrderViewSet(ReplicaReadMixin, RowSerializationMixin,
+                   KeysetPaginationMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
-    authentication_classes = (AuthTokenAuthentication, )
+    row_serializer = OrderRowSerializer()
+    authentication_classes = (CachingAuthTokenAuthentication, )
     permission_classes = (IsAuthenticated, )
+    keyset_ordering = ('-datetime', '-id')
 
     def get_queryset(self):
-        return self.queryset.filter(user=self.request.user).order_by('-datetime')
+        return (self.queryset.filter(user=self.request.user)
+                             .with_product_ids()
+                             .order_by(*self.keyset_ordering))
 
     def get_serializer_context(self):
-        return {'user': self.request.user}
+        return {'user': self.request.user,
+                'async': self.is_async(self.request)}
+
+    @staticmethod
+    def is_async(request):
+        """ Clients opt in to asynchronous orders with the header
+            Prefer: respond-async, see RFC 7240.
+        """
+        prefer = request.headers.get('Prefer', '')
+        return 'respond-async' in (token.strip().lower()
+                                   for token in prefer.split(','))
+
+    def retrieve(self, request, *args, **kwargs):
+        """ An order, or, once it's been archived, the archived
+            order, in the same form, see archive.find.
+        """
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            order = archive.find(request.user, self.kwargs['pk'])
+            if order is None:
+                raise
+            return Response(OrderSerializer(order).data)
+
+    def create(self, request, *args, **kwargs):
+        """ Place an order, or accept it to be placed shortly,
+            with a 202 and where to poll for its status.
+
+            Orders with an Idempotency-Key header are placed once
+            per key, retries get the first response again, see
+            idempotency.respond_once.
+        """
+        key = idempotency.get_key(request)
+        if key is None:
+            return self.place(request, *args, **kwargs)
+        return idempotency.respond_once(
+            request, key, lambda: self.place(request, *args, **kwargs))
+
+    def place(self, request, *args, **kwargs):
+        if not self.is_async(request):
+            return super().create(request, *args, **kwargs)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order = serializer.save()
+        location = reverse('order-status', kwargs={'pk': order.id})
+        return Response({'id': order.id, 'status': order.status},
+                         status=status.HTTP_202_ACCEPTED,
+                         headers={'Location': location,
+                                  'Preference-Applied': 'respond-async'})
+
+    def batch(self, request, *args, **kwargs):
+        """ Place a batch of orders in one go, see
+            OrderBatchSerializer and orders.place_batch, with the
+            result of each order:
+
+                {"result": "created", "order": {...}}
+                {"result": "out_of_stock", "products": [2]}
+                {"result": "invalid", "products": [999]}
+                {"result": "not_placed"}
+
+            It's a 201 when every order is placed. Otherwise, in
+            all_or_nothing mode nothing is and it's a 400, in
+            best_effort mode those that could be are and it's a 200.
+        """
+        key = idempotency.get_key(request)
+        if key is None:
+            return self.place_batch(request)
+        return idempotency.respond_once(
+            request, key, lambda: self.place_batch(request))
+
+    def place_batch(self, request):
+        serializer = OrderBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        mode = serializer.validated_data['mode']
+        results = orders.place_batch(
+            request.user, serializer.validated_data['orders'],
+            all_or_nothing=mode == OrderBatchSerializer.ALL_OR_NOTHING)
+
+        data = []
+        for result, detail in results:
+            if result == orders.CREATED:
+                data.append({'result': result,
+                             'order': OrderSerializer(detail).data})
+            elif detail is None:
+                data.append({'result': result})
+            else:
+                data.append({'result': result, 'products': detail})
+        created = sum(result == orders.CREATED for result, _ in results)
+
+        if created == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif mode == OrderBatchSerializer.ALL_OR_NOTHING:
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_200_OK
+        return Response({'mode': mode, 'created': created, 'results': data},
+                        status=response_status)
+
+    def order_status(self, request, *args, **kwargs):
+        """ The status of an order, pending, confirmed or
+            rejected, for polling asynchronous orders.
+        """
+        order = self.get_object()
+        return Response({'id': order.id, 'status': order.status})
+
+    def export(self, request, *args, **kwargs):
+        """ Stream the order history as NDJSON, one order per line,
+            or CSV, one order line per row, see export.export_orders.
+
+            Note: Under ASGI it's spooled to a file first, then
+                  streamed from that, see export.spool, so nothing
+                  is sent until it's all been read.
+        """
+        serializer = OrderExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        filters = dict(serializer.validated_data)
+        output = filters.pop('output')
+        if not request.user.is_staff:
+            filters['user'] = request.user.id
+
+        chunks = export.export_orders(output, **filters)
+        content_type = export.CONTENT_TYPES[output]
+        if isinstance(request._request, ASGIRequest):
+            return FileResponse(export.spool(chunks), as_attachment=True,
+                                filename=f'orders.{output}',
+                                content_type=content_type)
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response.headers['Content-Disposition'] = \
+            f'attachment; filename="orders.{output}"'
+        return response
+
+
+class StockReportView(APIView):
+    """ The products low on stock and the top sellers, for staff,
+        e.g. /store/reports/stock?threshold=10&days=30
+
+        Note: Sales are read from ProductSales, so this takes the
+              same time however many orders there are.
+    """
+    authentication_classes = (CachingAuthTokenAuthentication, )
+    permission_classes = (IsAdminUser, )
+
+    def get(self, request, *args, **kwargs):
+        serializer = StockReportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+        return Response({
+            'low_stock': sales.low_stock(options.get('threshold'),
+                                         options.get('days'),
+                                         options.get('limit')),
+            'top_sellers': sales.top_sellers(options.get('days'),
+                                             options.get('limit')),
+        })
+
+
+class SpendingReportView(APIView):
+    """ The customers who spent the most, for staff, e.g.
+        /store/reports/spending?days=30&limit=10
+
+        Note: It's read from the orders' totals, see
+              sales.top_spenders, so no order lines are read.
+    """
+    authentication_classes = (CachingAuthTokenAuthentication, )
+    permission_classes = (IsAdminUser, )
+
+    def get(self, request, *args, **kwargs):
+        serializer = SpendingReportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+        return Response(sales.top_spenders(options.get('days'),
+                                           options.get('limit')))
+
+
+class MetricsView(APIView):
+    """ The request metrics of this process, and the hits and misses
+        of its token cache, for staff, in the prometheus text format,
+        or as JSON with ?format=json.
+    """
+    authentication_classes = (CachingAuthTokenAuthentication, )
+    permission_classes = (IsAdminUser, )
+    renderer_classes = (PrometheusRenderer, JSONRenderer)
+
+    def get(self, request, *args, **kwargs):
+        return Response({**metrics.snapshot(),
+                         'token_cache': tokens.snapshot()})
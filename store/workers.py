@@ -0,0 +1,65 @@
+# General
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """ In process thread pool working through the pending
+        orders, see orders.process_pending.
+
+        Workers are woken when an order is enqueued and drain the
+        pending orders in batches until there are none left, at
+        most settings.ORDER_WORKERS of them at once.
+
+        Note: No broker is needed, the pending orders are rows of
+              the order table, so the pool is just a way of getting
+              to them quickly. manage.py process_orders works
+              through them too, e.g. after a restart.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._running = 0
+        self._woken = False
+
+    def wake(self):
+        with self._lock:
+            if self._running >= settings.ORDER_WORKERS:
+                # A running worker will go round again
+                self._woken = True
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.ORDER_WORKERS,
+                    thread_name_prefix='orders')
+            self._running += 1
+        self._executor.submit(self._drain)
+
+    def _drain(self):
+        from .orders import process_pending
+
+        try:
+            while True:
+                with self._lock:
+                    self._woken = False
+                while process_pending():
+                    pass
+                with self._lock:
+                    if not self._woken:
+                        self._running -= 1
+                        return
+        except Exception:
+            logger.exception('Failed processing pending orders')
+            with self._lock:
+                self._running -= 1
+        finally:
+            connections.close_all()
+
+
+pool = WorkerPool()